@@ -1,12 +1,21 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, g, request, jsonify, redirect, send_file, send_from_directory
 from flask_cors import CORS
 import os
 import shutil
+import re
+import json
+import stat
+import mimetypes
+import heapq
+import base64
+import hashlib
 from datetime import datetime
 from pathlib import Path
+from urllib.parse import quote
 import logging
-from concurrent.futures import ThreadPoolExecutor
 from functools import partial, lru_cache
+from operator import attrgetter
+from array import array
 import threading
 import time
 from flask_limiter import Limiter
@@ -14,16 +23,37 @@
 import getpass
 import ctypes
 import sys
+import cProfile
 from config import get_config
+from file_index import FileIndex, VALID_EXTENSIONS
+from scanner import ParallelScanner
+from indexer import IndexerThread, IndexFollower
+from search_index import NameIndexCache
+from versions import VersionParser
+from copy_jobs import CopyJobManager
+from archive import stream_zip
+import bom
+from model_cache import ArtifactCache, ModelCache
+from mesh import lod_builder, lod_counts, stl_triangle_count
+from geometry import GeometryIndexer, parse_filters, matches_filters, geometry_to_dict
+from thumbnails import ThumbnailStore
+from duplicates import DuplicateIndexer, DuplicateClusters, KINDS as DUPLICATE_KINDS
+from drives import DriveProber, DriveUnavailableError
+from query_cache import QueryCache
+from metrics import REGISTRY, REQUEST_SECONDS, SEARCH_SECONDS, SEARCH_CACHE, STAT_CALLS, MODEL_BYTES, gauge
 
 # Initialize configuration
 config_class = get_config()
 config_instance = config_class()
-config_instance.validate_directories()
+# Unreachable network drives can take minutes to time out, so startup doesn't wait for them
+threading.Thread(target=config_instance.validate_directories, name='validate-directories', daemon=True).start()
 
 app = Flask(__name__, static_folder='../frontend')
 CORS(app)
 
+# Create logs directory if it doesn't exist
+os.makedirs(os.path.join(os.path.dirname(__file__), 'logs'), exist_ok=True)
+
 # Configure logging
 logging.basicConfig(
     level=logging.DEBUG if app.config.get('DEBUG', False) else logging.INFO,
@@ -37,12 +67,57 @@
 # Configure base directories for different categories from config
 DIRECTORIES = config_instance.DIRECTORIES
 
-# Create logs directory if it doesn't exist
-os.makedirs(os.path.join(os.path.dirname(__file__), 'logs'), exist_ok=True)
+# Load the persistent file index so searches don't have to walk the network drives
+file_index = FileIndex(config_instance.INDEX_PATH, scanner=ParallelScanner(config_instance.INDEX_SCAN_WORKERS))
+file_index.load()
 
-local_data = threading.local()
+# Lowercased names and trigram postings per category, rebuilt once per index change
+default_version_parser = VersionParser(config_instance.VERSION_PATTERNS)
+name_indexes = NameIndexCache(file_index, {
+    category: VersionParser(patterns) if patterns else default_version_parser
+    for category, patterns in config_instance.CATEGORY_VERSION_PATTERNS.items()
+})
+
+# Result sets of recent searches, dropped as soon as the index they came from changes
+search_cache = QueryCache(config_instance.SEARCH_CACHE_MAX_MB * 2 ** 20, config_instance.SEARCH_CACHE_TTL)
+
+# Copies run as background jobs, their state is kept on disk so they can be resumed
+copy_jobs = CopyJobManager(config_instance.COPY_JOBS_DIR, workers=config_instance.COPY_WORKERS)
+
+# Compressed, binary STL copies of viewed models, kept on local disk
+# and shared with the decimated previews
+model_artifacts = ArtifactCache(config_instance.MODEL_CACHE_DIR, config_instance.MODEL_CACHE_MAX_MB * 1024 * 1024)
+model_cache = ModelCache(model_artifacts)
+# Names of the decimated previews being built, requests meanwhile are sent the full model
+lod_builds = set()
+lod_builds_lock = threading.Lock()
+
+# Rendered by the geometry indexer, named by the hash of their content
+thumbnails = ThumbnailStore(config_instance.THUMBNAIL_DIR)
+
+# Cached reachability of the category drives, so requests don't block on a disconnected share
+drive_prober = DriveProber(DIRECTORIES, interval=config_instance.DRIVE_PROBE_INTERVAL,
+                           timeout=config_instance.DRIVE_PROBE_TIMEOUT)
 
-VALID_EXTENSIONS = {'.stl', '.3mf'}
+# Files sharing their content or shape with another file, across all categories
+duplicate_clusters = DuplicateClusters(file_index, DIRECTORIES)
+
+# Background indexer, geometry extraction and content hashing, started next to the server by start_indexer()
+indexer = None
+geometry_indexer = None
+duplicate_indexer = None
+# In multi-process serving, elects the one process running them, see start_index_sync()
+index_follower = None
+
+MAX_FILE_CHECK_PATHS = 1000
+MAX_BOM_LINES = 5000
+# Results listed per BOM line, a part number matching a whole family of files only needs the newest few
+MAX_BOM_FILES_PER_LINE = 50
+
+# Thumbnails are addressed by content, a year is as good as forever
+THUMBNAIL_MAX_AGE = 365 * 24 * 3600
+
+local_data = threading.local()
 
 limiter = Limiter(
     app=app,
@@ -50,62 +125,381 @@
     default_limits=["200 per day", "50 per hour"]
 )
 
-@lru_cache(maxsize=10)
-def get_cached_files(directory):
-    result = []
-    for root, _, files in os.walk(directory):
-        for file in files:
-            if os.path.splitext(file)[1].lower() in VALID_EXTENSIONS:
-                result.append(os.path.join(root, file))
-    return result
+@app.before_request
+def start_request_timer():
+    g.start_time = time.perf_counter()
+    g.profile = None
+    if config_instance.PROFILE_SLOW_REQUESTS_MS:
+        g.profile = cProfile.Profile()
+        try:
+            g.profile.enable()
+        except ValueError:
+            # Another profiler is active on this thread, e.g. a debugger
+            g.profile = None
+
+@app.after_request
+def record_request_time(response):
+    start_time = g.pop('start_time', None)
+    if start_time is None:
+        return response
+    seconds = time.perf_counter() - start_time
+    REQUEST_SECONDS.observe(seconds, request.endpoint or 'none', request.method)
+    profile = g.pop('profile', None)
+    if profile is not None:
+        profile.disable()
+        if seconds * 1000 >= config_instance.PROFILE_SLOW_REQUESTS_MS:
+            dump_profile(profile, seconds)
+    return response
+
+@app.teardown_request
+def stop_profile(error=None):
+    # Requests that raised never reached after_request
+    profile = g.pop('profile', None)
+    if profile is not None:
+        profile.disable()
+
+def dump_profile(profile, seconds):
+    """Write the cProfile data of a slow request to PROFILE_DIR, for pstats or snakeviz"""
+    try:
+        os.makedirs(config_instance.PROFILE_DIR, exist_ok=True)
+        name = f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}-{request.endpoint or 'none'}-{int(seconds * 1000)}ms.prof"
+        path = os.path.join(config_instance.PROFILE_DIR, name)
+        profile.dump_stats(path)
+        app.logger.warning(f"Slow request {request.method} {request.path} took {int(seconds * 1000)}ms, "
+                           f"profile written to {path}")
+    except OSError as e:
+        app.logger.error(f"Could not write request profile: {e}")
+
+def index_changed(category):
+    """Rebuild derived indexes after the indexer changed a category's files"""
+    name_indexes.refresh(category)
+    if geometry_indexer is not None:
+        geometry_indexer.notify(category)
+    if duplicate_indexer is not None:
+        duplicate_indexer.notify(category)
+
+def index_synced(changed):
+    """Rebuild derived indexes after reloading what another process changed in the shared index"""
+    for category in changed:
+        if category in DIRECTORIES:
+            name_indexes.refresh(category)
+    # Only kept current once something asked for the clusters
+    if duplicate_clusters.generation:
+        duplicate_clusters.refresh()
+
+def start_drive_prober():
+    if not drive_prober.is_alive():
+        drive_prober.start()
+
+def start_indexer():
+    """Start the background indexer that keeps the file index current, geometry extraction and hashing"""
+    global indexer, geometry_indexer, duplicate_indexer
+    start_drive_prober()
+    if config_instance.GEOMETRY_WORKERS and (geometry_indexer is None or not geometry_indexer.is_alive()):
+        geometry_indexer = GeometryIndexer(file_index, DIRECTORIES, thumbnails,
+                                           thumbnail_size=config_instance.THUMBNAIL_SIZE,
+                                           workers=config_instance.GEOMETRY_WORKERS)
+        geometry_indexer.start()
+    if config_instance.DUPLICATE_WORKERS and (duplicate_indexer is None or not duplicate_indexer.is_alive()):
+        duplicate_indexer = DuplicateIndexer(file_index, DIRECTORIES, workers=config_instance.DUPLICATE_WORKERS)
+        duplicate_indexer.start()
+    if indexer is None or not indexer.is_alive():
+        indexer = IndexerThread(
+            file_index,
+            DIRECTORIES,
+            max_staleness=config_instance.INDEX_MAX_STALENESS,
+            use_events=config_instance.INDEX_USE_EVENTS,
+            on_change=index_changed
+        )
+        indexer.start()
+    return indexer
+
+def start_index_sync():
+    """Share the file index with the other processes of a multi-worker server.
+
+    One process runs start_indexer(), the others reload the index whenever
+    it changes, see indexer.IndexFollower.
+    """
+    global index_follower
+    start_drive_prober()
+    if index_follower is None:
+        index_follower = IndexFollower(file_index, config_instance.INDEX_PATH + '.lock', start_indexer,
+                                       interval=config_instance.INDEX_SYNC_INTERVAL, on_sync=index_synced)
+        index_follower.start()
+    return index_follower
+
+def stop_indexer():
+    """Stop the background threads started by start_indexer() and start_index_sync()"""
+    for thread in (indexer, geometry_indexer, duplicate_indexer, index_follower, drive_prober):
+        if thread is not None:
+            thread.stop()
+
+def indexing_in_background():
+    """True if this or another server process keeps the index current"""
+    return (indexer is not None and indexer.is_alive()) or \
+        (index_follower is not None and index_follower.is_alive())
+
+def get_name_index(category):
+    """Return the search index for a category.
 
-def search_files(category, search_term, file_type=None, latest_only=False):
-    results = []
+    While the background indexer is running it owns all walking, so a category
+    it has not indexed yet is reported as empty instead of walked inline.
+    """
+    directory = DIRECTORIES[category]
+    if not file_index.is_indexed(category, directory):
+        if not indexing_in_background():
+            drive_prober.check(category)
+            file_index.rebuild(category, directory)
+    return name_indexes.get(category)
+
+def get_cached_files(category):
+    """Return the indexed file paths for a category"""
+    return [entry.path for entry in get_name_index(category).entries]
+
+def split_terms(search_term):
+    """Lowercased terms of a search, one per line or comma separated"""
+    return [term.strip() for term in search_term.lower().replace(',', '\n').split('\n') if term.strip()]
+
+def match_ids(category, search_term, file_type=None):
+    """Return the search index of a category and the ids of files whose name contains any search term.
+
+    Everything, including size and mtime, is answered from the index, so a
+    search makes no filesystem calls once the category has been indexed.
+    """
     base_dir = DIRECTORIES.get(category, '')
+    if not base_dir:
+        app.logger.error(f"Unknown category: {category}")
+        raise ValueError(f"Directory not found or not accessible for category: {category}")
+
+    search_terms = split_terms(search_term)
     
-    app.logger.debug(f"Searching in category: {category}")
-    app.logger.debug(f"Base directory: {base_dir}")
-    app.logger.debug(f"Search term: {search_term}")
-    
-    try:
-        if not base_dir or not os.path.exists(base_dir):
-            app.logger.error(f"Directory not found or not accessible: {base_dir}")
-            raise ValueError(f"Directory not found or not accessible for category: {category}")
+    # Only names containing a search term, found through the trigram index
+    name_index = get_name_index(category)
+    file_ids = name_index.search(search_terms)
+    if file_type:
+        wanted_ext = f'.{file_type.lower()}'
+        entries = name_index.entries
+        file_ids = [file_id for file_id in file_ids if entries[file_id].ext == wanted_ext]
+    return name_index, file_ids
 
-        search_terms = [term.strip() for term in search_term.lower().replace(',', '\n').split('\n') if term.strip()]
-        
-        # Use cached files
-        valid_files = get_cached_files(base_dir)
-        
-        for file_path in valid_files:
-            file_name = os.path.basename(file_path)
-            if any(term in file_name.lower() for term in search_terms):
-                file_ext = os.path.splitext(file_name)[1].lower()
-                if file_type and file_ext != f'.{file_type.lower()}':
-                    continue
-                    
-                results.append({
-                    'path': file_path,
-                    'relative_path': os.path.relpath(file_path, base_dir),
-                    'name': file_name,
-                    'type': file_ext[1:].upper(),
-                    'size': os.path.getsize(file_path),
-                    'modified': os.path.getmtime(file_path)
-                })
+def find_match_ids(category, search_term, file_type=None, latest_only=False, filters=None, collapse=None):
+    """Like match_ids, but reduced to the latest revision of each matched part family if asked.
 
+    filters are geometry checks from geometry.parse_filters(), answered from
+    the geometry stored in the index. collapse is 'content' or 'geometry' to
+    keep only the newest of matched files that are copies of each other.
+    """
+    try:
+        name_index, file_ids = match_ids(category, search_term, file_type)
     except Exception as e:
         app.logger.error(f"Error in search_files: {str(e)}")
         raise
+    if latest_only:
+        file_ids = name_index.latest(file_ids, by_type=bool(file_type))
+    if filters:
+        entries = name_index.entries
+        file_ids = [file_id for file_id in file_ids
+                    if matches_filters(file_index.get_geometry(entries[file_id]), filters)]
+    if collapse:
+        file_ids = collapse_duplicates(name_index.entries, file_ids, collapse)
+    return name_index, file_ids
 
+def collapse_duplicates(entries, file_ids, kind):
+    """Reduce file ids to the newest of each duplicate cluster of a kind, keeping their order"""
+    keys = duplicate_clusters.keys(kind)
+    newest = {}
+    for file_id in file_ids:
+        key = keys.get(entries[file_id].path)
+        if key is not None and (key not in newest or entries[file_id].mtime > entries[newest[key]].mtime):
+            newest[key] = file_id
+    kept = set(newest.values())
+    return [file_id for file_id in file_ids if entries[file_id].path not in keys or file_id in kept]
+
+def rank_matches(category, search_term, file_type=None, latest_only=False, filters=None, collapse=None):
+    """Return the search index of a category and {file id: relevance} of the files matching a search.
+
+    Unlike find_match_ids names only need to come close to a term, see
+    NameIndex.rank(); ranking stops after SEARCH_RANK_BUDGET_MS of CPU time,
+    the third value returned is False if it did.
+    """
+    if category not in DIRECTORIES:
+        raise ValueError(f"Directory not found or not accessible for category: {category}")
+    name_index = get_name_index(category)
+    scores, complete = name_index.rank(split_terms(search_term), config_instance.SEARCH_RANK_BUDGET_MS / 1000)
+    entries = name_index.entries
+    if file_type:
+        wanted_ext = f'.{file_type.lower()}'
+        scores = {file_id: score for file_id, score in scores.items() if entries[file_id].ext == wanted_ext}
     if latest_only:
-        by_name = {}
-        for file in results:
-            name_without_version = file['name'].split('_v')[0]
-            if name_without_version not in by_name or file['modified'] > by_name[name_without_version]['modified']:
-                by_name[name_without_version] = file
-        results = list(by_name.values())
+        scores = name_index.latest_scores(scores, by_type=bool(file_type))
+    if filters:
+        scores = {file_id: score for file_id, score in scores.items()
+                  if matches_filters(file_index.get_geometry(entries[file_id]), filters)}
+    if collapse:
+        scores = {file_id: scores[file_id] for file_id in collapse_duplicates(entries, sorted(scores), collapse)}
+    return name_index, scores, complete
+
+def best_first(name_index, scores, limit=None, offset=0):
+    """Return (entry, score) of the most relevant files, the newest first among equally relevant ones"""
+    entries = name_index.entries
+    return [(entries[file_id], scores[file_id]) for file_id in best_ids(name_index, scores, limit, offset)]
+
+def best_ids(name_index, scores, limit=None, offset=0):
+    """Like best_first, but only the file ids"""
+    mtimes = name_index.mtimes
+    count = offset + min(limit or config_instance.SEARCH_RANK_MAX_RESULTS, config_instance.SEARCH_RANK_MAX_RESULTS)
+    return heapq.nlargest(count, scores, key=lambda file_id: (scores[file_id], mtimes[file_id]))[offset:]
+
+def newest_ids(name_index, file_ids, limit=None, offset=0):
+    """Sort file ids newest first, selecting only the top offset + limit when a limit is given"""
+    if limit is None:
+        return sorted(file_ids, key=name_index.mtimes.__getitem__, reverse=True)[offset:]
+    return heapq.nlargest(offset + limit, file_ids, key=name_index.mtimes.__getitem__)[offset:]
+
+def search_cache_key(category, search_term, file_type, latest_only, filters, collapse, rank=False):
+    """Cache key of a search, the same for searches differing only in term order, case or spacing"""
+    return json.dumps([category, sorted(set(split_terms(search_term))), file_type.lower() if file_type else None,
+                       bool(latest_only), sorted(filters or ()), collapse, bool(rank)])
+
+def search_tag(name_index, filters, collapse):
+    """The index state a search's results depend on, results cached from any other state are stale"""
+    return (name_index.generation, file_index.geometry_generation if filters else None,
+            # Collapsing uses the duplicate clusters being served, rebuilt in the background
+            duplicate_clusters.generation if collapse else None)
+
+def cached_match_ids(category, search_term, file_type=None, latest_only=False, filters=None, collapse=None):
+    """Return the search index of a category, the ids of the files matching a search in index order,
+    and whether they came from the search cache.
+
+    Only the ids are cached, 4 bytes a match, pages are picked from them with newest_ids().
+    """
+    key = search_cache_key(category, search_term, file_type, latest_only, filters, collapse)
+    name_index = get_name_index(category)
+    # Taken before searching, so results of an index changing meanwhile are never reused
+    tag = search_tag(name_index, filters, collapse)
+    file_ids = search_cache.get(key, tag)
+    SEARCH_CACHE.inc(1, 'miss' if file_ids is None else 'hit')
+    if file_ids is not None:
+        return name_index, file_ids, True
+    searched_index, file_ids = find_match_ids(category, search_term, file_type, latest_only, filters, collapse)
+    if searched_index is name_index:
+        file_ids = array('I', file_ids)
+        search_cache.put(key, tag, file_ids, file_ids.itemsize * len(file_ids))
+    return searched_index, file_ids, False
+
+def cached_ranking(category, search_term, file_type=None, latest_only=False, filters=None, collapse=None):
+    """Return (entry, score) of the best SEARCH_RANK_MAX_RESULTS matches of a ranked search, the number of
+    matches, whether ranking completed within its budget, and whether all that came from the search cache"""
+    key = search_cache_key(category, search_term, file_type, latest_only, filters, collapse, rank=True)
+    name_index = get_name_index(category)
+    tag = search_tag(name_index, filters, collapse)
+    cached = search_cache.get(key, tag)
+    SEARCH_CACHE.inc(1, 'miss' if cached is None else 'hit')
+    if cached is not None:
+        file_ids, scores, matched = cached
+        entries = name_index.entries
+        return [(entries[file_id], score) for file_id, score in zip(file_ids, scores)], matched, True, True
+    ranked_index, scores, complete = rank_matches(category, search_term, file_type, latest_only, filters, collapse)
+    file_ids = array('I', best_ids(ranked_index, scores, config_instance.SEARCH_RANK_MAX_RESULTS))
+    best_scores = array('d', (scores[file_id] for file_id in file_ids))
+    # A ranking cut short by its budget is not kept, the next search may have time to complete it
+    if ranked_index is name_index and complete:
+        search_cache.put(key, tag, (file_ids, best_scores, len(scores)),
+                         file_ids.itemsize * len(file_ids) + best_scores.itemsize * len(best_scores))
+    entries = ranked_index.entries
+    return [(entries[file_id], score) for file_id, score in zip(file_ids, best_scores)], len(scores), complete, False
+
+def parse_collapse(value):
+    """Return the duplicate kind a collapseDuplicates search field asks for, None for no collapsing"""
+    if value in (None, False, ''):
+        return None
+    if value is True:
+        return 'content'
+    if value not in DUPLICATE_KINDS:
+        raise ValueError(f"collapseDuplicates must be true, false or one of {', '.join(DUPLICATE_KINDS)}")
+    return value
 
-    return sorted(results, key=lambda x: x['modified'], reverse=True)
+def find_matches(category, search_term, file_type=None, latest_only=False, filters=None, collapse=None):
+    """Return the indexed entries matching a search, unsorted"""
+    name_index, file_ids = find_match_ids(category, search_term, file_type, latest_only, filters, collapse)
+    entries = name_index.entries
+    return [entries[file_id] for file_id in file_ids]
+
+def newest_first(entries, limit=None, offset=0):
+    """Sort entries newest first, selecting only the top offset + limit when a limit is given"""
+    if limit is None:
+        return sorted(entries, key=attrgetter('mtime'), reverse=True)[offset:]
+    return heapq.nlargest(offset + limit, entries, key=attrgetter('mtime'))[offset:]
+
+def to_result(entry, base_dir, duplicates=False):
+    """Build the JSON result for an indexed entry, with its number of copies if duplicates is set"""
+    geometry = file_index.get_geometry(entry)
+    thumbnail = file_index.get_thumbnail(entry)
+    base_prefix = os.path.join(base_dir, '')
+    if entry.path.startswith(base_prefix):
+        relative_path = entry.path[len(base_prefix):]
+    else:
+        relative_path = os.path.relpath(entry.path, base_dir)
+    result = {
+        'path': entry.path,
+        'relative_path': relative_path,
+        'name': entry.name,
+        'type': entry.ext[1:].upper(),
+        'size': entry.size,
+        'modified': entry.mtime,
+        'geometry': geometry and geometry_to_dict(geometry),
+        'thumbnail': thumbnail and f'/api/thumbnail/{thumbnail}',
+    }
+    if duplicates:
+        # Number of other indexed files with the same content and with the same shape
+        result['duplicates'] = duplicate_clusters.copies(entry)
+    return result
+
+def search_files(category, search_term, file_type=None, latest_only=False, limit=None, offset=0,
+                 filters=None, collapse=None, duplicates=False):
+    """Search a category and return result dicts, newest first.
+
+    filters take the same form as the /api/search "filters" field, e.g.
+    {"extent_x": {"max": 200}} for parts less than 200 mm long in X,
+    collapse that of its "collapseDuplicates" field and duplicates that of
+    its "duplicates" field.
+    """
+    matches = find_matches(category, search_term, file_type, latest_only, parse_filters(filters),
+                           parse_collapse(collapse))
+    base_dir = DIRECTORIES[category]
+    return [to_result(entry, base_dir, duplicates) for entry in newest_first(matches, limit, offset)]
+
+def _query_key(category, search_term, file_type, latest_only, filters=None, collapse=None, rank=False):
+    key = json.dumps([category, search_term, file_type, bool(latest_only), filters or None, collapse, rank],
+                     sort_keys=True)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:12]
+
+def encode_cursor(offset, query_key):
+    """Opaque cursor for the next page of a search"""
+    payload = json.dumps({'offset': offset, 'query': query_key}).encode('utf-8')
+    return base64.urlsafe_b64encode(payload).decode('ascii')
+
+def decode_cursor(cursor, query_key):
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        offset = int(payload['offset'])
+    except Exception:
+        raise ValueError('Invalid cursor')
+    if payload.get('query') != query_key or offset < 0:
+        raise ValueError('Cursor does not belong to this search')
+    return offset
+
+def _page_param(data, name, default, minimum=0):
+    value = data.get(name, default)
+    if value is None:
+        return None
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{name} must be an integer')
+    if value < minimum:
+        raise ValueError(f'{name} must be at least {minimum}')
+    return value
 
 def is_admin():
     try:
@@ -138,6 +532,12 @@ def api_search():
         search_term = data.get('searchTerm', '')
         file_type = data.get('fileType')
         latest_only = data.get('latestOnly', False)
+        filters = parse_filters(data.get('filters'))
+        collapse = parse_collapse(data.get('collapseDuplicates'))
+        # Count each result's copies, which needs the duplicate clusters
+        duplicates = bool(data.get('duplicates'))
+        # Most relevant first and typo tolerant, instead of exact matches newest first
+        rank = bool(data.get('rank'))
         
         # Validate required parameters
         if not search_term:
@@ -150,42 +550,212 @@ def api_search():
             app.logger.error(f"Invalid category: {category}")
             return jsonify({'error': f'Invalid category: {category}'}), 400
             
-        # Check if directory exists and is accessible
-        base_dir = DIRECTORIES.get(category)
-        if not os.path.exists(base_dir):
-            app.logger.error(f"Directory not accessible: {base_dir}")
-            return jsonify({'error': 'Network drive not accessible. Please check connection.'}), 500
+        limit = _page_param(data, 'limit', None, minimum=1)
+        offset = _page_param(data, 'offset', 0)
+        query_key = _query_key(category, search_term, file_type, latest_only, data.get('filters'), collapse, rank)
+        if data.get('cursor'):
+            offset = decode_cursor(data['cursor'], query_key)
             
         app.logger.info(f"Starting search in {category} for '{search_term}'")
         start_time = time.time()
         
-        # Get valid files first
-        valid_files = get_cached_files(DIRECTORIES[category])
+        if rank:
+            return ranked_search(category, search_term, file_type, latest_only, filters, collapse, duplicates, limit,
+                                 offset, query_key, start_time)
+
+        if data.get('stream'):
+            # Surface an unreachable, never indexed drive before the stream starts
+            get_name_index(category)
+            return Response(
+                stream_search(category, search_term, file_type, latest_only, filters, collapse, duplicates, limit,
+                              offset, start_time),
+                mimetype='application/x-ndjson'
+            )
         
-        # Then search
-        results = search_files(category, search_term, file_type, latest_only)
+        name_index, file_ids, cache_hit = cached_match_ids(category, search_term, file_type, latest_only, filters,
+                                                           collapse)
+        page = newest_ids(name_index, file_ids, limit, offset)
+        base_dir = DIRECTORIES[category]
+        entries = name_index.entries
+        results = [to_result(entries[file_id], base_dir, duplicates) for file_id in page]
         
         search_time = int((time.time() - start_time) * 1000)
-        app.logger.info(f"Search complete. Found {len(results)} results in {search_time}ms")
+        SEARCH_SECONDS.observe(time.time() - start_time, category)
+        app.logger.info(f"Search complete. Found {len(file_ids)} results in {search_time}ms")
         
+        next_offset = offset + len(page)
+        has_more = limit is not None and next_offset < len(file_ids)
         return jsonify({
             'results': results,
+            'next_cursor': encode_cursor(next_offset, query_key) if has_more else None,
             'stats': {
-                'total_files': len(valid_files),
-                'matched_files': len(results),
-                'search_time_ms': search_time
+                'total_files': len(get_name_index(category)),
+                'matched_files': len(file_ids),
+                'returned': len(results),
+                'offset': offset,
+                'search_time_ms': search_time,
+                'cache': search_cache_stats(cache_hit),
+                'duplicates_ready': duplicates_ready(collapse, duplicates),
+                # Results still come from the index, opening them will fail until the drive is back
+                'drive_available': drive_prober.is_available(category)
             }
         })
             
+    except DriveUnavailableError as e:
+        app.logger.error(str(e))
+        return jsonify({'error': 'Network drive not accessible. Please check connection.'}), 503
     except ValueError as e:
         app.logger.error(f"Value Error: {str(e)}")
         return jsonify({'error': str(e)}), 400
+    except FileNotFoundError as e:
+        # Only raised when a category that was never indexed can't be walked
+        app.logger.error(f"Directory not accessible: {str(e)}")
+        return jsonify({'error': 'Network drive not accessible. Please check connection.'}), 500
     except Exception as e:
         app.logger.error(f"Unexpected error in api_search: {str(e)}")
         return jsonify({'error': 'An unexpected error occurred. Please try again.'}), 500
 
+def search_cache_stats(hit):
+    cache = search_cache.stats()
+    return {'hit': hit, 'hits': cache['hits'], 'misses': cache['misses'], 'entries': cache['entries']}
+
+def duplicates_ready(collapse, duplicates):
+    """Whether a search using the duplicate clusters got them, None for searches not using them"""
+    return duplicate_clusters.ready if collapse or duplicates else None
+
+def ranked_search(category, search_term, file_type, latest_only, filters, collapse, duplicates, limit, offset,
+                  query_key, start_time):
+    """Respond to a ranked search with a page of its most relevant results.
+
+    Pages reach at most SEARCH_RANK_MAX_RESULTS deep, and are never
+    streamed since every candidate is scored before the first is known.
+    """
+    ranked, matched, complete, cache_hit = cached_ranking(category, search_term, file_type, latest_only, filters,
+                                                          collapse)
+    page = ranked[offset:] if limit is None else ranked[offset:offset + limit]
+    base_dir = DIRECTORIES[category]
+    results = [dict(to_result(entry, base_dir, duplicates), score=round(score, 3)) for entry, score in page]
+
+    search_time = int((time.time() - start_time) * 1000)
+    SEARCH_SECONDS.observe(time.time() - start_time, category)
+    app.logger.info(f"Ranked search complete. Scored {matched} results in {search_time}ms")
+
+    next_offset = offset + len(page)
+    has_more = limit is not None and next_offset < len(ranked)
+    return jsonify({
+        'results': results,
+        'next_cursor': encode_cursor(next_offset, query_key) if has_more else None,
+        'stats': {
+            'total_files': len(get_name_index(category)),
+            'matched_files': matched,
+            'returned': len(results),
+            'offset': offset,
+            'search_time_ms': search_time,
+            # False if the CPU budget ran out, results then miss some weaker matches
+            'complete': complete,
+            'cache': search_cache_stats(cache_hit),
+            'duplicates_ready': duplicates_ready(collapse, duplicates),
+            'drive_available': drive_prober.is_available(category)
+        }
+    })
+
+def stream_search(category, search_term, file_type, latest_only, filters, collapse, duplicates, limit, offset,
+                  start_time):
+    """Yield NDJSON lines for a search, one result per line as it is found, then a stats line.
+
+    Results are streamed in index order rather than newest first, since
+    sorting would mean waiting for every match.
+    """
+    base_dir = DIRECTORIES[category]
+    name_index, file_ids = find_match_ids(category, search_term, file_type, latest_only, filters, collapse)
+    matched = returned = 0
+    for file_id in file_ids:
+        entry = name_index.entries[file_id]
+        matched += 1
+        if matched <= offset or (limit is not None and returned >= limit):
+            continue
+        returned += 1
+        yield json.dumps(to_result(entry, base_dir, duplicates)) + '\n'
+    SEARCH_SECONDS.observe(time.time() - start_time, category)
+    yield json.dumps({'stats': {
+        'total_files': len(get_name_index(category)),
+        'matched_files': matched,
+        'returned': returned,
+        'offset': offset,
+        'search_time_ms': int((time.time() - start_time) * 1000),
+        'duplicates_ready': duplicates_ready(collapse, duplicates)
+    }}) + '\n'
+
+@app.route('/api/bom', methods=['POST'])
+@limiter.limit("30 per minute")
+def api_bom():
+    """Resolve the part numbers of a bill of materials to their files and latest revisions.
+
+    Takes JSON with a "parts" list of part numbers, or a multipart upload
+    of a CSV export in "file" (see bom.read_csv), along with "category" and
+    optionally "fileType" and "latestOnly" as for /api/search. Answers one
+    result per input line, in order, found or missing.
+    """
+    try:
+        start_time = time.time()
+        if 'file' in request.files:
+            data = request.form
+            lines = bom.read_csv(request.files['file'].read().decode('utf-8-sig', errors='replace'))
+        else:
+            data = request.get_json(silent=True) or {}
+            parts = data.get('parts')
+            if not isinstance(parts, list) or not all(isinstance(part, str) for part in parts):
+                return jsonify({'error': 'parts must be a list of part numbers, or upload a CSV file'}), 400
+            lines = [(part, None) for part in parts if part.strip()]
+        category = data.get('category', '')
+        if category not in DIRECTORIES:
+            return jsonify({'error': f'Invalid category: {category}'}), 400
+        if len(lines) > MAX_BOM_LINES:
+            return jsonify({'error': f'At most {MAX_BOM_LINES} lines per request'}), 400
+        latest_only = data.get('latestOnly') in (True, 'true', '1')
+
+        name_index = get_name_index(category)
+        base_dir = DIRECTORIES[category]
+        resolved = bom.resolve(name_index, [part for part, _ in lines], data.get('fileType') or None, latest_only)
+        results = []
+        for number, ((part, quantity), line) in enumerate(zip(lines, resolved), 1):
+            matches = line['matches']
+            result = {
+                'line': number,
+                'part': part,
+                'status': 'found' if matches else 'missing',
+                'matched_by': line['matched_by'],
+                'matched_files': len(matches),
+                'files': [to_result(entry, base_dir) for entry in matches[:MAX_BOM_FILES_PER_LINE]],
+                'latest': line['latest'] and to_result(line['latest'], base_dir),
+            }
+            if quantity is not None:
+                result['quantity'] = quantity
+            results.append(result)
+
+        found = sum(result['status'] == 'found' for result in results)
+        search_time = int((time.time() - start_time) * 1000)
+        app.logger.info(f"Resolved BOM of {len(results)} lines in {category}, {found} found, in {search_time}ms")
+        return jsonify({
+            'lines': results,
+            'stats': {
+                'lines': len(results),
+                'found': found,
+                'missing': len(results) - found,
+                'search_time_ms': search_time,
+                'drive_available': drive_prober.is_available(category)
+            }
+        })
+    except DriveUnavailableError as e:
+        app.logger.error(str(e))
+        return jsonify({'error': 'Network drive not accessible. Please check connection.'}), 503
+    except Exception as e:
+        app.logger.error(f"Unexpected error in api_bom: {str(e)}")
+        return jsonify({'error': 'An unexpected error occurred. Please try again.'}), 500
+
 @app.route('/api/copy', methods=['POST'])
 def api_copy():
+    """Start a background job copying the selected files into Downloads/PartFiles_<date>"""
     try:
         data = request.json
         files = data.get('files', [])
@@ -207,59 +777,203 @@ def api_copy():
             except Exception as e:
                 return jsonify({'error': f'Failed to create folder: {str(e)}'}), 500
         
-        results = []
-        for file in files:
-            try:
-                source_path = file['path']
-                if not os.path.exists(source_path):
-                    raise FileNotFoundError(f"Source file not found: {source_path}")
-                    
-                file_name = os.path.basename(source_path)
-                target_path = os.path.join(target_dir, file_name)
-                
-                # Simple copy with overwrite protection
-                if os.path.exists(target_path):
-                    base, ext = os.path.splitext(file_name)
-                    target_path = os.path.join(target_dir, f"{base}_{int(time.time())}{ext}")
-                
-                shutil.copy2(source_path, target_path)
-                results.append({
-                    'file': file_name,
-                    'success': True,
-                    'path': target_path
-                })
-            except Exception as e:
-                results.append({
-                    'file': file.get('name', 'unknown'),
-                    'success': False,
-                    'error': str(e)
-                })
+        sources = [(file['path'], file.get('size')) for file in files if file.get('path')]
+        if not sources:
+            return jsonify({'error': 'No files selected'}), 400
+        job = copy_jobs.create(sources, target_dir)
         
-        successful_copies = sum(1 for r in results if r['success'])
-        if successful_copies == 0:
-            return jsonify({'error': 'No files were copied successfully'}), 500
-            
-        return jsonify({
-            'results': results,
-            'message': f'Successfully copied {successful_copies} files to Downloads/PartFiles_{today}'
-        })
+        return jsonify(dict(
+            job.to_dict(),
+            message=f'Copying {len(sources)} files to Downloads/PartFiles_{today}',
+            status_url=f'/api/copy/{job.id}'
+        )), 202
             
     except Exception as e:
         return jsonify({'error': f'Copy failed: {str(e)}'}), 500
 
+@app.route('/api/copy/<job_id>')
+def copy_progress(job_id):
+    """Report bytes and files copied so far by a copy job"""
+    job = copy_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Copy job not found'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/api/copy/<job_id>/resume', methods=['POST'])
+def resume_copy(job_id):
+    """Resume a failed or interrupted copy job without copying finished files again"""
+    job = copy_jobs.resume(job_id)
+    if job is None:
+        return jsonify({'error': 'Copy job not found'}), 404
+    return jsonify(job.to_dict()), 202
+
+@lru_cache(maxsize=8)
+def _root_prefixes(roots):
+    """Normalized (prefix, category) pairs of the category roots, longest first so nested roots win"""
+    prefixes = [(os.path.normcase(os.path.join(os.path.abspath(root), '')), category)
+                for category, root in roots]
+    return tuple(sorted(prefixes, key=lambda item: len(item[0]), reverse=True))
+
+def root_category(path):
+    """Return the category whose directory contains path, None if it's outside all of them"""
+    full_path = os.path.normcase(os.path.abspath(path))
+    for prefix, category in _root_prefixes(tuple(DIRECTORIES.items())):
+        if full_path.startswith(prefix):
+            return category
+    return None
+
+def is_allowed_path(path):
+    """Check that a path lies inside one of the configured category directories"""
+    return root_category(path) is not None
+
+@app.route('/api/archive', methods=['POST'])
+def api_archive():
+    """Stream a ZIP of the selected files, compressed on the fly as it is sent"""
+    data = request.get_json(silent=True)
+    if data is not None:
+        paths = [file['path'] if isinstance(file, dict) else file for file in data.get('files', [])]
+    else:
+        # Plain form posts let the browser stream the download straight to disk
+        paths = request.form.getlist('path')
+    paths = [path for path in paths if path]
+    
+    if not paths:
+        return jsonify({'error': 'No files selected'}), 400
+    denied = [path for path in paths if not is_allowed_path(path)]
+    if denied:
+        app.logger.error(f"Attempted to archive files outside allowed directories: {denied}")
+        return jsonify({'error': 'Access denied'}), 403
+        
+    today = datetime.now().strftime('%Y-%m-%d')
+    app.logger.info(f"Streaming archive of {len(paths)} files")
+    return Response(
+        stream_zip(paths, compresslevel=config_instance.ARCHIVE_COMPRESS_LEVEL),
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename="PartFiles_{today}.zip"'}
+    )
+
 @app.route('/api/cache-refresh', methods=['POST'])
 def refresh_cache():
-    """Force refresh of the file cache"""
+    """Refresh the file index, rescanning only changed directories unless a full refresh is requested"""
     try:
-        # Clear the lru_cache
-        get_cached_files.cache_clear()
-        # Pre-warm the cache
-        for category, directory in DIRECTORIES.items():
-            get_cached_files(directory)
-        return jsonify({'message': 'Cache refreshed successfully'})
+        data = request.get_json(silent=True) or {}
+        full = data.get('mode') == 'full'
+        # A refresh is often asked for right after reconnecting a drive
+        drive_prober.request_probe()
+        if indexer is not None and indexer.is_alive():
+            # Let the indexer thread do the work instead of blocking this request
+            indexer.request_refresh(full=full)
+        elif index_follower is not None and index_follower.is_alive():
+            # Another process runs the indexer, it picks the request up from the shared database
+            file_index.request_refresh(full=full)
+        if indexing_in_background():
+            return jsonify({
+                'message': 'Cache refresh scheduled',
+                'mode': 'full' if full else 'incremental'
+            }), 202
+
+        categories = {}
+        if full:
+            # Walk every root at once so the scanner pool fans out across all of them
+            results, errors = file_index.rebuild_many(DIRECTORIES)
+            for category, entries in results.items():
+                categories[category] = {'added': len(entries), 'removed': 0, 'changed': 0,
+                                        'full_rescan': True, 'scan': file_index.scan_stats[category]}
+            for category, error in errors.items():
+                categories[category] = {'error': str(error)}
+        else:
+            for category, directory in DIRECTORIES.items():
+                try:
+                    categories[category] = file_index.refresh(category, directory)
+                except FileNotFoundError as e:
+                    categories[category] = {'error': str(e)}
+        return jsonify({
+            'message': 'Cache refreshed successfully',
+            'mode': 'full' if full else 'incremental',
+            'categories': categories
+        })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def category_memory(category):
+    """Memory held for a category's files: the columns shared by all processes, and this process's search index"""
+    memory = file_index.memory(category)
+    if memory is None:
+        return None
+    name_index_bytes = name_indexes.memory(category) or 0
+    total = memory['column_bytes'] + memory['heap_bytes'] + name_index_bytes
+    return dict(memory, name_index_bytes=name_index_bytes,
+                process_bytes=memory['heap_bytes'] + name_index_bytes,
+                bytes_per_file=round(total / memory['files'], 1) if memory['files'] else 0)
+
+@app.route('/api/index-status')
+def index_status():
+    """Report how current the file index is for each category"""
+    return jsonify({
+        'indexer_running': indexing_in_background(),
+        'worker': index_follower.status() if index_follower is not None else None,
+        'max_staleness_seconds': config_instance.INDEX_MAX_STALENESS,
+        'geometry': geometry_indexer.status() if geometry_indexer is not None else None,
+        'duplicates': duplicate_indexer.status() if duplicate_indexer is not None else None,
+        'categories': {
+            category: dict(
+                indexed=file_index.is_indexed(category, directory),
+                files=len(file_index.get_entries(category) or []),
+                memory=category_memory(category),
+                scan=file_index.scan_stats.get(category),
+                **(indexer.status()[category] if indexer is not None else {})
+            )
+            for category, directory in DIRECTORIES.items()
+        }
+    })
+
+@app.route('/api/duplicates')
+def api_duplicates():
+    """List clusters of duplicate files, those freeing the most space if removed first.
+
+    kind=content groups byte-identical files, kind=geometry files with the
+    same shape whatever their format. category limits the clusters to those
+    with a file in that category, limit and offset page through them.
+    """
+    try:
+        kind = request.args.get('kind', 'content')
+        if kind not in DUPLICATE_KINDS:
+            raise ValueError(f"kind must be one of {', '.join(DUPLICATE_KINDS)}")
+        category = request.args.get('category')
+        if category and category not in DIRECTORIES:
+            raise ValueError(f'Invalid category: {category}')
+        limit = _page_param(request.args, 'limit', 100, minimum=1)
+        offset = _page_param(request.args, 'offset', 0)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    clusters = []
+    for key, members in duplicate_clusters.clusters(kind).items():
+        if category and not any(member_category == category for member_category, _ in members):
+            continue
+        sizes = [entry.size for _, entry in members]
+        # Keeping one copy frees the rest; copies of a shape in other formats differ in size
+        reclaimable = sizes[0] * (len(sizes) - 1) if kind == 'content' else sum(sizes) - min(sizes)
+        clusters.append((reclaimable, key, members))
+    clusters.sort(key=lambda cluster: (-cluster[0], cluster[1]))
+
+    return jsonify({
+        'kind': kind,
+        'clusters': [{
+            'key': key,
+            'files': len(members),
+            'reclaimable_bytes': reclaimable,
+            'members': [dict(to_result(entry, DIRECTORIES[member_category]), category=member_category)
+                        for member_category, entry in sorted(members, key=lambda member: member[1].mtime,
+                                                             reverse=True)]
+        } for reclaimable, key, members in clusters[offset:offset + limit]],
+        'total_clusters': len(clusters),
+        'total_reclaimable_bytes': sum(cluster[0] for cluster in clusters),
+        # False while the clusters are first grouped in the background, the list is then empty
+        'ready': duplicate_clusters.ready,
+        'indexer': duplicate_indexer.status() if duplicate_indexer is not None else None
+    })
+
 @app.route('/', defaults={'path': 'index.html'})
 @app.route('/<path:path>')
 def serve_static(path):
@@ -270,115 +984,307 @@ def serve_assets(filename):
     assets_dir = os.path.join(os.path.dirname(__file__), '..', 'frontend', 'public', 'assets')
     return send_from_directory(assets_dir, filename)
 
-# Add error handling for network drives
 def check_drive_availability():
-    for category, path in DIRECTORIES.items():
-        if not os.path.exists(path):
-            app.logger.error(f"Drive for {category} is not accessible: {path}")
-            return False
-    return True
+    """True unless the drive prober last found a category drive unreachable"""
+    return all(drive_prober.is_available(category) for category in DIRECTORIES)
 
-# Add health check endpoint
+def check_drive(path):
+    """Raise DriveUnavailableError if path lies on a category drive that is down"""
+    category = root_category(path)
+    if category is not None:
+        drive_prober.check(category)
+
+# Answered from the drive prober's last results, never touches the drives itself
 @app.route('/api/health')
 def health_check():
     drives_ok = check_drive_availability()
     return jsonify({
         'status': 'healthy' if drives_ok else 'degraded',
-        'drives_ok': drives_ok
+        'drives_ok': drives_ok,
+        'drives': drive_prober.status()
     })
 
+gauge('partsfinder_indexed_files', 'Files in the index per category',
+      lambda: {category: len(file_index.get_entries(category) or []) for category in DIRECTORIES},
+      labels=('category',))
+gauge('partsfinder_drive_up', 'Whether the category drive answered its last check',
+      lambda: {category: int(drive_prober.is_available(category)) for category in DIRECTORIES},
+      labels=('category',))
+gauge('partsfinder_model_cache_bytes', 'Size of the local model cache',
+      lambda: {(): model_artifacts.stats()['bytes']})
+
+@app.route('/api/metrics')
+@limiter.exempt
+def metrics():
+    """Counters and histograms of this server process in the Prometheus text format"""
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+def drive_unavailable(error):
+    app.logger.error(str(error))
+    response = jsonify({'error': 'Network drive not accessible. Please check connection.'})
+    response.status_code = 503
+    response.retry_after = config_instance.DRIVE_PROBE_INTERVAL
+    return response
+
+def lookup_entry(path):
+    """Find the indexed entry for a path, None if it isn't in any indexed category"""
+    category = root_category(path)
+    if category is None or not file_index.is_indexed(category, DIRECTORIES[category]):
+        return None
+    name_index = name_indexes.get(category)
+    return name_index.find(path) or name_index.find(os.path.abspath(path))
+
+def model_etag(size, mtime):
+    """Strong validator for a model file, derived from its indexed size and mtime"""
+    return f"{size:x}-{int(mtime * 1000000):x}"
+
+def model_stat(file_path):
+    """Return (size, mtime) of a model from the index, asking the filesystem only if it isn't indexed yet"""
+    entry = lookup_entry(file_path)
+    if entry is not None:
+        return entry.size, entry.mtime
+    full_path = os.path.abspath(file_path)
+    check_drive(full_path)
+    STAT_CALLS.inc(1, 'model')
+    st = os.stat(full_path)
+    if not stat.S_ISREG(st.st_mode):
+        raise FileNotFoundError(full_path)
+    return st.st_size, st.st_mtime
+
+def is_fresh(etag, mtime):
+    """True if the request's validators show the client already has this version"""
+    return request.if_none_match.contains(etag) or (
+        not request.if_none_match and request.if_modified_since
+        and int(mtime) <= request.if_modified_since.timestamp()
+    )
+
+def not_modified(etag, mtime):
+    response = app.response_class(status=304)
+    response.set_etag(etag)
+    response.last_modified = mtime
+    return response
+
+def add_model_headers(response):
+    """Revalidation and CORS headers shared by the model endpoints"""
+    response.cache_control.no_cache = True
+    response.headers['Access-Control-Allow-Origin'] = '*'
+    response.headers['Access-Control-Allow-Methods'] = 'GET, HEAD, OPTIONS'
+    response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Range, If-None-Match, If-Modified-Since'
+    response.headers['Access-Control-Expose-Headers'] = 'Accept-Ranges, Content-Range, Content-Length, ETag'
+    return response
+
 @app.route('/api/model/<path:file_path>')
 def serve_model(file_path):
-    """Serve a 3D model file for the viewer"""
+    """Serve a 3D model file for the viewer.
+
+    Responses carry an ETag and Last-Modified taken from the file index, so a
+    repeat view of an unchanged model is answered with 304 without opening
+    the file, and Range requests are honoured for partial or resumed fetches.
+    HEAD requests are answered from the index alone, replacing a separate
+    /api/file-check call before loading a model.
+    """
     try:
-        app.logger.info(f"Model request received for: {file_path}")
-        
-        # Log request details
-        app.logger.debug(f"Request headers: {dict(request.headers)}")
-        app.logger.debug(f"Request method: {request.method}")
-        
         # For security, validate that the file exists and is within allowed directories
         full_path = os.path.abspath(file_path)
-        app.logger.debug(f"Resolved absolute path: {full_path}")
-        
-        # Check if the file is within one of our allowed directories
-        allowed = False
-        for category, base_dir in DIRECTORIES.items():
-            base_dir_abs = os.path.abspath(base_dir)
-            app.logger.debug(f"Checking if path is in {category} directory: {base_dir_abs}")
-            app.logger.debug(f"Path starts with base_dir? {full_path.startswith(base_dir_abs)}")
-            if full_path.startswith(base_dir_abs):
-                allowed = True
-                app.logger.debug(f"Path is allowed in {category} directory")
-                break
-        
-        if not allowed:
+        if not is_allowed_path(full_path):
             app.logger.error(f"Attempted to access file outside allowed directories: {full_path}")
             return jsonify({'error': 'Access denied'}), 403
             
-        # Check if file exists
-        file_exists = os.path.isfile(full_path)
-        app.logger.debug(f"File exists? {file_exists}")
-        if not file_exists:
-            app.logger.error(f"File not found: {full_path}")
-            return jsonify({'error': 'File not found'}), 404
-            
-        # Get the directory and filename
-        directory = os.path.dirname(full_path)
-        filename = os.path.basename(full_path)
-        app.logger.debug(f"Serving file: {filename} from directory: {directory}")
+        size, mtime = model_stat(file_path)
+        etag = model_etag(size, mtime)
         
-        # Serve the file with appropriate headers
-        response = send_from_directory(directory, filename)
+        # Clients accepting gzip get the local compressed copy once it is built,
+        # which also keeps viewed models available while their drive is down
+        drive_up = drive_prober.is_available(root_category(full_path))
+        send_path, encoding = full_path, None
+        if full_path.lower().endswith('.stl') and 'gzip' in request.accept_encodings:
+            # HEAD only describes the response, the copy is built when the model is fetched
+            cached_path = model_cache.lookup(full_path, size, mtime, build=drive_up and request.method != 'HEAD')
+            if cached_path is not None:
+                send_path, encoding = cached_path, 'gzip'
+                etag = f"{etag}-gz"
         
-        # Add CORS headers
-        response.headers['Access-Control-Allow-Origin'] = '*'
-        response.headers['Access-Control-Allow-Methods'] = 'GET, OPTIONS'
-        response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
+        if is_fresh(etag, mtime):
+            response = not_modified(etag, mtime)
+        elif request.method == 'HEAD':
+            response = app.response_class(
+                mimetype=mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+            )
+            response.content_length = os.path.getsize(send_path) if encoding else size
+            if encoding:
+                response.content_encoding = encoding
+            response.accept_ranges = 'bytes'
+            response.set_etag(etag)
+            response.last_modified = mtime
+        else:
+            if not encoding:
+                check_drive(full_path)
+            # send_file answers Range and If-Range requests with 206 partial content
+            response = send_file(send_path, download_name=os.path.basename(full_path),
+                                 conditional=True, etag=etag, last_modified=mtime)
+            if encoding:
+                response.content_encoding = encoding
+            MODEL_BYTES.inc(response.content_length or 0, encoding or 'identity')
+        if full_path.lower().endswith('.stl'):
+            response.vary.add('Accept-Encoding')
+        add_model_headers(response)
         
-        app.logger.info(f"Successfully serving model file: {filename}")
+        app.logger.info(f"Serving model file {os.path.basename(full_path)} ({response.status_code})")
         return response
+    except DriveUnavailableError as e:
+        return drive_unavailable(e)
+    except FileNotFoundError:
+        app.logger.error(f"File not found: {file_path}")
+        return jsonify({'error': 'File not found'}), 404
     except Exception as e:
         app.logger.error(f"Error serving model file: {str(e)}")
         app.logger.exception("Exception details:")
         return jsonify({'error': str(e)}), 500
 
+def build_lod(name, full_path, level):
+    """Build a decimated preview into the model cache on a background thread, once at a time per name"""
+    with lod_builds_lock:
+        if name in lod_builds:
+            return
+        lod_builds.add(name)
+
+    def build():
+        try:
+            start_time = time.time()
+            model_artifacts.put(name, lod_builder(full_path, level))
+            app.logger.info(f"Built {level} triangle preview of {os.path.basename(full_path)} "
+                            f"in {int((time.time() - start_time) * 1000)}ms")
+        except Exception as e:
+            app.logger.error(f"Could not build a preview of {full_path}: {e}")
+        finally:
+            with lod_builds_lock:
+                lod_builds.discard(name)
+
+    threading.Thread(target=build, name='lod-builder', daemon=True).start()
+
+@app.route('/api/model-lod/<path:file_path>')
+def serve_model_lod(file_path):
+    """Serve a decimated copy of an STL for a quick first preview.
+
+    The ?triangles= budget is rounded up to the nearest MODEL_LOD_LEVELS
+    entry, and each level is built once per model version, in the
+    background, and kept in the model cache. Models already within the
+    budget, or whose preview isn't built yet, redirect to /api/model.
+    """
+    try:
+        full_path = os.path.abspath(file_path)
+        if not is_allowed_path(full_path):
+            app.logger.error(f"Attempted to access file outside allowed directories: {full_path}")
+            return jsonify({'error': 'Access denied'}), 403
+        if not full_path.lower().endswith('.stl'):
+            return jsonify({'error': 'Previews are only available for STL files'}), 400
+        try:
+            requested = int(request.args.get('triangles', config_instance.MODEL_LOD_LEVELS[0]))
+        except ValueError:
+            return jsonify({'error': 'triangles must be a number'}), 400
+        levels = config_instance.MODEL_LOD_LEVELS
+        level = next((level for level in levels if level >= requested), levels[-1])
+        
+        size, mtime = model_stat(file_path)
+        full_model_url = '/api/model/' + quote(file_path, safe='')
+        name = model_artifacts.key(full_path, size, mtime, f'lod{level}.stl')
+        lod_path = model_artifacts.get(name)
+        if lod_path is None:
+            check_drive(full_path)
+            count = stl_triangle_count(full_path)
+            if count is None or count > level:
+                build_lod(name, full_path, level)
+            response = redirect(full_model_url)
+            response.headers['Cache-Control'] = 'no-store'
+            return response
+        kept, original = lod_counts(lod_path)
+        if kept == original:
+            return redirect(full_model_url)
+        
+        etag = f"{model_etag(size, mtime)}-lod{level}"
+        if is_fresh(etag, mtime):
+            response = not_modified(etag, mtime)
+        else:
+            response = send_file(lod_path, download_name=os.path.basename(full_path),
+                                 conditional=True, etag=etag, last_modified=mtime)
+            MODEL_BYTES.inc(response.content_length or 0, 'lod')
+        response.headers['X-LOD-Triangles'] = str(kept)
+        response.headers['X-Original-Triangles'] = str(original)
+        return add_model_headers(response)
+    except DriveUnavailableError as e:
+        return drive_unavailable(e)
+    except FileNotFoundError:
+        app.logger.error(f"File not found: {file_path}")
+        return jsonify({'error': 'File not found'}), 404
+    except Exception as e:
+        app.logger.error(f"Error building model preview: {str(e)}")
+        app.logger.exception("Exception details:")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/thumbnail/<digest>')
+def serve_thumbnail(digest):
+    """Serve a rendered thumbnail by digest, as linked from search results.
+
+    A digest always names the same image, so clients may keep it for good.
+    """
+    if not re.fullmatch(r'[0-9a-f]{40}', digest):
+        return jsonify({'error': 'Invalid thumbnail'}), 404
+    path = thumbnails.path(digest)
+    if not os.path.isfile(path):
+        return jsonify({'error': 'Thumbnail not found'}), 404
+    response = send_file(path, mimetype='image/png', etag=digest, max_age=THUMBNAIL_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+def file_status(file_path):
+    """Existence and size of a file for /api/file-check, from the index where possible"""
+    full_path = os.path.abspath(file_path)
+    status = {'path': file_path, 'full_path': full_path, 'allowed': is_allowed_path(full_path),
+              'exists': False, 'size': 0, 'is_file': False, 'is_dir': False}
+    if not status['allowed']:
+        return status
+    entry = lookup_entry(file_path)
+    if entry is not None:
+        status.update(exists=True, size=entry.size, is_file=True, modified=entry.mtime)
+        return status
+    if not drive_prober.is_available(root_category(full_path)):
+        status['error'] = 'Drive not accessible'
+        return status
+    try:
+        STAT_CALLS.inc(1, 'file_check')
+        st = os.stat(full_path)
+    except OSError:
+        return status
+    is_file = stat.S_ISREG(st.st_mode)
+    status.update(exists=is_file, size=st.st_size if is_file else 0, is_file=is_file,
+                  is_dir=stat.S_ISDIR(st.st_mode), modified=st.st_mtime)
+    return status
+
 @app.route('/api/file-check', methods=['POST'])
 def check_file_exists():
-    """Check if a file exists and is accessible"""
+    """Check if files exist and are accessible.
+
+    Takes a single "path", or "paths" for up to MAX_FILE_CHECK_PATHS files
+    at once, answered from the file index without touching the drives for
+    indexed files. Paths outside the category directories are never stat'ed.
+    """
     try:
         data = request.json
         file_path = data.get('path')
+        paths = data.get('paths')
         
-        if not file_path:
+        if paths is None and not file_path:
             return jsonify({'error': 'No file path provided'}), 400
+        if paths is not None:
+            if not isinstance(paths, list) or not all(isinstance(path, str) for path in paths):
+                return jsonify({'error': 'paths must be a list of file paths'}), 400
+            if len(paths) > MAX_FILE_CHECK_PATHS:
+                return jsonify({'error': f'At most {MAX_FILE_CHECK_PATHS} paths per request'}), 400
+            return jsonify({'files': [file_status(path) for path in paths]})
             
         app.logger.info(f"File check request for: {file_path}")
-        
-        # Resolve the absolute path
-        full_path = os.path.abspath(file_path)
-        app.logger.debug(f"Resolved absolute path: {full_path}")
-        
-        # Check if the file is within one of our allowed directories
-        allowed = False
-        for category, base_dir in DIRECTORIES.items():
-            base_dir_abs = os.path.abspath(base_dir)
-            if full_path.startswith(base_dir_abs):
-                allowed = True
-                break
-        
-        # Check if file exists
-        file_exists = os.path.isfile(full_path)
-        
-        return jsonify({
-            'path': file_path,
-            'full_path': full_path,
-            'exists': file_exists,
-            'allowed': allowed,
-            'size': os.path.getsize(full_path) if file_exists else 0,
-            'is_file': os.path.isfile(full_path),
-            'is_dir': os.path.isdir(full_path)
-        })
+        return jsonify(file_status(file_path))
     except Exception as e:
         app.logger.error(f"Error checking file: {str(e)}")
         return jsonify({'error': str(e)}), 500
@@ -399,4 +1305,7 @@ def check_file_exists():
             print(f"Error creating directory: {e}")
             sys.exit(1)
 
+    # With the reloader active only the serving child process should index
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_indexer()
     app.run(debug=True)
\ No newline at end of file
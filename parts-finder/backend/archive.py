@@ -0,0 +1,84 @@
+"""ZIP archives generated chunk by chunk while they are being sent"""
+import io
+import os
+import zipfile
+import logging
+
+logger = logging.getLogger(__name__)
+
+READ_CHUNK_SIZE = 1024 * 1024
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only, unseekable stream that hands written bytes back to the generator.
+
+    zipfile notices it can't seek and writes data descriptors after each
+    member instead of patching the local headers, so nothing is buffered
+    beyond what has been compressed since the last chunk was taken.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def unique_arcnames(paths):
+    """Map each path to a file name inside the archive, numbering duplicate names"""
+    seen = {}
+    names = []
+    for path in paths:
+        name = os.path.basename(path)
+        count = seen.get(name.lower(), 0)
+        seen[name.lower()] = count + 1
+        if count:
+            base, ext = os.path.splitext(name)
+            name = f"{base}_{count}{ext}"
+        names.append(name)
+    return names
+
+
+def stream_zip(paths, compresslevel=6):
+    """Yield a ZIP archive of paths in chunks, without staging it on disk or in memory.
+
+    Files that can't be read are skipped and listed in a MISSING.txt member
+    at the end, since the response has already started by then.
+    """
+    sink = _ChunkSink()
+    missing = []
+    archive = zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED,
+                              compresslevel=compresslevel, allowZip64=True)
+    for path, arcname in zip(paths, unique_arcnames(paths)):
+        try:
+            info = zipfile.ZipInfo.from_file(path, arcname)
+            info.compress_type = zipfile.ZIP_DEFLATED
+            with open(path, 'rb') as src, archive.open(info, 'w') as dst:
+                while True:
+                    chunk = src.read(READ_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    dst.write(chunk)
+                    data = sink.take()
+                    if data:
+                        yield data
+        except OSError as e:
+            logger.error(f"Skipping {path} in archive: {e}")
+            missing.append(f"{path}: {e}")
+        data = sink.take()
+        if data:
+            yield data
+    if missing:
+        archive.writestr('MISSING.txt', '\n'.join(missing) + '\n')
+    archive.close()
+    yield sink.take()
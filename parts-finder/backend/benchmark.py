@@ -0,0 +1,427 @@
+"""Benchmarks of indexing, search, copying and model serving on a synthetic parts tree.
+
+Generates a reproducible tree of STL/3MF files with _vN revision suffixes
+(reused while its parameters don't change), runs the app against it in
+process and writes a JSON report. Reports from different releases can be
+compared to catch regressions:
+
+    python benchmark.py --tree /tmp/parts --files 100000 --output report.json
+    python benchmark.py --tree /tmp/parts --files 100000 --latency-ms 5 --compare report.json
+
+--latency-ms delays every directory listing, stat and open under the tree,
+roughly like a network drive, so walks and copies can be measured without one.
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import shutil
+import builtins
+import argparse
+import platform
+import tempfile
+import statistics
+import tracemalloc
+import subprocess
+from contextlib import contextmanager
+from urllib.parse import quote
+
+MANIFEST_NAME = '.benchmark-tree.json'
+FAMILY_WORDS = ['bracket', 'housing', 'frame', 'mount', 'plate', 'shaft',
+                'cover', 'spacer', 'clip', 'hinge', 'gear', 'flange']
+SEARCH_QUERIES = {
+    'exact_family': 'mount_000123',
+    'common_word': 'bracket',
+    'two_terms': 'hinge, flange',
+    'short_term': 'ge',
+    'no_match': 'zzzzzz',
+    'typo': 'mout_000132',
+}
+# Figures compared between reports, throughputs where higher is better and
+# median latencies; minimum and p95 latencies are too noisy to gate on
+HIGHER_IS_BETTER = ('_per_second',)
+COMPARED = HIGHER_IS_BETTER + ('median_ms',)
+# Latency differences below this are timer noise, not regressions
+NOISE_FLOOR_MS = 0.5
+
+
+def tiny_stl():
+    """Smallest valid binary STL, one triangle, used as the content of generated parts"""
+    return b'benchmark part'.ljust(80, b' ') + (1).to_bytes(4, 'little') + bytes(50)
+
+
+def generate_tree(root, files=10000, depth=3, files_per_dir=50, max_versions=4,
+                  threemf_share=0.1, seed=1):
+    """Create a synthetic parts tree under root, returns the number of part files written.
+
+    Part families are spread evenly over the leaf directories, each with one
+    to max_versions revisions named <word>_<number>_v<n>. Later revisions get
+    later mtimes. The same arguments always produce the same tree, and an
+    existing tree made with them is left as it is.
+    """
+    params = {'files': files, 'depth': depth, 'files_per_dir': files_per_dir,
+              'max_versions': max_versions, 'threemf_share': threemf_share, 'seed': seed}
+    manifest_path = os.path.join(root, MANIFEST_NAME)
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if manifest['params'] == params:
+            return manifest['written']
+        # Generated before with other parameters
+        shutil.rmtree(root)
+    except FileNotFoundError:
+        if os.path.isdir(root) and os.listdir(root):
+            raise ValueError(f"{root} is not empty and was not generated by the benchmark")
+    except (OSError, ValueError, KeyError):
+        shutil.rmtree(root)
+    os.makedirs(root)
+
+    rng = random.Random(seed)
+    content = tiny_stl()
+    leaves = max(1, math.ceil(files / files_per_dir))
+    fanout = max(2, math.ceil(leaves ** (1 / depth))) if depth else 1
+    base_time = time.time() - 365 * 24 * 3600
+    written = 0
+    family = 0
+    while written < files:
+        leaf = family % leaves
+        parts = []
+        for level in range(depth):
+            parts.append(f'{chr(ord("A") + level)}{leaf % fanout:02d}')
+            leaf //= fanout
+        directory = os.path.join(root, *parts)
+        os.makedirs(directory, exist_ok=True)
+        ext = '.3mf' if rng.random() < threemf_share else '.stl'
+        name = f'{FAMILY_WORDS[family % len(FAMILY_WORDS)]}_{family:06d}'
+        mtime = base_time + rng.random() * 300 * 24 * 3600
+        for version in range(1, min(rng.randint(1, max_versions), files - written) + 1):
+            path = os.path.join(directory, f'{name}_v{version}{ext}')
+            with open(path, 'wb') as f:
+                f.write(content)
+            mtime += rng.random() * 7 * 24 * 3600
+            os.utime(path, (mtime, mtime))
+            written += 1
+        family += 1
+
+    with open(manifest_path, 'w') as f:
+        json.dump({'params': params, 'written': written}, f)
+    return written
+
+
+def write_model(path, triangles, seed=1):
+    """Write a binary STL of random triangles, the model served by the throughput runs"""
+    import numpy as np
+    from mesh import write_stl
+    rng = np.random.default_rng(seed)
+    write_stl(rng.random((triangles, 3, 3), np.float32) * 100, path, b'benchmark model')
+
+
+@contextmanager
+def simulated_latency(root, seconds):
+    """Delay listings, stats and opens of paths under root by seconds each"""
+    if not seconds:
+        yield
+        return
+    prefix = os.path.abspath(root)
+    originals = {'scandir': os.scandir, 'stat': os.stat, 'listdir': os.listdir}
+
+    def delayed(function):
+        def call(path='.', *args, **kwargs):
+            if isinstance(path, (str, bytes, os.PathLike)) and os.path.abspath(os.fsdecode(path)).startswith(prefix):
+                time.sleep(seconds)
+            return function(path, *args, **kwargs)
+        return call
+
+    original_open = builtins.open
+    for name, function in originals.items():
+        setattr(os, name, delayed(function))
+    builtins.open = delayed(original_open)
+    try:
+        yield
+    finally:
+        for name, function in originals.items():
+            setattr(os, name, function)
+        builtins.open = original_open
+
+
+def timings(function, repeat):
+    """Run function repeat times, returns latency figures in milliseconds"""
+    samples = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        function()
+        samples.append((time.perf_counter() - start_time) * 1000)
+    samples.sort()
+    return {
+        'runs': repeat,
+        'min_ms': round(samples[0], 3),
+        'median_ms': round(statistics.median(samples), 3),
+        'p95_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 3),
+    }
+
+
+def load_app(tree, work_dir):
+    """Import the app configured for the benchmark tree, with its state kept in work_dir"""
+    empty = os.path.join(work_dir, 'empty')
+    os.makedirs(empty, exist_ok=True)
+    os.environ.update({
+        'FLASK_ENV': 'production',
+        'MOTORCYCLE_DIR': tree,
+        'AEROSPACE_DIR': empty,
+        'DOCUMENTS_DIR': empty,
+        'INDEX_PATH': os.path.join(work_dir, 'index', 'file_index.db'),
+        'COPY_JOBS_DIR': os.path.join(work_dir, 'copy_jobs'),
+        'MODEL_CACHE_DIR': os.path.join(work_dir, 'cache', 'models'),
+        'THUMBNAIL_DIR': os.path.join(work_dir, 'cache', 'thumbnails'),
+        # Copies go to ~/Downloads
+        'HOME': work_dir,
+        'USERPROFILE': work_dir,
+    })
+    import logging
+    import app as app_module
+    logging.getLogger().setLevel(logging.WARNING)
+    app_module.limiter.enabled = False
+    return app_module
+
+
+def bench_index(app_module, tree, latency):
+    results = {}
+    with simulated_latency(tree, latency):
+        start_time = time.perf_counter()
+        entries = app_module.file_index.rebuild('motorcycle', tree)
+        seconds = time.perf_counter() - start_time
+        stats = app_module.file_index.scan_stats['motorcycle']
+        results['index_full_walk'] = {
+            'files': len(entries),
+            'seconds': round(seconds, 3),
+            'files_per_second': round(len(entries) / seconds, 1),
+            'dirs_per_second': stats['dirs_per_second'],
+        }
+        results['index_refresh_unchanged'] = timings(
+            lambda: app_module.file_index.refresh('motorcycle', tree), 3)
+
+    from file_index import FileIndex
+    results['index_load'] = timings(lambda: FileIndex(app_module.config_instance.INDEX_PATH).load(), 3)
+    return results
+
+
+def bench_memory(app_module):
+    """Memory of the indexed files: the shared columns, search data included, against a plain list of
+    FileEntry, and the part of the name index each process builds on top of them"""
+    from search_index import NameIndex
+    columns = app_module.file_index.get_entries('motorcycle')
+    tracemalloc.start()
+    entries = list(columns)
+    list_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    tracemalloc.start()
+    name_index = NameIndex(columns)
+    name_index_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    memory = columns.memory()
+    column_bytes = memory['column_bytes'] + memory['heap_bytes']
+    files = max(1, len(entries))
+    per_million = 1000000 / files
+    return {'index_memory': {
+        'files': len(entries),
+        'list_bytes_per_file': round(list_bytes / files, 1),
+        'column_bytes_per_file': memory['bytes_per_file'],
+        'name_index_bytes_per_file': round(name_index_bytes / files, 1),
+        'name_index_estimate_bytes_per_file': round(name_index.memory() / files, 1),
+        'list_mb_per_million_files': round(list_bytes * per_million / 2 ** 20, 1),
+        'column_mb_per_million_files': round(column_bytes * per_million / 2 ** 20, 1),
+        'name_index_mb_per_million_files': round(name_index_bytes * per_million / 2 ** 20, 1),
+        # Held by each process: its directory strings and the families of the name index,
+        # the mapped columns with the names and postings are shared
+        'process_mb_per_million_files': round((memory['heap_bytes'] + name_index_bytes) * per_million / 2 ** 20, 1),
+        'shared': memory['shared'],
+    }}
+
+
+def bench_search(app_module, repeat):
+    results = {}
+    # The first call after indexing builds the name index
+    results['get_cached_files_cold'] = timings(lambda: app_module.get_cached_files('motorcycle'), 1)
+    results['get_cached_files'] = timings(lambda: app_module.get_cached_files('motorcycle'), repeat)
+    for name, query in SEARCH_QUERIES.items():
+        for latest_only in (False, True):
+            key = f"search_{name}{'_latest' if latest_only else ''}"
+            results[key] = timings(
+                lambda: app_module.search_files('motorcycle', query, latest_only=latest_only, limit=100),
+                repeat
+            )
+            results[key]['matches'] = len(app_module.find_matches('motorcycle', query, latest_only=latest_only))
+        results[f'ranked_{name}'] = timings(
+            lambda: app_module.best_first(*app_module.rank_matches('motorcycle', query)[:2], limit=100), repeat
+        )
+        results[f'ranked_{name}']['matches'] = len(app_module.rank_matches('motorcycle', query)[1])
+    return results
+
+
+def bench_copy(client, app_module, tree, files, latency):
+    entries = app_module.file_index.get_entries('motorcycle')
+    model = os.path.join(tree, 'models', 'model.stl')
+    selected = [{'path': entry.path, 'size': entry.size} for entry in entries[:files]]
+    selected.append({'path': model, 'size': os.path.getsize(model)})
+    with simulated_latency(tree, latency):
+        start_time = time.perf_counter()
+        job = client.post('/api/copy', json={'files': selected}).get_json()
+        while True:
+            progress = client.get(job['status_url']).get_json()
+            if progress['status'] not in ('pending', 'running'):
+                break
+            time.sleep(0.01)
+        seconds = time.perf_counter() - start_time
+    shutil.rmtree(progress['target_dir'], ignore_errors=True)
+    return {'copy': {
+        'status': progress['status'],
+        'files': progress['files_done'],
+        'bytes': progress['bytes_done'],
+        'seconds': round(seconds, 3),
+        'files_per_second': round(progress['files_done'] / seconds, 1),
+        'bytes_per_second': round(progress['bytes_done'] / seconds),
+    }}
+
+
+def bench_models(client, app_module, tree, repeat, latency):
+    results = {}
+    model = os.path.join('models', 'model.stl')
+    url = '/api/model/' + quote(model, safe='')
+    size = os.path.getsize(os.path.join(tree, model))
+    previous = os.getcwd()
+    # Model URLs carry drive paths, which the route only takes relative here
+    os.chdir(tree)
+    try:
+        with simulated_latency(tree, latency):
+            for variant, headers in (('identity', {}), ('gzip', {'Accept-Encoding': 'gzip'})):
+                if variant == 'gzip':
+                    entry = app_module.lookup_entry(model)
+                    app_module.model_cache.build(os.path.abspath(model), entry.size, entry.mtime)
+                figures = timings(lambda: client.get(url, headers=headers).get_data(), repeat)
+                figures['bytes_per_second'] = round(size / (figures['median_ms'] / 1000))
+                results[f'model_{variant}'] = figures
+            lod_url = '/api/model-lod/' + quote(model, safe='') + '?triangles=20000'
+            results['model_lod_build'] = timings(lambda: client.get(lod_url).get_data(), 1)
+            results['model_lod_cached'] = timings(lambda: client.get(lod_url).get_data(), repeat)
+    finally:
+        os.chdir(previous)
+    return results
+
+
+def compare_reports(baseline, report, threshold=0.2):
+    """Return (rows, regressions) comparing the figures of two reports.
+
+    Each row is (result, metric, baseline value, new value, relative change),
+    where a positive change is an improvement. Figures that got worse by
+    more than threshold are regressions.
+    """
+    rows = []
+    regressions = []
+    for name, figures in report['results'].items():
+        old_figures = baseline.get('results', {}).get(name, {})
+        for metric, value in figures.items():
+            old = old_figures.get(metric)
+            if not metric.endswith(COMPARED) or not old or value is None:
+                continue
+            if metric.endswith(HIGHER_IS_BETTER):
+                change = (value - old) / old
+            elif abs(value - old) < NOISE_FLOOR_MS:
+                change = 0.0
+            else:
+                change = (old - value) / old
+            row = (name, metric, old, value, round(change, 3))
+            rows.append(row)
+            if change < -threshold:
+                regressions.append(row)
+    return rows, regressions
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True,
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark Parts Finder on a synthetic parts tree')
+    parser.add_argument('--tree', default=os.path.join(tempfile.gettempdir(), 'parts-finder-benchmark'),
+                        help='Where the synthetic tree is generated and kept between runs')
+    parser.add_argument('--files', type=int, default=10000)
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--files-per-dir', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--model-triangles', type=int, default=200000,
+                        help='Triangles of the model served by the /api/model runs')
+    parser.add_argument('--latency-ms', type=float, default=0,
+                        help='Simulated latency of every listing, stat and open under the tree')
+    parser.add_argument('--repeat', type=int, default=20, help='Runs of each search and model request')
+    parser.add_argument('--copy-files', type=int, default=200)
+    parser.add_argument('--output', help='Write the JSON report here')
+    parser.add_argument('--compare', help='Baseline report to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='Relative slowdown reported as a regression (default: 0.2)')
+    args = parser.parse_args(argv)
+
+    tree = os.path.abspath(args.tree)
+    start_time = time.perf_counter()
+    written = generate_tree(tree, args.files, args.depth, args.files_per_dir, seed=args.seed)
+    model = os.path.join(tree, 'models', 'model.stl')
+    if not os.path.exists(model):
+        os.makedirs(os.path.dirname(model), exist_ok=True)
+        write_model(model, args.model_triangles, args.seed)
+    print(f"Tree with {written} part files ready in {time.perf_counter() - start_time:.1f}s: {tree}")
+
+    work_dir = tempfile.mkdtemp(prefix='parts-finder-benchmark-')
+    try:
+        app_module = load_app(tree, work_dir)
+        latency = args.latency_ms / 1000
+        results = {}
+        with app_module.app.test_client() as client:
+            results.update(bench_index(app_module, tree, latency))
+            results.update(bench_memory(app_module))
+            results.update(bench_search(app_module, args.repeat))
+            results.update(bench_copy(client, app_module, tree, args.copy_files, latency))
+            results.update(bench_models(client, app_module, tree, min(args.repeat, 5), latency))
+        app_module.stop_indexer()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        'meta': {
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+        },
+        'params': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+        'results': results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+        print(f"Report written to {args.output}")
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        rows, regressions = compare_reports(baseline, report, args.threshold)
+        for name, metric, old, value, change in rows:
+            flag = '  REGRESSION' if (name, metric, old, value, change) in regressions else ''
+            print(f"{name:34} {metric:18} {old:>14} -> {value:<14} {change:+.1%}{flag}")
+        if regressions:
+            print(f"{len(regressions)} figures regressed by more than {args.threshold:.0%}")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,71 @@
+"""Bills of materials resolved to the indexed part files, one lookup per line"""
+import io
+import csv
+from operator import attrgetter
+
+# Header names of the part number and quantity columns of BOM spreadsheets, compared lowercased
+PART_COLUMNS = ('part', 'part number', 'part_number', 'part no', 'part no.', 'partnumber', 'pn', 'item')
+QUANTITY_COLUMNS = ('qty', 'quantity', 'count')
+
+
+def read_csv(text):
+    """Return (part number, quantity or None) of every row of a CSV export of a BOM.
+
+    The part number column is found by its header, see PART_COLUMNS, and is
+    the first column of files without a known header. Comma, semicolon and
+    tab separated files are accepted. Rows without a part number are skipped.
+    """
+    try:
+        dialect = csv.Sniffer().sniff(text[:8192], delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel
+    rows = list(csv.reader(io.StringIO(text), dialect))
+    if not rows:
+        return []
+    header = [cell.strip().lower() for cell in rows[0]]
+    part_column = next((header.index(name) for name in PART_COLUMNS if name in header), None)
+    quantity_column = next((header.index(name) for name in QUANTITY_COLUMNS if name in header), None)
+    if part_column is None:
+        part_column = 0
+    else:
+        rows = rows[1:]
+    lines = []
+    for row in rows:
+        part = row[part_column].strip() if part_column < len(row) else ''
+        if not part:
+            continue
+        quantity = row[quantity_column].strip() if quantity_column is not None and quantity_column < len(row) else ''
+        lines.append((part, quantity or None))
+    return lines
+
+
+def resolve(name_index, parts, file_type=None, latest_only=False):
+    """Resolve part numbers to indexed files, returning one dict per part in input order.
+
+    Each has the part as given, how it matched (see NameIndex.resolve), its
+    matching entries newest first, reduced to the latest revision of each
+    part family with latest_only, and the latest indexed revision of its
+    part families as 'latest', even one it didn't match. Parts are looked up in dictionaries of the name index, so the
+    cost grows with the number of parts and matches, not with the number of
+    indexed files. Repeated parts are resolved once.
+    """
+    wanted_ext = f'.{file_type.lower()}' if file_type else None
+    entries = name_index.entries
+    resolved = {}
+    lines = []
+    for part in parts:
+        key = part.strip().lower()
+        if key not in resolved:
+            file_ids, matched_by = name_index.resolve(key)
+            if wanted_ext:
+                file_ids = [file_id for file_id in file_ids if entries[file_id].ext == wanted_ext]
+            if latest_only:
+                file_ids = name_index.latest(file_ids, by_type=bool(file_type))
+            matches = sorted((entries[file_id] for file_id in file_ids), key=attrgetter('mtime'), reverse=True)
+            # The newest revision the part's families have, even one the part didn't match
+            latest_ids = name_index.latest(file_ids, by_type=bool(file_type), family_wide=True)
+            latest = max((entries[file_id] for file_id in latest_ids), key=attrgetter('mtime'), default=None)
+            resolved[key] = (matches, latest, matched_by if matches else None)
+        matches, latest, matched_by = resolved[key]
+        lines.append({'part': part, 'matched_by': matched_by, 'matches': matches, 'latest': latest})
+    return lines
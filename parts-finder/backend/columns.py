@@ -0,0 +1,213 @@
+"""Compact, memory mapped columns of the indexed files of a category.
+
+A list of FileEntry tuples costs several hundred bytes per file in every
+server process: the tuple, the full path string repeating its directory,
+the name, the extension and boxed size and mtime. Columns keep each
+directory prefix once and the rest in flat arrays:
+
+    dir_ids   array of uint32, index into the interned directory prefixes
+    offsets   array of uint64, start of each name in the names buffer
+    names     all file names, UTF-8 encoded back to back
+    sizes     array of int64
+    mtimes    array of float64
+    ext_ids   array of uint16, index into the distinct extensions
+
+followed by the search data of the names, see name_postings. Written to a
+file, the columns are read through mmap, so every process of a
+multi-worker server maps the same pages from the OS page cache instead of
+holding its own copy. Entries are built on access, a FileEntry at a time.
+"""
+import os
+import sys
+import json
+import mmap
+import struct
+import tempfile
+import logging
+from array import array
+from collections.abc import Sequence
+from scanner import FileEntry
+import name_postings
+from name_postings import NamePostings, encode_postings
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'PFCOLS02'
+_HEADER = struct.Struct('<8sQ')
+# (name, typecode) of the columns, in file order
+COLUMNS = (('dir_ids', 'I'), ('offsets', 'Q'), ('sizes', 'q'), ('mtimes', 'd'), ('ext_ids', 'H'),
+           ('names', 'B'))
+# Followed by the search data of the names
+SECTIONS = COLUMNS + name_postings.SECTIONS
+# Lone surrogates stand for undecodable bytes in file names, keep them round-tripping
+_ERRORS = 'surrogatepass'
+
+
+def _align(offset):
+    return (offset + 7) & ~7
+
+
+def encode_columns(entries):
+    """Return the column file contents for a list of FileEntry"""
+    dirs = {}
+    exts = {}
+    exceptions = {}
+    columns = {name: array(typecode) for name, typecode in COLUMNS if name != 'names'}
+    names = bytearray()
+    file_names = []
+    offsets = columns['offsets']
+    offsets.append(0)
+    for index, entry in enumerate(entries):
+        path, name = entry.path, entry.name
+        if path.endswith(name):
+            prefix = path[:len(path) - len(name)]
+        else:
+            # Never the case for scanned files, kept whole rather than lost
+            prefix = ''
+            exceptions[index] = path
+        dir_id = dirs.get(prefix)
+        if dir_id is None:
+            dir_id = dirs[prefix] = len(dirs)
+        columns['dir_ids'].append(dir_id)
+        names += name.encode('utf-8', _ERRORS)
+        file_names.append(name)
+        offsets.append(len(names))
+        columns['sizes'].append(entry.size)
+        columns['mtimes'].append(entry.mtime)
+        ext_id = exts.get(entry.ext)
+        if ext_id is None:
+            ext_id = exts[entry.ext] = len(exts)
+        columns['ext_ids'].append(ext_id)
+
+    columns['names'] = bytes(names)
+    columns.update(encode_postings(file_names))
+    sections = {}
+    chunks = []
+    position = 0
+    for name, _ in SECTIONS:
+        data = bytes(columns[name])
+        sections[name] = (position, len(data))
+        chunks.append(data + b'\0' * (_align(len(data)) - len(data)))
+        position += _align(len(data))
+    header = json.dumps({
+        'count': len(offsets) - 1,
+        'byteorder': sys.byteorder,
+        'dirs': list(dirs),
+        'exts': list(exts),
+        'exceptions': exceptions,
+        'sections': sections,
+    }).encode('utf-8')
+    start = _HEADER.size + len(header)
+    return b''.join([_HEADER.pack(MAGIC, len(header)), header, b'\0' * (_align(start) - start)] + chunks)
+
+
+def write_columns(path, data):
+    """Write encoded columns to path, replacing any file there at once"""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+class FileColumns(Sequence):
+    """Read-only sequence of FileEntry backed by column data, see the module docstring"""
+
+    def __init__(self, buffer, path=None):
+        magic, header_size = _HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC:
+            raise ValueError('Not a file columns buffer')
+        header = json.loads(bytes(buffer[_HEADER.size:_HEADER.size + header_size]))
+        if header['byteorder'] != sys.byteorder:
+            raise ValueError('File columns were written on a machine of other byte order')
+        self.path = path
+        self._buffer = buffer
+        self._count = header['count']
+        self._dirs = header['dirs']
+        self._exts = header['exts']
+        self._exceptions = {int(index): path for index, path in header['exceptions'].items()}
+        base = _align(_HEADER.size + header_size)
+        view = memoryview(buffer)
+        self.mapped_bytes = len(view)
+        for name, typecode in SECTIONS:
+            offset, size = header['sections'][name]
+            section = view[base + offset:base + offset + size]
+            setattr(self, '_' + name, section if typecode == 'B' else section.cast(typecode))
+        self.postings = NamePostings({name: getattr(self, '_' + name) for name, _ in name_postings.SECTIONS},
+                                     buffer.find, base + header['sections']['lower_names'][0])
+
+    @classmethod
+    def build(cls, entries):
+        """Columns of a list of FileEntry, held in memory"""
+        return cls(encode_columns(entries))
+
+    @classmethod
+    def open(cls, path):
+        """Columns read from a file through a shared, read-only memory map"""
+        with open(path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(mapped, path)
+
+    def __len__(self):
+        return self._count
+
+    def _entry(self, index):
+        offsets = self._offsets
+        name = str(self._names[offsets[index]:offsets[index + 1]], 'utf-8', _ERRORS)
+        path = self._exceptions.get(index) or self._dirs[self._dir_ids[index]] + name
+        return FileEntry(path, name, self._exts[self._ext_ids[index]], self._sizes[index], self._mtimes[index])
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._entry(i) for i in range(*index.indices(self._count))]
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError('file columns index out of range')
+        return self._entry(index)
+
+    def __iter__(self):
+        # The hot loop of every full pass over the index, so everything is a local
+        names, offsets, dirs, dir_ids = self._names, self._offsets, self._dirs, self._dir_ids
+        exts, ext_ids, sizes, mtimes = self._exts, self._ext_ids, self._sizes, self._mtimes
+        exceptions = self._exceptions
+        start = 0
+        for index in range(self._count):
+            end = offsets[index + 1]
+            name = str(names[start:end], 'utf-8', _ERRORS)
+            start = end
+            path = exceptions.get(index) if exceptions else None
+            yield FileEntry(path or dirs[dir_ids[index]] + name, name, exts[ext_ids[index]],
+                            sizes[index], mtimes[index])
+
+    @property
+    def mtimes(self):
+        """The modification times alone, an array indexed like the entries"""
+        return self._mtimes
+
+    def names(self):
+        """Yield the file names alone, without building entries"""
+        names, offsets = self._names, self._offsets
+        for index in range(self._count):
+            yield str(names[offsets[index]:offsets[index + 1]], 'utf-8', _ERRORS)
+
+    def memory(self):
+        """Bytes held by the columns, the shared mapped data and this process's directory strings"""
+        heap = sum(sys.getsizeof(prefix) for prefix in self._dirs) + sys.getsizeof(self._dirs)
+        return {
+            'files': self._count,
+            'dirs': len(self._dirs),
+            'column_bytes': self.mapped_bytes,
+            # Mapped from a file, shared with the other processes mapping it
+            'shared': self.path is not None,
+            'heap_bytes': heap,
+            'bytes_per_file': round((self.mapped_bytes + heap) / self._count, 1) if self._count else 0,
+        }
@@ -11,6 +11,9 @@
     "documents": os.path.join('N:', 'Documents'),
 }
 
+def _split_patterns(value):
+    return [pattern for pattern in (value or '').split(';') if pattern] or None
+
 class Config:
     DEBUG = False
     TESTING = False
@@ -22,6 +25,79 @@ class Config:
         "aerospace": os.environ.get('AEROSPACE_DIR', DEFAULT_DIRECTORIES["aerospace"]),
         "documents": os.environ.get('DOCUMENTS_DIR', DEFAULT_DIRECTORIES["documents"]),
     }
+
+    # Persistent file index, loaded at startup instead of walking the drives
+    INDEX_PATH = os.environ.get('INDEX_PATH', os.path.join(BASE_DIR, 'index', 'file_index.db'))
+
+    # Background indexer: indexed data is kept at most this many seconds old,
+    # using filesystem events on local drives when watchdog is installed
+    INDEX_MAX_STALENESS = int(os.environ.get('INDEX_MAX_STALENESS', 60))
+    INDEX_USE_EVENTS = os.environ.get('INDEX_USE_EVENTS', 'true').lower() == 'true'
+    # Directory listings kept in flight at once while walking, raise for high-latency mounts
+    INDEX_SCAN_WORKERS = int(os.environ.get('INDEX_SCAN_WORKERS', 8))
+    # Seconds between checks of server worker processes for index changes made by
+    # the one worker running the indexer, see serve.py
+    INDEX_SYNC_INTERVAL = int(os.environ.get('INDEX_SYNC_INTERVAL', 10))
+
+    # Category drives are checked in the background every DRIVE_PROBE_INTERVAL seconds;
+    # one not answering within DRIVE_PROBE_TIMEOUT is reported down and requests
+    # needing it fail right away instead of waiting on the share
+    DRIVE_PROBE_INTERVAL = int(os.environ.get('DRIVE_PROBE_INTERVAL', 30))
+    DRIVE_PROBE_TIMEOUT = float(os.environ.get('DRIVE_PROBE_TIMEOUT', 5))
+
+    # Requests slower than this many milliseconds have their cProfile output written
+    # to PROFILE_DIR; 0 turns profiling off, which otherwise runs for every request
+    PROFILE_SLOW_REQUESTS_MS = int(os.environ.get('PROFILE_SLOW_REQUESTS_MS', 0))
+    PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(BASE_DIR, 'logs', 'profiles'))
+
+    # Production server (serve.py): processes, and request threads per process
+    SERVER_WORKERS = int(os.environ.get('SERVER_WORKERS', 4))
+    SERVER_THREADS = int(os.environ.get('SERVER_THREADS', 8))
+
+    # CPU time a relevance ranked search may spend scoring names, and the
+    # deepest it pages
+    SEARCH_RANK_BUDGET_MS = int(os.environ.get('SEARCH_RANK_BUDGET_MS', 50))
+    SEARCH_RANK_MAX_RESULTS = int(os.environ.get('SEARCH_RANK_MAX_RESULTS', 500))
+    # Results of recent searches kept for repeated ones, in megabytes over
+    # all cached searches, and how long in seconds; 0 turns caching off
+    SEARCH_CACHE_MAX_MB = int(os.environ.get('SEARCH_CACHE_MAX_MB', 32))
+    SEARCH_CACHE_TTL = int(os.environ.get('SEARCH_CACHE_TTL', 300))
+
+    # Processes extracting bounding box, area, volume and triangle count of
+    # indexed models in the background, 0 turns extraction off
+    GEOMETRY_WORKERS = int(os.environ.get('GEOMETRY_WORKERS', 2))
+    # Thumbnails rendered in the same pass for the search results
+    THUMBNAIL_DIR = os.environ.get('THUMBNAIL_DIR', os.path.join(BASE_DIR, 'cache', 'thumbnails'))
+    THUMBNAIL_SIZE = int(os.environ.get('THUMBNAIL_SIZE', 128))
+    # Processes hashing files that may be byte-identical copies of each other,
+    # 0 turns duplicate detection by content off
+    DUPLICATE_WORKERS = int(os.environ.get('DUPLICATE_WORKERS', 2))
+
+    # Background copy jobs for /api/copy
+    COPY_WORKERS = int(os.environ.get('COPY_WORKERS', 4))
+    COPY_JOBS_DIR = os.environ.get('COPY_JOBS_DIR', os.path.join(BASE_DIR, 'index', 'copy_jobs'))
+
+    # Deflate level for streamed ZIP downloads (1 = fastest, 9 = smallest)
+    ARCHIVE_COMPRESS_LEVEL = int(os.environ.get('ARCHIVE_COMPRESS_LEVEL', 6))
+
+    # Local cache of compressed, binary STL copies served to the viewer, least
+    # recently used files are removed once it grows past MODEL_CACHE_MAX_MB
+    MODEL_CACHE_DIR = os.environ.get('MODEL_CACHE_DIR', os.path.join(BASE_DIR, 'cache', 'models'))
+    MODEL_CACHE_MAX_MB = int(os.environ.get('MODEL_CACHE_MAX_MB', 2048))
+    # Triangle budgets of the decimated previews, requested budgets are rounded
+    # up to one of these so each level is built once per model
+    MODEL_LOD_LEVELS = sorted(int(level) for level in os.environ.get('MODEL_LOD_LEVELS', '20000,100000,500000').split(','))
+
+    # Regexes splitting file names into part family and revision for latest-only
+    # searches, separated by ';' and tried in order. Each needs a (?P<family>...)
+    # group and may have a (?P<version>...) group, e.g. (?P<family>.*?)-Rev(?P<version>[A-Z]+)
+    VERSION_PATTERNS = _split_patterns(os.environ.get('VERSION_PATTERNS'))
+    # Per category overrides, for shares that follow their own naming convention
+    CATEGORY_VERSION_PATTERNS = {
+        "motorcycle": _split_patterns(os.environ.get('MOTORCYCLE_VERSION_PATTERNS')),
+        "aerospace": _split_patterns(os.environ.get('AEROSPACE_VERSION_PATTERNS')),
+        "documents": _split_patterns(os.environ.get('DOCUMENTS_VERSION_PATTERNS')),
+    }
     
     # Ensure directories exist
     @classmethod
@@ -0,0 +1,301 @@
+"""Background copy jobs for /api/copy, run on a shared worker pool and resumable"""
+import os
+import re
+import json
+import shutil
+import threading
+import time
+import uuid
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from metrics import COPY_BYTES, COPY_THROUGHPUT
+
+logger = logging.getLogger(__name__)
+
+COPY_BUFFER_SIZE = 8 * 1024 * 1024
+PARTIAL_SUFFIX = '.partial'
+JOB_ID_PATTERN = re.compile(r'[0-9a-f]{32}')
+# Running jobs' state files are rewritten at least this often by the process running them,
+# a job whose state is older than HEARTBEAT_TIMEOUT was left behind by a process that died
+HEARTBEAT_INTERVAL = 10
+HEARTBEAT_TIMEOUT = 60
+
+
+def copy_file(source, target, offset=0, progress=None):
+    """Copy source to target starting at byte offset, calling progress(bytes) as data is written.
+
+    Uses copy_file_range where the OS has it, so the kernel moves the data
+    without it passing through Python, and large buffered reads otherwise.
+    """
+    with open(source, 'rb', buffering=0) as src, \
+            open(target, 'r+b' if offset else 'wb', buffering=0) as dst:
+        src.seek(offset)
+        dst.seek(offset)
+        dst.truncate()
+        if hasattr(os, 'copy_file_range'):
+            try:
+                while True:
+                    copied = os.copy_file_range(src.fileno(), dst.fileno(), COPY_BUFFER_SIZE)
+                    if not copied:
+                        return
+                    if progress:
+                        progress(copied)
+            except OSError:
+                # Not supported between these filesystems, carry on where the kernel stopped
+                src.seek(dst.tell())
+        buffer = bytearray(COPY_BUFFER_SIZE)
+        view = memoryview(buffer)
+        while True:
+            read = src.readinto(buffer)
+            if not read:
+                return
+            written = 0
+            while written < read:
+                written += dst.write(view[written:read])
+            if progress:
+                progress(read)
+
+
+class CopyJob:
+    """Files to copy into one target directory, with per-file state persisted for resuming"""
+
+    def __init__(self, job_id, target_dir, files, state_path):
+        self.id = job_id
+        self.target_dir = target_dir
+        # Each file: source, target, size, mtime, status (pending/done/failed), error
+        self.files = files
+        self.state_path = state_path
+        self.status = 'pending'
+        self.created = time.time()
+        self.finished = None
+        # Process running the job and when it last saved its state
+        self.owner = None
+        self.heartbeat = None
+        self.bytes_done = sum(f['size'] for f in files if f['status'] == 'done')
+        self._lock = threading.Lock()
+        self._remaining = 0
+
+    @classmethod
+    def load(cls, state_path, live=False):
+        """Read a job from its state file, live for a job another process may still be running"""
+        with open(state_path) as f:
+            state = json.load(f)
+        job = cls(state['id'], state['target_dir'], state['files'], state_path)
+        job.created = state['created']
+        job.finished = state['finished']
+        job.status = state['status']
+        job.owner = state.get('owner')
+        job.heartbeat = state.get('heartbeat')
+        if job.status in ('pending', 'running') and (
+                not live or time.time() - (job.heartbeat or 0) > HEARTBEAT_TIMEOUT):
+            # The process running this job stopped while it was copying
+            job.status = 'interrupted'
+        return job
+
+    def save(self):
+        with self._lock:
+            state = {
+                'id': self.id,
+                'target_dir': self.target_dir,
+                'files': self.files,
+                'status': self.status,
+                'created': self.created,
+                'finished': self.finished,
+                'owner': self.owner,
+                'heartbeat': time.time(),
+            }
+            tmp_path = self.state_path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(state, f)
+            os.replace(tmp_path, self.state_path)
+
+    def add_progress(self, count):
+        with self._lock:
+            self.bytes_done += count
+
+    def to_dict(self):
+        with self._lock:
+            files_done = sum(1 for f in self.files if f['status'] == 'done')
+            files_failed = sum(1 for f in self.files if f['status'] == 'failed')
+            return {
+                'job_id': self.id,
+                'status': self.status,
+                'target_dir': self.target_dir,
+                'files_total': len(self.files),
+                'files_done': files_done,
+                'files_failed': files_failed,
+                'bytes_total': sum(f['size'] for f in self.files),
+                'bytes_done': self.bytes_done,
+                'created': self.created,
+                'finished': self.finished,
+                'results': [
+                    {'file': os.path.basename(f['source']), 'success': f['status'] == 'done',
+                     'path': f['target'], 'error': f['error']}
+                    for f in self.files if f['status'] in ('done', 'failed')
+                ],
+            }
+
+
+class CopyJobManager:
+    """Runs copy jobs on a bounded pool and keeps their state on disk.
+
+    Every file is copied to a .partial file that is renamed into place once
+    complete, so resuming a failed or interrupted job skips finished files
+    and continues partial ones from where they stopped, as long as the
+    source is unchanged. Jobs can be followed and resumed from any process
+    sharing state_dir; the one running a job keeps its state file fresh, so
+    a job whose process died is seen as interrupted and can be resumed.
+    """
+
+    def __init__(self, state_dir, workers=4):
+        self.state_dir = state_dir
+        os.makedirs(state_dir, exist_ok=True)
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='copy')
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._heartbeat = None
+        for name in os.listdir(state_dir):
+            if name.endswith('.json'):
+                try:
+                    job = CopyJob.load(os.path.join(state_dir, name))
+                except (OSError, ValueError, KeyError) as e:
+                    logger.warning(f"Skipping unreadable copy job state {name}: {e}")
+                    continue
+                self._jobs[job.id] = job
+
+    def create(self, sources, target_dir):
+        """Plan a job copying sources into target_dir and start it.
+
+        sources are (path, expected size) pairs; sizes only seed the progress
+        totals, the sources themselves are first touched by the workers.
+        """
+        files = []
+        taken = set()
+        for source, size in sources:
+            file_name = os.path.basename(source)
+            target = os.path.join(target_dir, file_name)
+            # Never overwrite, neither files already there nor others in this job
+            if target in taken or os.path.exists(target):
+                base, ext = os.path.splitext(file_name)
+                counter = 1
+                while target in taken or os.path.exists(target):
+                    target = os.path.join(target_dir, f"{base}_{int(time.time())}_{counter}{ext}")
+                    counter += 1
+            taken.add(target)
+            files.append({
+                'source': source,
+                'target': target,
+                'size': size or 0,
+                'mtime': None,
+                'status': 'pending',
+                'error': None,
+            })
+        job_id = uuid.uuid4().hex
+        job = CopyJob(job_id, target_dir, files, os.path.join(self.state_dir, f'{job_id}.json'))
+        with self._lock:
+            self._jobs[job_id] = job
+        self._start(job)
+        return job
+
+    def get(self, job_id):
+        """Return a job, including ones started by other server processes sharing state_dir"""
+        job = self._jobs.get(job_id)
+        if job is not None and job.owner == os.getpid():
+            return job
+        if JOB_ID_PATTERN.fullmatch(job_id):
+            try:
+                # Another process may have resumed or finished it since
+                return CopyJob.load(os.path.join(self.state_dir, f'{job_id}.json'), live=True)
+            except (OSError, ValueError, KeyError):
+                pass
+        return job
+
+    def resume(self, job_id):
+        """Restart the unfinished files of a job, returns None if there is no such job"""
+        job = self.get(job_id)
+        if job is None:
+            return None
+        if job.status in ('pending', 'running'):
+            return job
+        with self._lock:
+            self._jobs[job.id] = job
+        for f in job.files:
+            if f['status'] == 'failed':
+                f['status'] = 'pending'
+                f['error'] = None
+        self._start(job)
+        return job
+
+    def _start(self, job):
+        os.makedirs(job.target_dir, exist_ok=True)
+        pending = [f for f in job.files if f['status'] == 'pending']
+        job.status = 'running'
+        job.owner = os.getpid()
+        job.finished = None
+        job.bytes_done = sum(f['size'] for f in job.files if f['status'] == 'done')
+        job._remaining = len(pending)
+        job.save()
+        if not pending:
+            self._finish(job)
+        for f in pending:
+            self._pool.submit(self._copy_one, job, f)
+        with self._lock:
+            if self._heartbeat is None or not self._heartbeat.is_alive():
+                self._heartbeat = threading.Thread(target=self._beat, name='copy-heartbeat', daemon=True)
+                self._heartbeat.start()
+
+    def _beat(self):
+        """Save the running jobs of this process every HEARTBEAT_INTERVAL, until none are left"""
+        while True:
+            time.sleep(HEARTBEAT_INTERVAL)
+            with self._lock:
+                running = [job for job in self._jobs.values()
+                           if job.status == 'running' and job.owner == os.getpid()]
+                if not running:
+                    self._heartbeat = None
+                    return
+            for job in running:
+                try:
+                    job.save()
+                except OSError as e:
+                    logger.warning(f"Could not save state of copy job {job.id}: {e}")
+
+    def _copy_one(self, job, f):
+        partial = f['target'] + PARTIAL_SUFFIX
+        try:
+            st = os.stat(f['source'])
+            offset = 0
+            if os.path.exists(partial) and st.st_size == f['size'] and st.st_mtime == f['mtime']:
+                offset = min(os.path.getsize(partial), st.st_size)
+                job.add_progress(offset)
+            f['size'], f['mtime'] = st.st_size, st.st_mtime
+            job.save()
+            start_time = time.perf_counter()
+            copy_file(f['source'], partial, offset, job.add_progress)
+            seconds = time.perf_counter() - start_time
+            shutil.copystat(f['source'], partial)
+            os.replace(partial, f['target'])
+            f['status'] = 'done'
+            COPY_BYTES.inc(st.st_size - offset)
+            if seconds:
+                COPY_THROUGHPUT.observe((st.st_size - offset) / seconds)
+        except Exception as e:
+            logger.error(f"Copy of {f['source']} failed: {e}")
+            f['status'] = 'failed'
+            f['error'] = str(e)
+        with job._lock:
+            job._remaining -= 1
+            last = job._remaining == 0
+        if last:
+            self._finish(job)
+        else:
+            job.save()
+
+    def _finish(self, job):
+        failed = any(f['status'] == 'failed' for f in job.files)
+        job.status = 'failed' if failed else 'done'
+        job.finished = time.time()
+        # Recount from the files, partial progress of failed files doesn't count
+        job.bytes_done = sum(f['size'] for f in job.files if f['status'] == 'done')
+        job.save()
+        logger.info(f"Copy job {job.id} finished: {job.status}")
@@ -0,0 +1,115 @@
+"""Background availability checks of the category drives, so requests never wait on a disconnected share"""
+import os
+import stat
+import time
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class DriveUnavailableError(OSError):
+    """Raised instead of touching a drive the prober last found unreachable"""
+
+
+class DriveProber(threading.Thread):
+    """Checks every category root on a schedule and caches the result.
+
+    Each check runs on a thread of its own and is given up on after timeout
+    seconds, since a stat on a disconnected SMB share can block for much
+    longer and can't be interrupted. While such a check is still stuck the
+    drive stays down and no further check of it is started, so a hung
+    share costs one thread rather than one per interval.
+
+    Drives count as available until their first check completes, so
+    requests are never refused just because the server is starting.
+    """
+
+    def __init__(self, directories, interval=30, timeout=5):
+        super().__init__(name='drive-prober', daemon=True)
+        self.directories = directories
+        self.interval = interval
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._state = {category: {'available': None, 'checked': None, 'latency_ms': None, 'error': None}
+                       for category in directories}
+        self._probes = {}
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.is_set():
+            self.probe()
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+
+    def probe(self):
+        """Check every root once, waiting at most timeout seconds in total"""
+        started = {}
+        for category, root in self.directories.items():
+            probe = self._probes.get(category)
+            if probe is not None and probe.is_alive():
+                # The previous check never came back, don't pile up more behind it
+                self._record(category, False, None, f"No response for {int(time.time() - probe.started)}s")
+                continue
+            probe = _Probe(root)
+            probe.start()
+            self._probes[category] = started[category] = probe
+        deadline = time.time() + self.timeout
+        for category, probe in started.items():
+            probe.join(max(0.0, deadline - time.time()))
+            if probe.is_alive():
+                self._record(category, False, None, f"No response within {self.timeout}s")
+            else:
+                self._record(category, probe.error is None, probe.latency, probe.error)
+
+    def _record(self, category, available, latency, error):
+        with self._lock:
+            state = self._state[category]
+            if state['available'] is not False and not available:
+                logger.error(f"Drive for {category} is not accessible: {self.directories[category]} ({error})")
+            elif state['available'] is False and available:
+                logger.info(f"Drive for {category} is accessible again: {self.directories[category]}")
+            state.update(available=available, checked=time.time(),
+                         latency_ms=None if latency is None else int(latency * 1000), error=error)
+
+    def is_available(self, category):
+        with self._lock:
+            state = self._state.get(category)
+            return state is None or state['available'] is not False
+
+    def check(self, category):
+        """Raise DriveUnavailableError if the drive of a category is down"""
+        if not self.is_available(category):
+            raise DriveUnavailableError(f"Drive for {category} is not accessible: {self.directories[category]}")
+
+    def status(self):
+        with self._lock:
+            return {category: dict(state) for category, state in self._state.items()}
+
+    def request_probe(self):
+        """Check every drive right away instead of at the next interval"""
+        self._wakeup.set()
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+
+
+class _Probe(threading.Thread):
+    """One availability check of a root directory"""
+
+    def __init__(self, root):
+        super().__init__(name=f'drive-probe {root}', daemon=True)
+        self.root = root
+        self.started = time.time()
+        self.latency = None
+        self.error = None
+
+    def run(self):
+        try:
+            if not stat.S_ISDIR(os.stat(self.root).st_mode):
+                self.error = 'Not a directory'
+        except OSError as e:
+            self.error = e.strerror or str(e)
+        self.latency = time.time() - self.started
@@ -0,0 +1,221 @@
+"""Byte-identical and same-shape copies of part files across all categories"""
+import time
+import hashlib
+import threading
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Bytes read from each end of a file for its partial hash
+PARTIAL_BYTES = 64 * 1024
+HASH_CHUNK = 1024 * 1024
+
+KINDS = ('content', 'geometry')
+
+
+def hash_file(path, size, full=False):
+    """Return (partial hash, full hash or None, error) of a file, run in the worker processes.
+
+    The partial hash covers the size and the first and last PARTIAL_BYTES.
+    Files that small are read whole, their partial hash is then the full one.
+    """
+    try:
+        with open(path, 'rb') as f:
+            if size <= 2 * PARTIAL_BYTES:
+                digest = hashlib.sha1(f.read()).hexdigest()
+                return digest, digest, None
+            partial = hashlib.sha1(str(size).encode('ascii'))
+            partial.update(f.read(PARTIAL_BYTES))
+            f.seek(-PARTIAL_BYTES, 2)
+            partial.update(f.read(PARTIAL_BYTES))
+            if not full:
+                return partial.hexdigest(), None, None
+            f.seek(0)
+            whole = hashlib.sha1()
+            for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+                whole.update(chunk)
+            return partial.hexdigest(), whole.hexdigest(), None
+    except OSError as e:
+        return '', None, str(e)
+
+
+def _hash_full(item):
+    return hash_file(*item, full=True)
+
+
+def _hash_partial(item):
+    return hash_file(*item)
+
+
+class DuplicateIndexer(threading.Thread):
+    """Hashes the indexed files that may have byte-identical copies, in a process pool.
+
+    Files with a size no other file has are never read. The rest get a
+    partial hash first, and only the ones whose partial hash collides are
+    read in full. Hashes are kept per file version, so only new or changed
+    files are hashed again.
+    """
+
+    def __init__(self, file_index, directories, workers=2, batch_size=256, interval=60):
+        super().__init__(name='duplicate-indexer', daemon=True)
+        self.file_index = file_index
+        self.directories = directories
+        self.workers = max(1, workers)
+        self.batch_size = batch_size
+        self.interval = interval
+        self.hashed = 0
+        self.failed = 0
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+
+    def run(self):
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            while not self._stopped.is_set():
+                partial_pending, full_pending = self.file_index.pending_hashes(self.directories)
+                if partial_pending:
+                    self._hash(pool, _hash_partial, [(entry, None) for entry in partial_pending])
+                    continue
+                if full_pending:
+                    self._hash(pool, _hash_full, full_pending)
+                    continue
+                self.file_index.prune_hashes()
+                self._wakeup.wait(self.interval)
+                self._wakeup.clear()
+
+    def _hash(self, pool, hash_function, pending):
+        start_time = time.time()
+        done = 0
+        for start in range(0, len(pending), self.batch_size):
+            if self._stopped.is_set():
+                break
+            batch = pending[start:start + self.batch_size]
+            results = []
+            for (entry, _), (partial, full, error) in zip(
+                    batch, pool.map(hash_function, [(entry.path, entry.size) for entry, _ in batch])):
+                if error:
+                    logger.warning(f"Could not hash {entry.path}: {error}")
+                    self.failed += 1
+                results.append((entry, partial, full))
+            self.file_index.store_hashes(results)
+            done += len(batch)
+        self.hashed += done
+        kind = 'full' if hash_function is _hash_full else 'partial'
+        logger.info(f"Computed {kind} hashes of {done} files in {int((time.time() - start_time) * 1000)}ms")
+
+    def notify(self, category=None):
+        """Look for new or changed files right away, used as the indexer's change callback"""
+        self._wakeup.set()
+
+    def status(self):
+        partial_pending, full_pending = self.file_index.pending_hashes(self.directories)
+        return {'alive': self.is_alive(), 'hashed': self.hashed, 'failed': self.failed,
+                'pending': len(partial_pending) + len(full_pending)}
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+
+
+_NO_CLUSTERS = ({kind: {} for kind in KINDS}, {kind: {} for kind in KINDS})
+
+
+class DuplicateClusters:
+    """Groups of indexed files with the same content hash or shape fingerprint.
+
+    Regrouping every file takes a while on a large index, so it never
+    happens on the request path: once the entries, content hashes or shape
+    fingerprints changed, the next use starts a rebuild in a background
+    thread, at most one every min_interval seconds, and the previous groups
+    are served until it's done. Until the first build is done there are no
+    groups, see ready. Clusters span all categories, each member is a
+    (category, entry) pair.
+    """
+
+    def __init__(self, file_index, directories, min_interval=2.0):
+        self.file_index = file_index
+        self.directories = directories
+        self.min_interval = min_interval
+        # Moves whenever new groups are in place
+        self.generation = 0
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._building = False
+        self._built_at = 0.0
+        self._state = None
+        self._snapshot = None
+
+    @property
+    def ready(self):
+        """True once the first build is in place, until then every file is without copies"""
+        return self._snapshot is not None
+
+    def _index_state(self):
+        file_index = self.file_index
+        return file_index.generation, file_index.hash_generation, file_index.fingerprint_generation
+
+    def _current(self):
+        state = self._index_state()
+        with self._lock:
+            snapshot = self._snapshot
+            start = not self._building and state != self._state
+            if start:
+                self._building = True
+        if start:
+            threading.Thread(target=self._rebuild, name='duplicate-clusters', daemon=True).start()
+        return snapshot if snapshot is not None else _NO_CLUSTERS
+
+    def _rebuild(self):
+        try:
+            delay = self._built_at + self.min_interval - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            self.refresh()
+        except Exception:
+            logger.exception('Could not group duplicate files')
+        finally:
+            with self._lock:
+                self._building = False
+
+    def refresh(self):
+        """Regroup the files if the index changed since the last build, returns whether it did"""
+        with self._build_lock:
+            state = self._index_state()
+            if state == self._state:
+                return False
+            start_time = time.time()
+            file_index = self.file_index
+            groups = {kind: {} for kind in KINDS}
+            for category in self.directories:
+                for entry in file_index.get_entries(category) or ():
+                    content = file_index.content_hash(entry)
+                    if content:
+                        groups['content'].setdefault(content, []).append((category, entry))
+                    fingerprint = file_index.get_fingerprint(entry)
+                    if fingerprint:
+                        groups['geometry'].setdefault(fingerprint, []).append((category, entry))
+            clusters = {kind: {key: members for key, members in group.items() if len(members) > 1}
+                        for kind, group in groups.items()}
+            keys = {kind: {entry.path: key for key, members in group.items() for _, entry in members}
+                    for kind, group in clusters.items()}
+            with self._lock:
+                self._state, self._snapshot = state, (clusters, keys)
+                self._built_at = time.time()
+                self.generation += 1
+            logger.info(f"Grouped {len(clusters['content'])} content and {len(clusters['geometry'])} "
+                        f"geometry duplicate clusters in {int((time.time() - start_time) * 1000)}ms")
+            return True
+
+    def clusters(self, kind):
+        """Return {key: [(category, entry), ...]} of the clusters of a kind"""
+        return self._current()[0][kind]
+
+    def keys(self, kind):
+        """Return {path: cluster key} of every file in a cluster of a kind"""
+        return self._current()[1][kind]
+
+    def copies(self, entry):
+        """Return the number of other files sharing an entry's content and shape"""
+        clusters, keys = self._current()
+        return {kind: len(clusters[kind][keys[kind][entry.path]]) - 1 if entry.path in keys[kind] else 0
+                for kind in KINDS}
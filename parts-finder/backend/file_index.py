@@ -0,0 +1,693 @@
+"""Persistent on-disk index of the part files found under each category root"""
+import os
+import re
+import sqlite3
+import threading
+import time
+import logging
+from contextlib import contextmanager
+from scanner import FileEntry, VALID_EXTENSIONS, ParallelScanner, scan_stats
+from metrics import SCAN_SECONDS, SCAN_FILES_PER_SECOND
+from geometry import Geometry
+from columns import FileColumns, encode_columns, write_columns
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS roots (
+    category TEXT PRIMARY KEY,
+    root TEXT NOT NULL,
+    scanned_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS files (
+    category TEXT NOT NULL,
+    path TEXT NOT NULL,
+    name TEXT NOT NULL,
+    ext TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    PRIMARY KEY (category, path)
+);
+CREATE TABLE IF NOT EXISTS dirs (
+    category TEXT NOT NULL,
+    path TEXT NOT NULL,
+    mtime REAL NOT NULL,
+    PRIMARY KEY (category, path)
+);
+CREATE TABLE IF NOT EXISTS geometry (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    triangles INTEGER,
+    min_x REAL,
+    min_y REAL,
+    min_z REAL,
+    max_x REAL,
+    max_y REAL,
+    max_z REAL,
+    area REAL,
+    volume REAL,
+    thumbnail TEXT,
+    fingerprint TEXT
+);
+CREATE TABLE IF NOT EXISTS hashes (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    partial TEXT NOT NULL,
+    full TEXT
+);
+CREATE TABLE IF NOT EXISTS versions (
+    name TEXT PRIMARY KEY,
+    version INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS refresh_requests (
+    mode TEXT PRIMARY KEY,
+    requested_at REAL NOT NULL
+);
+"""
+
+# Names under which geometry and content hash changes are counted in the versions table
+GEOMETRY_VERSION = ':geometry'
+HASHES_VERSION = ':hashes'
+
+# Let SQLite read the database through a shared memory map, so several
+# server processes reading the same index use the same cached pages
+SQLITE_MMAP_SIZE = 256 * 1024 * 1024
+
+
+def _fingerprint(stored):
+    """(size, mtime, fingerprint) of a stored geometry row, None without a fingerprint"""
+    if stored is None or not stored[4]:
+        return None
+    return stored[0], stored[1], stored[4]
+
+
+def _fingerprints(geometry):
+    return {path: _fingerprint(stored) for path, stored in geometry.items() if stored[4]}
+
+
+class FileIndex:
+    """File listings per category, kept in memory and persisted to SQLite.
+
+    The in-memory lists are replaced wholesale on every rebuild, so readers
+    can use whatever list they got from get_entries() without locking. They
+    are FileColumns, each category's files written to a column file per
+    version next to the database and memory mapped, so the processes of a
+    multi-worker server share one copy of them.
+    """
+
+    def __init__(self, db_path, scanner=None):
+        self.db_path = db_path
+        self.columns_dir = db_path + '-columns'
+        self.scanner = scanner or ParallelScanner()
+        # Throughput of the last scan of each category, see scanner.scan_stats()
+        self.scan_stats = {}
+        # Guards the in-memory state, only ever held to read or swap it, as searches wait on it
+        self._lock = threading.Lock()
+        # Serializes writes to the database and to the persisted versions, held through them
+        self._write_lock = threading.Lock()
+        self._scan_lock = threading.Lock()
+        self._entries = {}
+        self._dirs = {}
+        self._roots = {}
+        self._generation = 0
+        self._generations = {}
+        # {path: (size, mtime, Geometry or None if extraction failed,
+        #         thumbnail digest, '' if rendering failed, None if never rendered,
+        #         shape fingerprint, '' if extraction failed, None if never computed)}
+        self._geometry = {}
+        # Moves whenever geometry is stored, separately from the entry generations
+        # so new geometry doesn't cause the name indexes to be rebuilt
+        self.geometry_generation = 0
+        # Moves only when a stored shape fingerprint changes, for the duplicate clusters
+        self.fingerprint_generation = 0
+        # {path: (size, mtime, partial hash, full hash or None)} of files whose
+        # size another file shares, the only ones that can be duplicates
+        self._hashes = {}
+        self.hash_generation = 0
+        # Change counters persisted per category (and for geometry), so other
+        # processes sharing the database can tell what to reload, see sync()
+        self._versions = {}
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+            columns = {row[1] for row in conn.execute('PRAGMA table_info(geometry)')}
+            if 'thumbnail' not in columns:
+                # Indexes from before thumbnails were rendered, their files get rendered once
+                conn.execute('ALTER TABLE geometry ADD COLUMN thumbnail TEXT')
+            if 'fingerprint' not in columns:
+                conn.execute('ALTER TABLE geometry ADD COLUMN fingerprint TEXT')
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(f'PRAGMA mmap_size={SQLITE_MMAP_SIZE}')
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def load(self):
+        """Load every persisted category into memory, returns the number of files loaded"""
+        start_time = time.time()
+        with self._connect() as conn:
+            conn.execute('BEGIN')
+            versions = dict(conn.execute('SELECT name, version FROM versions'))
+            roots = dict(conn.execute('SELECT category, root FROM roots'))
+            loaded = {category: self._read_category(conn, category, versions.get(category)) for category in roots}
+            geometry = self._read_geometry(conn)
+            hashes = self._read_hashes(conn)
+        with self._lock:
+            self._versions = versions
+            self._geometry = geometry
+            self.geometry_generation += 1
+            self.fingerprint_generation += 1
+            self._hashes = hashes
+            self.hash_generation += 1
+            self._roots = roots
+            self._entries = {category: entries for category, (entries, _) in loaded.items()}
+            self._dirs = {category: dirs for category, (_, dirs) in loaded.items()}
+            for category in loaded:
+                self._bump_generation(category)
+        total = sum(len(entries) for entries, _ in loaded.values())
+        logger.info(f"Loaded {total} indexed files for {len(loaded)} categories "
+                    f"in {int((time.time() - start_time) * 1000)}ms")
+        return total
+
+    def sync(self):
+        """Reload what another process sharing the database has changed, returns the names reloaded.
+
+        Only categories (or the geometry) whose persisted version moved since
+        this process last loaded or wrote them are read again.
+        """
+        # Not while this process writes, its versions move before its writes are committed
+        with self._write_lock:
+            return self._sync()
+
+    def _sync(self):
+        with self._connect() as conn:
+            conn.execute('BEGIN')
+            versions = dict(conn.execute('SELECT name, version FROM versions'))
+            changed = [name for name, version in versions.items() if self._versions.get(name) != version]
+            if not changed:
+                return []
+            roots = dict(conn.execute('SELECT category, root FROM roots'))
+            loaded = {name: self._read_category(conn, name, versions[name]) for name in changed if name in roots}
+            geometry = self._read_geometry(conn) if GEOMETRY_VERSION in changed else None
+            hashes = self._read_hashes(conn) if HASHES_VERSION in changed else None
+        with self._lock:
+            for name in changed:
+                self._versions[name] = versions[name]
+            for category, (entries, dirs) in loaded.items():
+                self._roots[category] = roots[category]
+                self._entries[category] = entries
+                self._dirs[category] = dirs
+                self._bump_generation(category)
+            if geometry is not None:
+                if _fingerprints(geometry) != _fingerprints(self._geometry):
+                    self.fingerprint_generation += 1
+                self._geometry = geometry
+                self.geometry_generation += 1
+            if hashes is not None:
+                self._hashes = hashes
+                self.hash_generation += 1
+        logger.info(f"Reloaded {', '.join(changed)} changed by another process")
+        return changed
+
+    def _read_category(self, conn, category, version):
+        dirs = dict(conn.execute('SELECT path, mtime FROM dirs WHERE category = ?', (category,)))
+        if version is not None:
+            try:
+                return FileColumns.open(self._columns_path(category, version)), dirs
+            except (OSError, ValueError):
+                # Missing when the version was written by an older release or a process that couldn't
+                pass
+        rows = conn.execute('SELECT path, name, ext, size, mtime FROM files WHERE category = ?', (category,))
+        entries = [FileEntry(*row) for row in rows]
+        return self._columns(category, version, encode_columns(entries)), dirs
+
+    def _columns_path(self, category, version):
+        return os.path.join(self.columns_dir, f"{re.sub(r'[^A-Za-z0-9_-]', '_', category)}.{version}.cols")
+
+    def _columns(self, category, version, data):
+        """Write encoded columns for a version of a category and map them, kept in memory if that fails"""
+        if version is not None:
+            path = self._columns_path(category, version)
+            try:
+                write_columns(path, data)
+                return FileColumns.open(path)
+            except OSError as e:
+                logger.warning(f"Could not write file columns {path}, keeping them in memory: {e}")
+        return FileColumns(data)
+
+    def _remove_old_columns(self, category):
+        """Delete the column files of earlier versions of a category.
+
+        Processes still using one keep their mapping; on Windows a mapped file
+        can't be deleted, it is retried after the next change.
+        """
+        current = os.path.basename(self._columns_path(category, self._versions.get(category)))
+        prefix = current[:current.index('.') + 1]
+        try:
+            names = os.listdir(self.columns_dir)
+        except OSError:
+            return
+        for name in names:
+            if name.startswith(prefix) and name != current and name[len(prefix):].split('.')[0].isdigit():
+                try:
+                    os.remove(os.path.join(self.columns_dir, name))
+                except OSError:
+                    pass
+
+    @staticmethod
+    def _read_geometry(conn):
+        return {
+            row[0]: (row[1], row[2], None if row[3] is None else Geometry(*row[3:12]), row[12], row[13])
+            for row in conn.execute(
+                'SELECT path, size, mtime, triangles, min_x, min_y, min_z, max_x, max_y, max_z, '
+                'area, volume, thumbnail, fingerprint FROM geometry'
+            )
+        }
+
+    @staticmethod
+    def _read_hashes(conn):
+        return {row[0]: row[1:] for row in conn.execute('SELECT path, size, mtime, partial, full FROM hashes')}
+
+    def _bump_version(self, conn, name):
+        conn.execute('INSERT OR IGNORE INTO versions (name, version) VALUES (?, 0)', (name,))
+        conn.execute('UPDATE versions SET version = version + 1 WHERE name = ?', (name,))
+        self._versions[name] = conn.execute('SELECT version FROM versions WHERE name = ?', (name,)).fetchone()[0]
+
+    def is_indexed(self, category, root):
+        return category in self._entries and self._roots.get(category) == root
+
+    def request_refresh(self, full=False):
+        """Ask whichever process runs the background indexer for a refresh, see take_refresh_request()"""
+        with self._connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO refresh_requests (mode, requested_at) VALUES (?, ?)',
+                         ('full' if full else 'incremental', time.time()))
+
+    def take_refresh_request(self):
+        """Return 'full', 'incremental' or None for the refreshes asked for since the last call"""
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            modes = {mode for mode, in conn.execute('SELECT mode FROM refresh_requests')}
+            if modes:
+                conn.execute('DELETE FROM refresh_requests')
+        if 'full' in modes:
+            return 'full'
+        return 'incremental' if modes else None
+
+    def get_entries(self, category):
+        """Return the indexed files for a category, or None if it has never been scanned"""
+        return self._entries.get(category)
+
+    def memory(self, category):
+        """Return the memory held by a category's columns, see FileColumns.memory()"""
+        entries = self._entries.get(category)
+        return entries.memory() if entries is not None else None
+
+    @property
+    def generation(self):
+        """Moves whenever the entries of any category change"""
+        return self._generation
+
+    def snapshot(self, category):
+        """Return (generation, entries) for a category, the generation moves whenever its entries change"""
+        with self._lock:
+            return self._generations.get(category, 0), self._entries.get(category)
+
+    def _bump_generation(self, category):
+        self._generation += 1
+        self._generations[category] = self._generation
+
+    def rebuild(self, category, root):
+        """Walk a category root from scratch and replace its indexed files"""
+        results, errors = self.rebuild_many({category: root})
+        if category in errors:
+            raise errors[category]
+        return results[category]
+
+    def rebuild_many(self, roots):
+        """Walk several category roots from scratch at once, sharing one scanner pool.
+
+        Returns ({category: entries}, {category: error}) so one offline drive
+        doesn't stop the others from being indexed.
+        """
+        with self._scan_lock:
+            return self._rebuild_many(roots)
+
+    def _rebuild_many(self, roots):
+        errors = {}
+        root_mtimes = self.scanner.stat_dirs(roots.values())
+        for category, root in roots.items():
+            if root_mtimes[root] is None:
+                # Never replace a good index with an empty one because a drive is offline
+                errors[category] = FileNotFoundError(f"Directory not found or not accessible: {root}")
+        reachable = {category: root for category, root in roots.items() if category not in errors}
+        listings, failed, seconds = self.scanner.walk(set(reachable.values()))
+
+        results = {}
+        for category, root in reachable.items():
+            if root in failed:
+                errors[category] = failed[root]
+                continue
+            prefix = os.path.join(root, '')
+            tree = {path: listing for path, listing in listings.items()
+                    if path == root or path.startswith(prefix)}
+            entries = [entry for listing in tree.values() for entry in listing.entries]
+            dirs = {root: root_mtimes[root]}
+            for listing in tree.values():
+                dirs.update(listing.subdirs)
+            for path in failed:
+                dirs.pop(path, None)
+            self._store_full(category, root, entries, dirs)
+            self.scan_stats[category] = scan_stats(
+                tree.values(), seconds, self.scanner.workers,
+                errors=sum(1 for path in failed if path.startswith(prefix))
+            )
+            results[category] = entries
+            SCAN_SECONDS.observe(seconds, category, 'full')
+            if seconds:
+                SCAN_FILES_PER_SECOND.observe(len(entries) / seconds, category)
+            logger.info(f"Indexed {len(entries)} files for {category} in {int(seconds * 1000)}ms "
+                        f"({self.scan_stats[category]['dirs_per_second']} dirs/s)")
+        return results, errors
+
+    def _store_full(self, category, root, entries, dirs):
+        data = encode_columns(entries)
+        with self._write_lock:
+            with self._connect() as conn:
+                conn.execute('DELETE FROM files WHERE category = ?', (category,))
+                conn.execute('DELETE FROM dirs WHERE category = ?', (category,))
+                conn.executemany(
+                    'INSERT INTO files (category, path, name, ext, size, mtime) VALUES (?, ?, ?, ?, ?, ?)',
+                    ((category,) + tuple(entry) for entry in entries)
+                )
+                conn.executemany(
+                    'INSERT INTO dirs (category, path, mtime) VALUES (?, ?, ?)',
+                    ((category, path, mtime) for path, mtime in dirs.items())
+                )
+                self._mark_scanned(conn, category, root)
+                self._bump_version(conn, category)
+                # Written before the version is committed, so other processes seeing it find the file
+                stored = self._columns(category, self._versions[category], data)
+            with self._lock:
+                self._entries[category] = stored
+                self._dirs[category] = dirs
+                self._roots[category] = root
+                self._bump_generation(category)
+        self._remove_old_columns(category)
+
+    def refresh(self, category, root, dirs=None, relist_all=False):
+        """Bring a category up to date by rescanning only the directories whose mtime moved.
+
+        A directory's mtime changes when entries are added, removed or renamed
+        in it, so unchanged directories keep their indexed files as they are.
+        Files rewritten in place without touching their directory are only
+        picked up by a full rebuild(), by passing the directories reported
+        by a filesystem watcher as `dirs`, which are relisted unconditionally,
+        or with relist_all, which relists every known directory and, unlike
+        rebuild(), only stores and reports the files that differ.
+        Returns added/removed/changed counts.
+        """
+        with self._scan_lock:
+            if not self.is_indexed(category, root):
+                results, errors = self._rebuild_many({category: root})
+                if category in errors:
+                    raise errors[category]
+                return {'added': len(results[category]), 'removed': 0, 'changed': 0,
+                        'dirs_rescanned': len(self._dirs[category]), 'full_rescan': True}
+            start_time = time.perf_counter()
+            counts = self._refresh(category, root, list(self._dirs[category]) if relist_all else dirs)
+            counts['full_rescan'] = relist_all
+            SCAN_SECONDS.observe(time.perf_counter() - start_time, category, 'incremental')
+            return counts
+
+    def _refresh(self, category, root, dirs):
+        start_time = time.time()
+        old_dirs = self._dirs[category]
+        if dirs is None:
+            candidates = old_dirs
+        else:
+            candidates = {path: old_dirs[path] for path in dirs if path in old_dirs}
+        current_mtimes = self.scanner.stat_dirs(candidates)
+        if current_mtimes.get(root, True) is None:
+            raise FileNotFoundError(f"Directory not found or not accessible: {root}")
+
+        new_dirs = dict(old_dirs)
+        pending = []
+        for path, mtime in candidates.items():
+            current = current_mtimes[path]
+            if current is None:
+                del new_dirs[path]
+                continue
+            new_dirs[path] = current
+            if dirs is not None or current != mtime:
+                pending.append(path)
+
+        # Relist changed directories in parallel, descending only into subdirectories never seen before
+        listings, failed, seconds = self.scanner.walk(pending, known_dirs=new_dirs)
+        for path in failed:
+            new_dirs.pop(path, None)
+        rescanned = set(listings)
+        listed_subdirs = set()
+        fresh_entries = []
+        for listing in listings.values():
+            fresh_entries.extend(listing.entries)
+            listed_subdirs.update(listing.subdirs)
+            for subdir, mtime in listing.subdirs.items():
+                new_dirs.setdefault(subdir, mtime)
+
+        # Known subdirectories missing from a relisted parent are gone along with their subtrees
+        vanished = tuple(
+            path for path in new_dirs
+            if path != root and path not in listed_subdirs and os.path.dirname(path) in rescanned
+        )
+        if vanished:
+            prefixes = tuple(os.path.join(path, '') for path in vanished)
+            for path in [path for path in new_dirs if path in vanished or path.startswith(prefixes)]:
+                del new_dirs[path]
+
+        stale_dirs = rescanned | (old_dirs.keys() - new_dirs.keys())
+        if not stale_dirs:
+            return {'added': 0, 'removed': 0, 'changed': 0,
+                    'dirs_rescanned': 0, 'full_rescan': False}
+
+        kept = []
+        dropped = {}
+        for entry in self._entries[category]:
+            if os.path.dirname(entry.path) in stale_dirs:
+                dropped[entry.path] = entry
+            else:
+                kept.append(entry)
+        fresh = {entry.path: entry for entry in fresh_entries}
+
+        added = [entry for path, entry in fresh.items() if path not in dropped]
+        changed = [entry for path, entry in fresh.items()
+                   if path in dropped and entry != dropped[path]]
+        removed = [path for path in dropped if path not in fresh]
+        data = encode_columns(kept + list(fresh.values())) if added or removed or changed else None
+
+        with self._write_lock:
+            with self._connect() as conn:
+                conn.executemany(
+                    'DELETE FROM files WHERE category = ? AND path = ?',
+                    ((category, path) for path in removed)
+                )
+                conn.executemany(
+                    'INSERT OR REPLACE INTO files (category, path, name, ext, size, mtime) VALUES (?, ?, ?, ?, ?, ?)',
+                    ((category,) + tuple(entry) for entry in added + changed)
+                )
+                conn.executemany(
+                    'DELETE FROM dirs WHERE category = ? AND path = ?',
+                    ((category, path) for path in old_dirs.keys() - new_dirs.keys())
+                )
+                conn.executemany(
+                    'INSERT OR REPLACE INTO dirs (category, path, mtime) VALUES (?, ?, ?)',
+                    ((category, path, mtime) for path, mtime in new_dirs.items()
+                     if old_dirs.get(path) != mtime)
+                )
+                self._mark_scanned(conn, category, root)
+                if data is not None:
+                    self._bump_version(conn, category)
+                    stored = self._columns(category, self._versions[category], data)
+            with self._lock:
+                self._dirs[category] = new_dirs
+                if data is not None:
+                    self._entries[category] = stored
+                    self._bump_generation(category)
+        if data is not None:
+            self._remove_old_columns(category)
+
+        logger.info(f"Refreshed {category}: {len(rescanned)} directories rescanned, "
+                    f"{len(added)} added, {len(removed)} removed, {len(changed)} changed "
+                    f"in {int((time.time() - start_time) * 1000)}ms")
+        return {'added': len(added), 'removed': len(removed), 'changed': len(changed),
+                'dirs_rescanned': len(rescanned), 'full_rescan': False}
+
+    def _mark_scanned(self, conn, category, root):
+        conn.execute(
+            'INSERT OR REPLACE INTO roots (category, root, scanned_at) VALUES (?, ?, ?)',
+            (category, root, time.time())
+        )
+
+    def get_geometry(self, entry):
+        """Return the Geometry extracted for an entry, None if there is none for its current version"""
+        stored = self._geometry.get(entry.path)
+        if stored is None or stored[0] != entry.size or stored[1] != entry.mtime:
+            return None
+        return stored[2]
+
+    def get_thumbnail(self, entry):
+        """Return the thumbnail digest of an entry's current version, None if there is none"""
+        stored = self._geometry.get(entry.path)
+        if stored is None or stored[0] != entry.size or stored[1] != entry.mtime:
+            return None
+        return stored[3] or None
+
+    def thumbnail_digests(self):
+        return {stored[3] for stored in list(self._geometry.values()) if stored[3]}
+
+    def pending_geometry(self, categories):
+        """Return the entries of categories whose current version has not been analyzed yet"""
+        geometry = self._geometry
+        pending = []
+        for category in categories:
+            for entry in self._entries.get(category) or ():
+                stored = geometry.get(entry.path)
+                if (stored is None or stored[0] != entry.size or stored[1] != entry.mtime
+                        or stored[3] is None or stored[4] is None):
+                    pending.append(entry)
+        return pending
+
+    def store_geometry(self, results):
+        """Persist (entry, Geometry or None, thumbnail digest, fingerprint) results.
+
+        A None geometry marks a file extraction failed for, an empty digest
+        one whose thumbnail couldn't be rendered.
+        """
+        rows = [(entry.path, entry.size, entry.mtime)
+                + (tuple(geometry) if geometry else (None,) * 9) + (thumbnail or '', fingerprint or '')
+                for entry, geometry, thumbnail, fingerprint in results]
+        with self._write_lock:
+            with self._connect() as conn:
+                conn.executemany(
+                    'INSERT OR REPLACE INTO geometry (path, size, mtime, triangles, min_x, min_y, min_z, '
+                    'max_x, max_y, max_z, area, volume, thumbnail, fingerprint) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows
+                )
+                self._bump_version(conn, GEOMETRY_VERSION)
+            with self._lock:
+                fingerprints_changed = False
+                for entry, geometry, thumbnail, fingerprint in results:
+                    stored = (entry.size, entry.mtime, geometry, thumbnail or '', fingerprint or '')
+                    if _fingerprint(stored) != _fingerprint(self._geometry.get(entry.path)):
+                        fingerprints_changed = True
+                    self._geometry[entry.path] = stored
+                self.geometry_generation += 1
+                if fingerprints_changed:
+                    self.fingerprint_generation += 1
+
+    def get_fingerprint(self, entry):
+        """Return the shape fingerprint of an entry's current version, None if there is none"""
+        stored = self._geometry.get(entry.path)
+        if stored is None or stored[0] != entry.size or stored[1] != entry.mtime:
+            return None
+        return stored[4] or None
+
+    def prune_geometry(self):
+        """Forget the geometry of files that are no longer indexed"""
+        with self._write_lock:
+            indexed = self._indexed_paths()
+            gone = [path for path in self._geometry if path not in indexed]
+            if not gone:
+                return 0
+            with self._connect() as conn:
+                conn.executemany('DELETE FROM geometry WHERE path = ?', ((path,) for path in gone))
+                self._bump_version(conn, GEOMETRY_VERSION)
+            with self._lock:
+                if any(_fingerprint(self._geometry[path]) for path in gone):
+                    self.fingerprint_generation += 1
+                for path in gone:
+                    del self._geometry[path]
+                self.geometry_generation += 1
+        return len(gone)
+
+    def _indexed_paths(self):
+        with self._lock:
+            categories = list(self._entries.values())
+        return {entry.path for entries in categories for entry in entries}
+
+    def content_hash(self, entry):
+        """Return the full content hash of an entry's current version, None if it has none.
+
+        Only files that share their size and first and last bytes with
+        another file are hashed in full, so every other file has no hash.
+        """
+        stored = self._hashes.get(entry.path)
+        if stored is None or stored[0] != entry.size or stored[1] != entry.mtime:
+            return None
+        return stored[3] or None
+
+    def pending_hashes(self, categories):
+        """Return (entries needing a partial hash, (entry, partial hash) pairs needing a full hash).
+
+        Files are bucketed by size across all categories first; only those in
+        a bucket with another file get a partial hash of their first and last
+        bytes, and only those whose partial hash collides get a full one.
+        """
+        hashes = self._hashes
+        by_size = {}
+        for category in categories:
+            for entry in self._entries.get(category) or ():
+                if entry.size:
+                    by_size.setdefault(entry.size, []).append(entry)
+        partial_pending = []
+        by_partial = {}
+        for bucket in by_size.values():
+            if len(bucket) < 2:
+                continue
+            for entry in bucket:
+                stored = hashes.get(entry.path)
+                if stored is None or stored[0] != entry.size or stored[1] != entry.mtime:
+                    partial_pending.append(entry)
+                elif stored[2]:
+                    by_partial.setdefault((entry.size, stored[2]), []).append((entry, stored))
+        full_pending = [(entry, stored[2]) for group in by_partial.values() if len(group) > 1
+                        for entry, stored in group if stored[3] is None]
+        return partial_pending, full_pending
+
+    def store_hashes(self, results):
+        """Persist (entry, partial hash, full hash or None) results, '' partial hashes mark failed files"""
+        with self._write_lock:
+            with self._connect() as conn:
+                conn.executemany(
+                    'INSERT OR REPLACE INTO hashes (path, size, mtime, partial, full) VALUES (?, ?, ?, ?, ?)',
+                    ((entry.path, entry.size, entry.mtime, partial, full) for entry, partial, full in results)
+                )
+                self._bump_version(conn, HASHES_VERSION)
+            with self._lock:
+                for entry, partial, full in results:
+                    self._hashes[entry.path] = (entry.size, entry.mtime, partial, full)
+                self.hash_generation += 1
+
+    def prune_hashes(self):
+        """Forget the hashes of files that are no longer indexed"""
+        with self._write_lock:
+            indexed = self._indexed_paths()
+            gone = [path for path in self._hashes if path not in indexed]
+            if not gone:
+                return 0
+            with self._connect() as conn:
+                conn.executemany('DELETE FROM hashes WHERE path = ?', ((path,) for path in gone))
+                self._bump_version(conn, HASHES_VERSION)
+            with self._lock:
+                for path in gone:
+                    del self._hashes[path]
+                self.hash_generation += 1
+        return len(gone)
@@ -0,0 +1,336 @@
+"""Geometry metadata and thumbnails of part files, extracted in the background and kept in the file index"""
+import time
+import hashlib
+import threading
+import logging
+from collections import namedtuple
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+from mesh import STL_DTYPE, STL_HEADER_SIZE, decimate, load_3mf, load_model, stl_triangle_count
+from thumbnails import MAX_RENDER_TRIANGLES, ThumbnailStore, render_thumbnail, encode_png
+
+logger = logging.getLogger(__name__)
+
+Geometry = namedtuple('Geometry', ['triangles', 'min_x', 'min_y', 'min_z',
+                                   'max_x', 'max_y', 'max_z', 'area', 'volume'])
+
+# Triangles converted to float64 at a time, a few MB per step of the sums
+CHUNK_TRIANGLES = 1 << 16
+
+# Seconds between sweeps removing thumbnails no indexed file uses anymore
+THUMBNAIL_PRUNE_INTERVAL = 3600
+
+# Decimals kept of the size-normalized figures in a fingerprint, coarse enough
+# that float noise from re-exporting a mesh doesn't change it
+FINGERPRINT_DECIMALS = 4
+
+# Search filter fields, all lengths in millimetres
+FILTER_FIELDS = {
+    'extent_x': lambda g: g.max_x - g.min_x,
+    'extent_y': lambda g: g.max_y - g.min_y,
+    'extent_z': lambda g: g.max_z - g.min_z,
+    'max_extent': lambda g: max(g.max_x - g.min_x, g.max_y - g.min_y, g.max_z - g.min_z),
+    'triangles': lambda g: g.triangles,
+    'area': lambda g: g.area,
+    'volume': lambda g: g.volume,
+}
+
+
+class _Accumulator:
+    """Bounding box, surface area and signed volume summed over chunks of triangles"""
+
+    def __init__(self):
+        self.triangles = 0
+        self.low = np.full(3, np.inf)
+        self.high = np.full(3, -np.inf)
+        self.area = 0.0
+        self.volume = 0.0
+
+    def add(self, triangles):
+        if not len(triangles):
+            return
+        triangles = triangles.astype(np.float64)
+        points = triangles.reshape(-1, 3)
+        self.low = np.minimum(self.low, points.min(axis=0))
+        self.high = np.maximum(self.high, points.max(axis=0))
+        a, b, c = triangles[:, 0], triangles[:, 1], triangles[:, 2]
+        self.area += 0.5 * float(np.linalg.norm(np.cross(b - a, c - a), axis=1).sum())
+        # Sum of signed tetrahedra against the origin, exact for closed meshes
+        self.volume += float(np.einsum('ij,ij->', a, np.cross(b, c))) / 6.0
+        self.triangles += len(triangles)
+
+    def result(self):
+        if not self.triangles:
+            return Geometry(0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0)
+        return Geometry(self.triangles, *self.low.tolist(), *self.high.tolist(),
+                        self.area, abs(self.volume))
+
+
+def mesh_geometry(triangles):
+    """Geometry of an (n, 3, 3) array of triangles"""
+    totals = _Accumulator()
+    for start in range(0, len(triangles), CHUNK_TRIANGLES):
+        totals.add(triangles[start:start + CHUNK_TRIANGLES])
+    return totals.result()
+
+
+def model_triangles(path):
+    """Triangles of a model file, for binary STLs a view of a memory map of the file.
+
+    Everything computed from them takes CHUNK_TRIANGLES at a time, so only
+    the pages of the current chunk of a binary STL are held in memory.
+    """
+    count = stl_triangle_count(path) if path.lower().endswith('.stl') else None
+    if not count:
+        return load_model(path)
+    return np.memmap(path, STL_DTYPE, 'r', offset=STL_HEADER_SIZE + 4, shape=(count,))['vertices']
+
+
+def thumbnail_triangles(triangles):
+    """Triangles to render a thumbnail from, decimated a chunk at a time when there are more than a renderer takes"""
+    if len(triangles) <= MAX_RENDER_TRIANGLES:
+        return np.asarray(triangles)
+    chunks = range(0, len(triangles), CHUNK_TRIANGLES)
+    budget = max(1, MAX_RENDER_TRIANGLES // len(chunks))
+    return np.concatenate([decimate(np.asarray(triangles[start:start + CHUNK_TRIANGLES]), budget)
+                           for start in chunks])
+
+
+def stl_geometry(path):
+    """Geometry of an STL, binary files are read through a memory map in chunks"""
+    return mesh_geometry(model_triangles(path))
+
+
+def mesh_fingerprint(triangles):
+    """Digest of a mesh's shape, the same for copies that are translated, re-ordered or re-saved.
+
+    Built from the exact surface integrals of the mesh, so neither triangle
+    order, vertex order within triangles, file format nor position matter,
+    and a re-tessellation of the same surface mostly doesn't either: the
+    bounding box diagonal (4 significant digits), then area, enclosed volume,
+    extents and the second moments of the surface about its centroid, all
+    normalized by the diagonal and rounded. Rotated copies differ.
+    """
+    if not len(triangles):
+        return hashlib.sha1(b'empty').hexdigest()
+    totals = np.zeros(1 + 3 + 9)
+    low = np.full(3, np.inf)
+    high = np.full(3, -np.inf)
+    volume = 0.0
+    for start in range(0, len(triangles), CHUNK_TRIANGLES):
+        chunk = triangles[start:start + CHUNK_TRIANGLES].astype(np.float64)
+        a, b, c = chunk[:, 0], chunk[:, 1], chunk[:, 2]
+        areas = 0.5 * np.linalg.norm(np.cross(b - a, c - a), axis=1)
+        sums = a + b + c
+        points = chunk.reshape(-1, 3)
+        low = np.minimum(low, points.min(axis=0))
+        high = np.maximum(high, points.max(axis=0))
+        totals[0] += areas.sum()
+        # First moment: area times centroid
+        totals[1:4] += areas @ sums / 3
+        # Second moment of a triangle: area / 12 * (a a' + b b' + c c' + s s'), s = a + b + c
+        outer = np.einsum('ni,nj->nij', a, a) + np.einsum('ni,nj->nij', b, b) \
+            + np.einsum('ni,nj->nij', c, c) + np.einsum('ni,nj->nij', sums, sums)
+        totals[4:] += (np.einsum('n,nij->ij', areas, outer) / 12).ravel()
+        volume += float(np.einsum('ij,ij->', a, np.cross(b, c))) / 6.0
+    diagonal = float(np.linalg.norm(high - low)) or 1.0
+    area = totals[0] or 1.0
+    centroid = totals[1:4] / area
+    covariance = totals[4:].reshape(3, 3) / area - np.outer(centroid, centroid)
+    figures = np.concatenate([
+        [totals[0] / diagonal ** 2, abs(volume) / diagonal ** 3],
+        (high - low) / diagonal,
+        covariance[np.triu_indices(3)] / diagonal ** 2,
+    ])
+    # Adding 0.0 turns -0.0 into 0.0
+    figures = np.round(figures, FINGERPRINT_DECIMALS) + 0.0
+    signature = f"{diagonal:.4g} " + ' '.join(f"{value:.{FINGERPRINT_DECIMALS}f}" for value in figures)
+    return hashlib.sha1(signature.encode('ascii')).hexdigest()
+
+
+def extract_geometry(path):
+    """Geometry of an STL or 3MF file"""
+    if path.lower().endswith('.3mf'):
+        return mesh_geometry(load_3mf(path))
+    return stl_geometry(path)
+
+
+def analyze(path, thumbnail_dir, thumbnail_size):
+    """Return (geometry, thumbnail digest, fingerprint, error) for a model file, run in the worker processes.
+
+    Errors are returned rather than raised so one broken file doesn't fail
+    its whole batch. A thumbnail that can't be rendered doesn't lose the
+    geometry, its digest is then ''.
+    """
+    try:
+        triangles = model_triangles(path)
+        geometry = mesh_geometry(triangles)
+        fingerprint = mesh_fingerprint(triangles)
+    except Exception as e:
+        return None, '', '', str(e)
+    try:
+        png = encode_png(render_thumbnail(thumbnail_triangles(triangles), thumbnail_size))
+        return geometry, ThumbnailStore(thumbnail_dir).save(png), fingerprint, None
+    except Exception as e:
+        return geometry, '', fingerprint, f"thumbnail: {e}"
+
+
+def parse_filters(spec):
+    """Turn {"extent_x": {"max": 200}, ...} into a list of (field, min, max) checks"""
+    if not spec:
+        return []
+    if not isinstance(spec, dict):
+        raise ValueError('filters must be an object')
+    filters = []
+    for field, bounds in spec.items():
+        if field not in FILTER_FIELDS:
+            raise ValueError(f"Unknown filter: {field}")
+        if not isinstance(bounds, dict) or not bounds.keys() <= {'min', 'max'}:
+            raise ValueError(f"Filter {field} takes min and/or max")
+        try:
+            low = None if bounds.get('min') is None else float(bounds['min'])
+            high = None if bounds.get('max') is None else float(bounds['max'])
+        except (TypeError, ValueError):
+            raise ValueError(f"Filter {field} bounds must be numbers")
+        filters.append((field, low, high))
+    return filters
+
+
+def matches_filters(geometry, filters):
+    """True if geometry is within every filter, files without geometry never match"""
+    if geometry is None:
+        return False
+    for field, low, high in filters:
+        value = FILTER_FIELDS[field](geometry)
+        if (low is not None and value < low) or (high is not None and value > high):
+            return False
+    return True
+
+
+def geometry_to_dict(geometry):
+    return {
+        'triangles': geometry.triangles,
+        'bbox_min': [geometry.min_x, geometry.min_y, geometry.min_z],
+        'bbox_max': [geometry.max_x, geometry.max_y, geometry.max_z],
+        'extent': [geometry.max_x - geometry.min_x, geometry.max_y - geometry.min_y,
+                   geometry.max_z - geometry.min_z],
+        'area': geometry.area,
+        'volume': geometry.volume,
+    }
+
+
+class GeometryIndexer(threading.Thread):
+    """Extracts geometry, fingerprints and thumbnails for indexed files that have none yet, in a process pool.
+
+    Files are processed in batches and each batch is stored as it completes,
+    so results show up in searches while a large share is still being
+    worked through. A file is only processed again once its size or mtime
+    changes, including files that failed. A file that kills its worker
+    process, e.g. by running it out of memory, is found by retrying its
+    batch a file at a time and recorded as failed too.
+    """
+
+    def __init__(self, file_index, directories, thumbnails, thumbnail_size=128,
+                 workers=2, batch_size=64, interval=60):
+        super().__init__(name='geometry-indexer', daemon=True)
+        self.file_index = file_index
+        self.directories = directories
+        self.thumbnails = thumbnails
+        self.thumbnail_size = thumbnail_size
+        self.workers = max(1, workers)
+        self.batch_size = batch_size
+        self.interval = interval
+        self.extracted = 0
+        self.failed = 0
+        self._last_prune = time.time()
+        self._pool = None
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+
+    def run(self):
+        analyze_file = partial(analyze, thumbnail_dir=self.thumbnails.directory,
+                               thumbnail_size=self.thumbnail_size)
+        self._restart_pool()
+        try:
+            while not self._stopped.is_set():
+                pending = self.file_index.pending_geometry(self.directories)
+                if pending:
+                    self._extract(analyze_file, pending)
+                    continue
+                self.file_index.prune_geometry()
+                if time.time() - self._last_prune > THUMBNAIL_PRUNE_INTERVAL:
+                    self._last_prune = time.time()
+                    removed = self.thumbnails.prune(self.file_index.thumbnail_digests())
+                    if removed:
+                        logger.info(f"Removed {removed} unused thumbnails")
+                self._wakeup.wait(self.interval)
+                self._wakeup.clear()
+        finally:
+            self._pool.shutdown(cancel_futures=True)
+
+    def _restart_pool(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+        self._pool = ProcessPoolExecutor(max_workers=self.workers)
+
+    def _analyze(self, analyze_file, paths):
+        """Results of analyze for paths, None for those whose worker process died"""
+        futures = [self._pool.submit(analyze_file, path) for path in paths]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except BrokenProcessPool:
+                results.append(None)
+            except Exception as e:
+                results.append((None, '', '', str(e)))
+        return results
+
+    def _extract(self, analyze_file, pending):
+        start_time = time.time()
+        done = 0
+        for start in range(0, len(pending), self.batch_size):
+            if self._stopped.is_set():
+                break
+            batch = pending[start:start + self.batch_size]
+            analyzed = self._analyze(analyze_file, [entry.path for entry in batch])
+            if None in analyzed:
+                # A worker died and took the batch's other files with it, find the culprit
+                logger.warning(f"A geometry worker process died, retrying {len(batch)} files one at a time")
+                broken = True
+                for position, entry in enumerate(batch):
+                    if analyzed[position] is not None:
+                        continue
+                    if broken:
+                        self._restart_pool()
+                    analyzed[position], = self._analyze(analyze_file, [entry.path])
+                    broken = analyzed[position] is None
+                    if broken:
+                        analyzed[position] = (None, '', '', 'worker process died analyzing it')
+                if broken:
+                    self._restart_pool()
+            results = []
+            for entry, (geometry, thumbnail, fingerprint, error) in zip(batch, analyzed):
+                if error:
+                    logger.warning(f"Could not analyze {entry.path}: {error}")
+                    self.failed += 1
+                results.append((entry, geometry, thumbnail, fingerprint))
+            self.file_index.store_geometry(results)
+            done += len(batch)
+        self.extracted += done
+        logger.info(f"Extracted geometry and thumbnails of {done} files "
+                    f"in {int((time.time() - start_time) * 1000)}ms")
+
+    def notify(self, category=None):
+        """Look for new or changed files right away, used as the indexer's change callback"""
+        self._wakeup.set()
+
+    def status(self):
+        return {'alive': self.is_alive(), 'extracted': self.extracted, 'failed': self.failed,
+                'pending': len(self.file_index.pending_geometry(self.directories))}
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
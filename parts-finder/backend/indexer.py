@@ -0,0 +1,305 @@
+"""Background thread that keeps the file index current"""
+import os
+import sys
+import threading
+import time
+import logging
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
+logger = logging.getLogger(__name__)
+
+NETWORK_FILESYSTEMS = {'nfs', 'nfs4', 'cifs', 'smbfs', 'smb3', 'fuse.sshfs', 'afpfs', '9p'}
+
+# Watched categories still get an occasional full poll in case events were dropped
+EVENT_RESYNC_INTERVAL = 600
+# Polled categories relist every directory this often, for files rewritten in place that
+# leave their directory's mtime as it was
+POLL_RESYNC_INTERVAL = 600
+# Let bursts of events (e.g. a folder being copied in) settle before rescanning
+EVENT_SETTLE_SECONDS = 1.0
+
+
+def is_network_path(path):
+    """Best-effort check for paths on network mounts, where change events are unreliable"""
+    path = os.path.abspath(path)
+    if path.startswith('\\\\'):
+        return True
+    if sys.platform == 'win32':
+        import ctypes
+        drive = os.path.splitdrive(path)[0] + '\\'
+        DRIVE_REMOTE = 4
+        return ctypes.windll.kernel32.GetDriveTypeW(drive) == DRIVE_REMOTE
+    try:
+        with open('/proc/mounts') as mounts:
+            best, fstype = '', ''
+            for line in mounts:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                mount_point = fields[1]
+                if (path == mount_point or path.startswith(mount_point.rstrip('/') + '/')) \
+                        and len(mount_point) > len(best):
+                    best, fstype = mount_point, fields[2]
+        return fstype in NETWORK_FILESYSTEMS
+    except OSError:
+        return False
+
+
+class _ChangeCollector(FileSystemEventHandler):
+    """Collects the directories touched by filesystem events"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.dirs = set()
+        self.last_event = 0.0
+
+    def on_any_event(self, event):
+        paths = [event.src_path, getattr(event, 'dest_path', '')]
+        with self.lock:
+            for path in filter(None, paths):
+                if event.is_directory:
+                    self.dirs.add(path)
+                self.dirs.add(os.path.dirname(path))
+            self.last_event = time.time()
+
+    def take(self):
+        with self.lock:
+            if not self.dirs or time.time() - self.last_event < EVENT_SETTLE_SECONDS:
+                return None
+            dirs, self.dirs = self.dirs, set()
+            return dirs
+
+
+class IndexerThread(threading.Thread):
+    """Keeps every category of a FileIndex current without blocking requests.
+
+    Local roots are watched for change events when watchdog is installed;
+    network mounts (and everything else without events) are polled with
+    incremental refreshes, scheduled so indexed data is never older than
+    max_staleness seconds, and relisted whole every POLL_RESYNC_INTERVAL.
+    Refreshes other server processes ask for through
+    FileIndex.request_refresh() are run here too.
+    """
+
+    def __init__(self, file_index, directories, max_staleness=60, use_events=True, on_change=None):
+        super().__init__(name='file-indexer', daemon=True)
+        self.file_index = file_index
+        self.directories = directories
+        self.max_staleness = max_staleness
+        self.use_events = use_events and Observer is not None
+        # Called with the category after its entries changed, to rebuild derived indexes off the request path
+        self.on_change = on_change
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._full_refresh_requested = False
+        self._poll_requested = False
+        self._observer = None
+        self._collectors = {}
+        # Relisted on the first poll, files may have been rewritten while the server was down
+        self._next_resync = {category: 0.0 for category in directories}
+        self._status = {
+            category: {'mode': 'poll', 'last_refresh': None, 'last_duration_ms': None,
+                       'last_counts': None, 'error': None}
+            for category in directories
+        }
+
+    def run(self):
+        self._start_watching()
+        next_poll = {category: 0.0 for category in self.directories}
+        # Categories never indexed before are walked together, sharing the scanner pool
+        unindexed = [category for category, root in self.directories.items()
+                     if not self.file_index.is_indexed(category, root)]
+        if unindexed:
+            self._rebuild(unindexed, next_poll)
+        while not self._stopped.is_set():
+            self._take_shared_request()
+            full, poll_now = self._full_refresh_requested, self._poll_requested
+            self._full_refresh_requested = self._poll_requested = False
+            if full:
+                self._rebuild(list(self.directories), next_poll)
+            now = time.time()
+            for category, root in self.directories.items():
+                if self._stopped.is_set():
+                    break
+                collector = self._collectors.get(category)
+                changed_dirs = collector.take() if collector else None
+                if not full and (poll_now or now >= next_poll[category]):
+                    relist_all = category not in self._collectors and now >= self._next_resync[category]
+                    duration = self._refresh(category, root, relist_all=relist_all)
+                    if relist_all:
+                        self._next_resync[category] = time.time() + POLL_RESYNC_INTERVAL
+                    self._schedule(category, next_poll, duration)
+                if changed_dirs and not full:
+                    # Relist even unchanged directories, events also cover files rewritten in place
+                    self._refresh(category, root, dirs=changed_dirs)
+            self._wakeup.wait(EVENT_SETTLE_SECONDS)
+            self._wakeup.clear()
+        if self._observer:
+            self._observer.stop()
+
+    def _take_shared_request(self):
+        try:
+            mode = self.file_index.take_refresh_request()
+        except Exception as e:
+            logger.warning(f"Could not check for refreshes requested by other processes: {e}")
+            return
+        if mode is not None:
+            self._poll_requested = True
+            if mode == 'full':
+                self._full_refresh_requested = True
+
+    def _schedule(self, category, next_poll, duration):
+        interval = EVENT_RESYNC_INTERVAL if category in self._collectors else self.max_staleness
+        # Start the next poll early enough that it finishes within the staleness bound
+        next_poll[category] = time.time() + max(interval - duration, 1)
+
+    def _start_watching(self):
+        if not self.use_events:
+            return
+        for category, root in self.directories.items():
+            if not os.path.isdir(root) or is_network_path(root):
+                continue
+            if self._observer is None:
+                self._observer = Observer()
+                self._observer.daemon = True
+            collector = _ChangeCollector()
+            try:
+                self._observer.schedule(collector, root, recursive=True)
+            except Exception as e:
+                logger.warning(f"Could not watch {root}, falling back to polling: {e}")
+                continue
+            self._collectors[category] = collector
+            self._status[category]['mode'] = 'events'
+        if self._observer is not None:
+            self._observer.start()
+
+    def _rebuild(self, categories, next_poll):
+        start_time = time.time()
+        results, errors = self.file_index.rebuild_many(
+            {category: self.directories[category] for category in categories}
+        )
+        duration = time.time() - start_time
+        for category in categories:
+            status = self._status[category]
+            status['last_refresh'] = time.time()
+            status['last_duration_ms'] = int(duration * 1000)
+            if category in errors:
+                logger.error(f"Background rebuild of {category} failed: {errors[category]}")
+                status['error'] = str(errors[category])
+            else:
+                status['last_counts'] = {'added': len(results[category]), 'removed': 0,
+                                         'changed': 0, 'full_rescan': True}
+                status['error'] = None
+                if self.on_change:
+                    self.on_change(category)
+            self._next_resync[category] = time.time() + POLL_RESYNC_INTERVAL
+            self._schedule(category, next_poll, duration)
+
+    def _refresh(self, category, root, dirs=None, relist_all=False):
+        start_time = time.time()
+        status = self._status[category]
+        try:
+            counts = self.file_index.refresh(category, root, dirs=dirs, relist_all=relist_all)
+            status['last_counts'] = counts
+            status['error'] = None
+            if self.on_change and (counts['added'] or counts['removed'] or counts['changed']):
+                self.on_change(category)
+        except Exception as e:
+            logger.error(f"Background refresh of {category} failed: {e}")
+            status['error'] = str(e)
+        duration = time.time() - start_time
+        status['last_refresh'] = time.time()
+        status['last_duration_ms'] = int(duration * 1000)
+        return duration
+
+    def request_refresh(self, full=False):
+        """Ask for an immediate refresh of every category on the indexer thread"""
+        if full:
+            self._full_refresh_requested = True
+        self._poll_requested = True
+        self._wakeup.set()
+
+    def status(self):
+        return {category: dict(status) for category, status in self._status.items()}
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+
+
+def try_lock(path):
+    """Take an exclusive lock on a file without waiting, returns the open file or None.
+
+    The lock lasts while the file stays open and is released by the OS when
+    the holding process exits, however it exits.
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    lock_file = open(path, 'a+')
+    try:
+        if sys.platform == 'win32':
+            import msvcrt
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return None
+    return lock_file
+
+
+class IndexFollower(threading.Thread):
+    """Elects one of several server processes sharing an index to run the indexer.
+
+    The process holding the lock file starts the background indexer through
+    start_leader. Every process reloads what the others changed in the
+    shared database every interval seconds, and a follower takes over when
+    the leader exits. on_sync is called with the names sync() reloaded, to
+    rebuild derived indexes here rather than on the next request.
+    """
+
+    def __init__(self, file_index, lock_path, start_leader, interval=10, on_sync=None):
+        super().__init__(name='index-follower', daemon=True)
+        self.file_index = file_index
+        self.lock_path = lock_path
+        self.start_leader = start_leader
+        self.interval = interval
+        self.on_sync = on_sync
+        self.is_leader = False
+        self.last_sync = None
+        self._lock_file = None
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                # The leader keeps syncing too, for refreshes a follower ran for an API request
+                changed = self.file_index.sync()
+                self.last_sync = time.time()
+                if changed and self.on_sync:
+                    self.on_sync(changed)
+            except Exception as e:
+                logger.error(f"Could not reload the shared file index: {e}")
+            if not self.is_leader:
+                self._lock_file = try_lock(self.lock_path)
+                if self._lock_file is not None:
+                    logger.info(f"Process {os.getpid()} runs the background indexer")
+                    self.is_leader = True
+                    self.start_leader()
+            self._stopped.wait(self.interval)
+
+    def status(self):
+        return {'pid': os.getpid(), 'leader': self.is_leader, 'last_sync': self.last_sync}
+
+    def stop(self):
+        self._stopped.set()
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
@@ -2,6 +2,7 @@
 import sys
 import webbrowser
 import threading
+import multiprocessing
 import time
 from flask import Flask
 from werkzeug.serving import make_server
@@ -11,7 +12,7 @@
 if backend_dir not in sys.path:
     sys.path.append(backend_dir)
 
-from app import app
+from app import app, start_indexer, stop_indexer
 
 class ServerThread(threading.Thread):
     def __init__(self, app):
@@ -19,13 +20,17 @@ def __init__(self, app):
         self.server = make_server('127.0.0.1', 5000, app)
         self.ctx = app.app_context()
         self.ctx.push()
+        self.indexer = None
 
     def run(self):
+        print("Starting background indexer...")
+        self.indexer = start_indexer()
         print("Starting server...")
         self.server.serve_forever()
 
     def shutdown(self):
         self.server.shutdown()
+        stop_indexer()
 
 def start_server():
     global server
@@ -41,6 +46,8 @@ def open_browser():
         print(f"Error opening browser: {e}")
 
 if __name__ == '__main__':
+    # Geometry extraction runs in worker processes, which frozen builds must be able to start
+    multiprocessing.freeze_support()
     try:
         print("Initializing Parts Finder...")
         start_server()
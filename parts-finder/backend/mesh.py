@@ -0,0 +1,224 @@
+"""Vectorized STL mesh loading, writing and decimation for model previews"""
+import math
+import zipfile
+import xml.etree.ElementTree as ElementTree
+import numpy as np
+
+STL_HEADER_SIZE = 80
+STL_DTYPE = np.dtype([
+    ('normal', '<f4', (3,)),
+    ('vertices', '<f4', (3, 3)),
+    ('attr', '<u2'),
+])
+
+# 3MF length units in millimetres
+THREEMF_UNITS = {
+    'micron': 0.001,
+    'millimeter': 1.0,
+    'centimeter': 10.0,
+    'inch': 25.4,
+    'foot': 304.8,
+    'meter': 1000.0,
+}
+
+# Clustering passes tried while looking for the grid closest to a triangle budget
+MAX_CLUSTER_PASSES = 8
+# A result using at least this share of the budget is close enough
+BUDGET_FILL = 0.8
+# ASCII STL files are parsed this many bytes of lines at a time
+ASCII_CHUNK_BYTES = 8 * 1024 * 1024
+
+
+def stl_triangle_count(path):
+    """Triangle count from the header of a binary STL, None for ASCII files.
+
+    Binary files may also start with "solid", so the size implied by the
+    triangle count decides; files that don't start with it are binary as
+    long as they hold all their triangles, trailing bytes are ignored.
+    """
+    with open(path, 'rb') as f:
+        head = f.read(STL_HEADER_SIZE + 4)
+        f.seek(0, 2)
+        size = f.tell()
+    if len(head) < STL_HEADER_SIZE + 4:
+        return None
+    count = int(np.frombuffer(head, '<u4', 1, STL_HEADER_SIZE)[0])
+    expected = STL_HEADER_SIZE + 4 + count * STL_DTYPE.itemsize
+    if size == expected or (size > expected and not head.lstrip().startswith(b'solid')):
+        return count
+    return None
+
+
+def load_stl(path):
+    """Return the triangles of an STL file as a float32 array of shape (n, 3, 3)"""
+    count = stl_triangle_count(path)
+    if count is not None:
+        if not count:
+            return np.empty((0, 3, 3), np.float32)
+        records = np.memmap(path, STL_DTYPE, 'r', offset=STL_HEADER_SIZE + 4, shape=(count,))
+        return np.array(records['vertices'])
+    return _load_ascii_stl(path)
+
+
+def _load_ascii_stl(path):
+    # Read a chunk of lines at a time, so only the coordinates parsed so far are held whole
+    parts = []
+    with open(path, 'rb') as f:
+        while True:
+            lines = f.readlines(ASCII_CHUNK_BYTES)
+            if not lines:
+                break
+            # Every "vertex" line holds the three coordinates of a corner
+            vertices = [line[6:] for line in map(bytes.lstrip, lines) if line.startswith(b'vertex')]
+            if vertices:
+                parts.append(np.fromstring(b' '.join(vertices).decode('ascii'), np.float32, sep=' '))
+    coords = np.concatenate(parts) if parts else np.empty(0, np.float32)
+    return coords[:len(coords) // 9 * 9].reshape(-1, 3, 3)
+
+
+def load_3mf(path):
+    """Return the triangles of the meshes in a 3MF package in millimetres, shape (n, 3, 3).
+
+    Every mesh object in the model part is included once; component
+    references and build item transforms are not applied, which is exact
+    for the single-object files our exporters write.
+    """
+    scale = 1.0
+    meshes = []
+    with zipfile.ZipFile(path) as package:
+        model_name = next((name for name in package.namelist()
+                           if name.lower().endswith('.model') and name.lower().startswith('3d/')), None)
+        if model_name is None:
+            raise ValueError(f"No 3D model part in {path}")
+        with package.open(model_name) as model:
+            vertices = []
+            faces = []
+            for event, element in ElementTree.iterparse(model, events=('start', 'end')):
+                tag = element.tag.rsplit('}', 1)[-1]
+                if event == 'start':
+                    if tag == 'model':
+                        scale = THREEMF_UNITS.get(element.get('unit', 'millimeter'), 1.0)
+                    continue
+                if tag == 'vertex':
+                    vertices.append((float(element.get('x')), float(element.get('y')), float(element.get('z'))))
+                elif tag == 'triangle':
+                    faces.append((int(element.get('v1')), int(element.get('v2')), int(element.get('v3'))))
+                elif tag == 'mesh':
+                    if faces:
+                        meshes.append(np.array(vertices, np.float64)[np.array(faces, np.int64)] * scale)
+                    vertices, faces = [], []
+                else:
+                    continue
+                element.clear()
+    if not meshes:
+        return np.empty((0, 3, 3), np.float32)
+    return np.concatenate(meshes).astype(np.float32)
+
+
+def load_model(path):
+    """Return the triangles of an STL or 3MF file"""
+    if path.lower().endswith('.3mf'):
+        return load_3mf(path)
+    return load_stl(path)
+
+
+def face_normals(triangles):
+    """Unit normals of triangles, zero for degenerate ones"""
+    normals = np.cross(triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0])
+    lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+    np.divide(normals, lengths, out=normals, where=lengths > 0)
+    return normals
+
+
+def write_stl(triangles, path, header=b''):
+    """Write triangles as a binary STL"""
+    records = np.zeros(len(triangles), STL_DTYPE)
+    records['vertices'] = triangles
+    records['normal'] = face_normals(triangles)
+    with open(path, 'wb') as f:
+        f.write(header[:STL_HEADER_SIZE].ljust(STL_HEADER_SIZE, b' '))
+        f.write(np.uint32(len(triangles)).tobytes())
+        records.tofile(f)
+
+
+def cluster_vertices(triangles, resolution):
+    """Merge all vertices within each cell of a grid with resolution cells along the longest side.
+
+    Each cell's vertices collapse to their mean, triangles that lose an
+    edge are dropped and triangles ending up on the same three cells are
+    kept once.
+    """
+    vertices = triangles.reshape(-1, 3).astype(np.float64)
+    low = vertices.min(axis=0)
+    cell_size = float((vertices.max(axis=0) - low).max()) / resolution or 1.0
+    cells = np.minimum(((vertices - low) / cell_size).astype(np.int64), resolution - 1)
+    keys = (cells[:, 0] * resolution + cells[:, 1]) * resolution + cells[:, 2]
+    unique_keys, inverse = np.unique(keys, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    counts = np.bincount(inverse)
+    points = np.empty((len(unique_keys), 3), np.float32)
+    for axis in range(3):
+        points[:, axis] = np.bincount(inverse, weights=vertices[:, axis]) / counts
+
+    faces = inverse.reshape(-1, 3)
+    faces = faces[(faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 0] != faces[:, 2])]
+    if len(faces):
+        _, first = np.unique(np.sort(faces, axis=1), axis=0, return_index=True)
+        faces = faces[np.sort(first)]
+    return points[faces]
+
+
+def decimate(triangles, max_triangles):
+    """Reduce a mesh to at most max_triangles by vertex clustering.
+
+    The grid resolution is adjusted over a few passes, scaling with the
+    square root of the budget ratio since a surface's triangle count grows
+    with the square of the resolution, and the largest result within the
+    budget is kept.
+    """
+    if len(triangles) <= max_triangles:
+        return triangles
+    resolution = max(2, int(math.sqrt(max_triangles)))
+    best = None
+    tried = set()
+    for _ in range(MAX_CLUSTER_PASSES):
+        tried.add(resolution)
+        result = cluster_vertices(triangles, resolution)
+        ratio = max_triangles / max(len(result), 1)
+        if len(result) <= max_triangles:
+            if best is None or len(result) > len(best):
+                best = result
+            if len(result) >= max_triangles * BUDGET_FILL:
+                break
+            step = min(2.0, math.sqrt(ratio))
+        else:
+            step = max(0.5, math.sqrt(ratio) * 0.95)
+        resolution = max(1, int(resolution * step))
+        while resolution in tried and resolution > 1:
+            resolution += 1 if len(result) <= max_triangles else -1
+        if resolution in tried:
+            break
+    if best is None:
+        best = cluster_vertices(triangles, 1)
+    return best
+
+
+def lod_builder(source, max_triangles):
+    """Return a build function writing the decimated binary STL of source.
+
+    The header records the triangle counts as "LOD kept/original" so the
+    artifact describes itself when served later.
+    """
+    def build(target):
+        triangles = load_stl(source)
+        lod = decimate(triangles, max_triangles)
+        write_stl(lod, target, f"parts-finder LOD {len(lod)}/{len(triangles)}".encode('ascii'))
+    return build
+
+
+def lod_counts(path):
+    """Return (kept, original) triangle counts from the header of an LOD artifact"""
+    with open(path, 'rb') as f:
+        header = f.read(STL_HEADER_SIZE).decode('ascii', 'replace')
+    kept, _, original = header.split()[-1].partition('/')
+    return int(kept), int(original)
@@ -0,0 +1,168 @@
+"""In-process counters and histograms, exposed in the Prometheus text format on /api/metrics"""
+import bisect
+import threading
+
+# Bucket upper bounds, seconds for latencies
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SCAN_BUCKETS = (0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+RATE_BUCKETS = (10, 100, 1000, 10000, 100000, 1000000)
+THROUGHPUT_BUCKETS = tuple(mb * 1024 * 1024 for mb in (1, 5, 10, 25, 50, 100, 250, 500, 1000))
+
+
+def _format_labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, label_values):
+        if len(label_values) != len(self.labels):
+            raise ValueError(f"{self.name} takes labels {self.labels}")
+        return tuple(str(value) for value in label_values)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            items = sorted(self._values.items())
+            lines.extend(self._render_samples(items))
+        return lines
+
+
+class Counter(_Metric):
+    """A value that only goes up, e.g. bytes served"""
+    kind = 'counter'
+
+    def inc(self, amount=1, *label_values):
+        key = self._key(label_values)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, *label_values):
+        with self._lock:
+            return self._values.get(self._key(label_values), 0)
+
+    def _render_samples(self, items):
+        return [f'{self.name}{_format_labels(self.labels, key)} {_format_value(value)}' for key, value in items]
+
+
+class Histogram(_Metric):
+    """Observations counted into cumulative buckets, plus their count and sum"""
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS, labels=()):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *label_values):
+        key = self._key(label_values)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # One slot per bucket, one for +Inf, then the sum
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def count(self, *label_values):
+        with self._lock:
+            counts = self._values.get(self._key(label_values))
+            return sum(counts[:-1]) if counts else 0
+
+    def _render_samples(self, items):
+        lines = []
+        for key, counts in items:
+            total = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                total += count
+                le = 'le="' + _format_value(float(bound)) + '"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labels, key, le)} {total}')
+            lines.append(f'{self.name}_count{_format_labels(self.labels, key)} {total}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labels, key)} {_format_value(counts[-1])}')
+        return lines
+
+
+class Gauge(_Metric):
+    """A value read when metrics are collected, from collect() returning {label values: value}"""
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, collect, labels=()):
+        super().__init__(name, help_text, labels)
+        self.collect = collect
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        for key, value in sorted(self.collect().items()):
+            key = key if isinstance(key, tuple) else (key,)
+            lines.append(f'{self.name}{_format_labels(self.labels, key)} {_format_value(value)}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def counter(name, help_text, labels=()):
+    return REGISTRY.register(Counter(name, help_text, labels))
+
+
+def histogram(name, help_text, buckets=LATENCY_BUCKETS, labels=()):
+    return REGISTRY.register(Histogram(name, help_text, buckets, labels))
+
+
+def gauge(name, help_text, collect, labels=()):
+    return REGISTRY.register(Gauge(name, help_text, collect, labels))
+
+
+REQUEST_SECONDS = histogram('partsfinder_request_seconds', 'Time spent handling API requests',
+                            labels=('endpoint', 'method'))
+SEARCH_SECONDS = histogram('partsfinder_search_seconds', 'Time spent matching and paging searches',
+                           labels=('category',))
+SCAN_SECONDS = histogram('partsfinder_index_scan_seconds', 'Duration of index walks and refreshes',
+                         SCAN_BUCKETS, labels=('category', 'kind'))
+SCAN_FILES_PER_SECOND = histogram('partsfinder_index_scan_files_per_second',
+                                  'Files listed per second by full index walks', RATE_BUCKETS,
+                                  labels=('category',))
+SEARCH_CACHE = counter('partsfinder_search_cache_lookups_total', 'Search result cache lookups',
+                       labels=('result',))
+STAT_CALLS = counter('partsfinder_stat_calls_total', 'Filesystem stat calls made', labels=('source',))
+COPY_BYTES = counter('partsfinder_copy_bytes_total', 'Bytes copied by copy jobs')
+COPY_THROUGHPUT = histogram('partsfinder_copy_bytes_per_second', 'Copy throughput per file',
+                            THROUGHPUT_BUCKETS)
+MODEL_BYTES = counter('partsfinder_model_bytes_served_total', 'Bytes of model files sent to viewers',
+                      labels=('variant',))
@@ -0,0 +1,206 @@
+"""Local disk cache of model files derived from the shares, e.g. binary STLs compressed for transfer"""
+import os
+import gzip
+import shutil
+import hashlib
+import tempfile
+import threading
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from mesh import load_stl, stl_triangle_count, write_stl
+
+logger = logging.getLogger(__name__)
+
+GZIP_LEVEL = 6
+_TMP_SUFFIX = '.tmp'
+# Temporary files older than this are left over from builds that died
+STALE_TMP_SECONDS = 3600
+
+
+class ArtifactCache:
+    """Size-bounded directory of files derived from source models.
+
+    Artifacts are named by a hash of the source path, size, mtime and kind,
+    so a changed source simply misses and its old artifacts age out. Once
+    the cache grows past max_bytes the least recently used files are
+    removed; a hit refreshes the file's mtime so use survives restarts.
+
+    The directory itself is the only state, so the processes of a
+    multi-worker server sharing it agree on its contents and size: any of
+    them may evict a file another one cached, which is then a miss.
+    """
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        for item in os.scandir(cache_dir):
+            try:
+                # Left over from an interrupted build, not one another process is running now
+                if item.name.endswith(_TMP_SUFFIX) and time.time() - item.stat().st_mtime > STALE_TMP_SECONDS:
+                    os.remove(item.path)
+            except OSError:
+                pass
+
+    @staticmethod
+    def key(path, size, mtime, kind):
+        """Artifact name for one kind of derived file of a source version"""
+        digest = hashlib.sha1(f"{path}\0{size}\0{mtime!r}\0{kind}".encode('utf-8')).hexdigest()
+        return f"{digest}.{kind}"
+
+    def _scan(self):
+        """(mtime, name, size) of every cached artifact, least recently used first"""
+        files = []
+        for item in os.scandir(self.cache_dir):
+            if item.name.endswith(_TMP_SUFFIX):
+                continue
+            try:
+                if item.is_file():
+                    st = item.stat()
+                    files.append((st.st_mtime, item.name, st.st_size))
+            except FileNotFoundError:
+                # Evicted by another process meanwhile
+                pass
+        files.sort()
+        return files
+
+    @property
+    def total_bytes(self):
+        return sum(size for _, _, size in self._scan())
+
+    def get(self, name):
+        """Return the path of a cached artifact and mark it used, None on a miss"""
+        path = os.path.join(self.cache_dir, name)
+        try:
+            # The precise time, the kernel's default is only a few milliseconds granular
+            now = time.time_ns()
+            os.utime(path, ns=(now, now))
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        except OSError:
+            # Still there, only its use isn't recorded
+            if not os.path.isfile(path):
+                with self._lock:
+                    self.misses += 1
+                return None
+        with self._lock:
+            self.hits += 1
+        return path
+
+    def put(self, name, build):
+        """Create an artifact by calling build(path) on a temporary file, then evict down to size"""
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=name, suffix=_TMP_SUFFIX)
+        os.close(fd)
+        try:
+            build(tmp_path)
+            path = os.path.join(self.cache_dir, name)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        files = self._scan()
+        total = sum(size for _, _, size in files)
+        evicted = 0
+        for _, old_name, old_size in files:
+            if total <= self.max_bytes:
+                break
+            if old_name == name:
+                continue
+            try:
+                os.remove(os.path.join(self.cache_dir, old_name))
+                evicted += 1
+            except FileNotFoundError:
+                # Another process evicted it first
+                pass
+            except OSError as e:
+                logger.warning(f"Could not evict {old_name} from cache: {e}")
+                continue
+            total -= old_size
+        with self._lock:
+            self.evictions += evicted
+        return path
+
+    def stats(self):
+        files = self._scan()
+        with self._lock:
+            return {
+                'files': len(files),
+                'bytes': sum(size for _, _, size in files),
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+class ModelCache:
+    """Gzip-compressed, binary STL copies of model files, built in the background.
+
+    The first request for a model is served from the share as before and
+    queues the build; later requests from clients accepting gzip get the
+    local compressed copy, which for an ASCII STL is typically a tenth of
+    the original size.
+    """
+
+    KIND = 'stl.gz'
+
+    def __init__(self, artifacts, workers=1):
+        self.artifacts = artifacts
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='model-cache')
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def lookup(self, path, size, mtime, build=True):
+        """Return the compressed copy of an STL if cached, otherwise queue its build and return None"""
+        name = self.artifacts.key(path, size, mtime, self.KIND)
+        cached = self.artifacts.get(name)
+        if cached is None and build:
+            with self._lock:
+                if name in self._pending:
+                    return None
+                self._pending.add(name)
+            self._pool.submit(self._build, name, path)
+        return cached
+
+    def build(self, path, size, mtime):
+        """Build the compressed copy of an STL right away and return its path"""
+        return self.artifacts.put(self.artifacts.key(path, size, mtime, self.KIND),
+                                  stl_gzip_builder(path))
+
+    def _build(self, name, path):
+        try:
+            self.artifacts.put(name, stl_gzip_builder(path))
+            logger.info(f"Cached compressed model for {path}")
+        except Exception as e:
+            logger.error(f"Could not cache model {path}: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard(name)
+
+
+def stl_gzip_builder(source):
+    """Return a build function writing the gzip-compressed binary STL of source"""
+    def build(target):
+        if stl_triangle_count(source) is not None:
+            compress_file(source, target)
+            return
+        fd, binary_path = tempfile.mkstemp(dir=os.path.dirname(target), suffix=_TMP_SUFFIX)
+        os.close(fd)
+        try:
+            write_stl(load_stl(source), binary_path, b'parts-finder binary STL')
+            compress_file(binary_path, target)
+        finally:
+            os.remove(binary_path)
+    return build
+
+
+def compress_file(source, target):
+    with open(source, 'rb') as src, gzip.open(target, 'wb', compresslevel=GZIP_LEVEL) as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
@@ -0,0 +1,248 @@
+"""Search data of a category's file names, stored as flat arrays in its column file.
+
+NameIndex needs every name lowercased, a posting list per trigram and the
+distinct name tokens with their own postings. Held as Python strings,
+dicts and arrays they cost hundreds of bytes per file in every process,
+so they are encoded with the columns instead and mapped like them:
+
+    lower_names        lowercased names, UTF-8, each followed by a NUL
+    lower_starts       array of uint64, start of each lowercased name
+    gram_keys          array of uint32, the distinct byte trigrams, sorted
+    gram_starts        array of uint64, start of each trigram's postings
+    gram_ids           array of uint32, the file ids of all postings back to back
+    tokens             the distinct name tokens, sorted, back to back
+    token_starts       array of uint64, start of each token
+    token_table        array of uint32, open addressing table of token id + 1
+    token_file_starts  array of uint64, start of each token's files
+    token_file_ids     array of uint32, the file ids of all tokens back to back
+    token_gram_*       trigram postings of the tokens padded with ^ and $
+
+Trigrams are taken over the UTF-8 bytes, so a name contains a term exactly
+when its bytes contain the term's bytes. They run over the name padded with
+two NULs, which no name or term can hold, so a term shorter than a trigram
+is the start of one for each name containing it.
+"""
+import os
+import re
+import zlib
+import bisect
+from array import array
+from collections.abc import Sequence
+
+NGRAM = 3
+
+# Names are split into runs of letters and digits for ranked search
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+
+SEPARATOR = b'\0'
+# Follows each name in its trigrams, so every byte of a name starts one
+_PADDING = SEPARATOR * (NGRAM - 1)
+
+# (name, typecode) of the sections, in file order
+SECTIONS = (('lower_starts', 'Q'), ('gram_keys', 'I'), ('gram_starts', 'Q'), ('gram_ids', 'I'),
+            ('token_starts', 'Q'), ('token_table', 'I'), ('token_file_starts', 'Q'), ('token_file_ids', 'I'),
+            ('token_gram_keys', 'I'), ('token_gram_starts', 'Q'), ('token_gram_ids', 'I'),
+            ('lower_names', 'B'), ('tokens', 'B'))
+
+# Lone surrogates stand for undecodable bytes in file names, keep them round-tripping
+_ERRORS = 'surrogatepass'
+
+_EMPTY = memoryview(array('I'))
+
+
+def encode(term):
+    """The bytes a lowercased term is searched for as"""
+    return term.encode('utf-8', _ERRORS)
+
+
+def gram_keys(data):
+    """The distinct trigrams of encoded data, as the integers they are stored as"""
+    return {int.from_bytes(data[i:i + NGRAM], 'big') for i in range(len(data) - NGRAM + 1)}
+
+
+def _postings(table):
+    """(sorted keys, starts, ids) of a {key: array of ids} table, keys being NGRAM bytes"""
+    keys, starts, ids = array('I'), array('Q', [0]), array('I')
+    for key in sorted(table):
+        keys.append(int.from_bytes(key, 'big'))
+        ids.extend(table[key])
+        starts.append(len(ids))
+    return keys, starts, ids
+
+
+def _token_hash(token):
+    return zlib.crc32(token)
+
+
+def encode_postings(names):
+    """Return {section: array or bytes} of the search data of a sequence of file names"""
+    lower_names = bytearray()
+    lower_starts = array('Q')
+    grams = {}
+    files = {}
+    for file_id, name in enumerate(names):
+        lowered = name.lower()
+        data = encode(lowered)
+        lower_starts.append(len(lower_names))
+        lower_names += data
+        lower_names += SEPARATOR
+        padded = data + _PADDING
+        for gram in {padded[i:i + NGRAM] for i in range(len(data))}:
+            ids = grams.get(gram)
+            if ids is None:
+                grams[gram] = ids = array('I')
+            ids.append(file_id)
+        for token in set(TOKEN_PATTERN.findall(os.path.splitext(lowered)[0])):
+            ids = files.get(token)
+            if ids is None:
+                files[token] = ids = array('I')
+            ids.append(file_id)
+    lower_starts.append(len(lower_names))
+
+    vocabulary = sorted(files)
+    tokens = bytearray()
+    token_starts = array('Q', [0])
+    token_file_starts = array('Q', [0])
+    token_file_ids = array('I')
+    token_grams = {}
+    # At most half full, so a lookup rarely probes more than a slot or two
+    size = 1
+    while size < 2 * len(vocabulary):
+        size *= 2
+    token_table = array('I', bytes(4 * size))
+    for token_id, token in enumerate(vocabulary):
+        data = token.encode('ascii')
+        tokens += data
+        token_starts.append(len(tokens))
+        token_file_ids.extend(files[token])
+        token_file_starts.append(len(token_file_ids))
+        slot = _token_hash(data) & (size - 1)
+        while token_table[slot]:
+            slot = (slot + 1) & (size - 1)
+        token_table[slot] = token_id + 1
+        padded = b'^' + data + b'$'
+        for gram in {padded[i:i + NGRAM] for i in range(len(padded) - NGRAM + 1)}:
+            ids = token_grams.get(gram)
+            if ids is None:
+                token_grams[gram] = ids = array('I')
+            ids.append(token_id)
+
+    sections = {
+        'lower_names': bytes(lower_names), 'lower_starts': lower_starts,
+        'tokens': bytes(tokens), 'token_starts': token_starts, 'token_table': token_table,
+        'token_file_starts': token_file_starts, 'token_file_ids': token_file_ids,
+    }
+    sections['gram_keys'], sections['gram_starts'], sections['gram_ids'] = _postings(grams)
+    (sections['token_gram_keys'], sections['token_gram_starts'],
+     sections['token_gram_ids']) = _postings(token_grams)
+    return sections
+
+
+class Slices(Sequence):
+    """The runs of a buffer between consecutive starts, each converted on access"""
+
+    def __init__(self, data, starts, convert=None):
+        self._data = data
+        self._starts = starts
+        self._count = len(starts) - 1
+        self._convert = convert
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        if not 0 <= index < self._count:
+            raise IndexError('slice index out of range')
+        data = self._data[self._starts[index]:self._starts[index + 1]]
+        return self._convert(data) if self._convert else data
+
+    def span(self, first, last):
+        """The runs first to last - 1 together, unconverted"""
+        return self._data[self._starts[first]:self._starts[last]]
+
+
+class NamePostings:
+    """Read side of the search data, over the sections of a FileColumns buffer.
+
+    find is the buffer's own find(sub, start, end), of bytes or of the mmap,
+    and base the buffer offset of lower_names, so names are checked for a
+    term in place.
+    """
+
+    def __init__(self, sections, find, base):
+        self._lower_names = sections['lower_names']
+        self._lower_starts = sections['lower_starts']
+        self._gram_keys = sections['gram_keys']
+        self._gram_ids = Slices(sections['gram_ids'], sections['gram_starts'])
+        self._token_table = sections['token_table']
+        self._token_gram_keys = sections['token_gram_keys']
+        self._token_gram_ids = Slices(sections['token_gram_ids'], sections['token_gram_starts'])
+        self._find = find
+        self._base = base
+        self.vocabulary = Slices(sections['tokens'], sections['token_starts'], lambda data: str(data, 'ascii'))
+        # The ids of the files each token appears in
+        self.files = Slices(sections['token_file_ids'], sections['token_file_starts'])
+
+    def __len__(self):
+        return len(self._lower_starts) - 1
+
+    def name(self, file_id):
+        """The lowercased name of a file"""
+        starts = self._lower_starts
+        return str(self._lower_names[starts[file_id]:starts[file_id + 1] - 1], 'utf-8', _ERRORS)
+
+    def names(self):
+        """Yield the lowercased names, in index order"""
+        for file_id in range(len(self)):
+            yield self.name(file_id)
+
+    def contains(self, file_id, term):
+        """True if the name of a file contains an encoded term"""
+        starts, base = self._lower_starts, self._base
+        return self._find(term, base + starts[file_id], base + starts[file_id + 1]) != -1
+
+    def postings(self, key):
+        """The ids of the files whose names contain a trigram, as returned by gram_keys()"""
+        return _lookup(self._gram_keys, self._gram_ids, key)
+
+    def token_postings(self, key):
+        """The ids of the tokens whose ^ and $ padded form contains a trigram"""
+        return _lookup(self._token_gram_keys, self._token_gram_ids, key)
+
+    def token_id(self, token):
+        """The id of a token in the vocabulary, or None"""
+        table = self._token_table
+        mask = len(table) - 1
+        try:
+            data = token.encode('ascii')
+        except UnicodeEncodeError:
+            return None
+        slot = _token_hash(data) & mask
+        vocabulary = self.vocabulary
+        while True:
+            entry = table[slot]
+            if not entry:
+                return None
+            if vocabulary[entry - 1] == token:
+                return entry - 1
+            slot = (slot + 1) & mask
+
+    def prefixed(self, prefix):
+        """The file ids of the postings of all trigrams starting with an encoded prefix shorter than NGRAM.
+
+        Names are padded with NULs for their trigrams, so these are the names
+        containing the prefix, each once per trigram, back to back in gram_ids.
+        """
+        shift = 8 * (NGRAM - len(prefix))
+        low = int.from_bytes(prefix, 'big') << shift
+        keys = self._gram_keys
+        first = bisect.bisect_left(keys, low)
+        last = bisect.bisect_left(keys, low + (1 << shift), first)
+        return self._gram_ids.span(first, last)
+
+
+def _lookup(keys, postings, key):
+    index = bisect.bisect_left(keys, key)
+    if index < len(keys) and keys[index] == key:
+        return postings[index]
+    return _EMPTY
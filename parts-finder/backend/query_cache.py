@@ -0,0 +1,79 @@
+"""Computed search result sets, reused until the index they were computed from changes"""
+import time
+import threading
+from collections import OrderedDict
+
+# Counted for every cached result on top of its own size, for its key and bookkeeping
+ENTRY_BYTES = 256
+
+
+class QueryCache:
+    """Bounded LRU cache of search results tagged with the index state they came from.
+
+    Each result is stored with a tag, e.g. the generation of its category
+    in the file index, and only returned to a lookup with the same tag, so
+    an index change makes exactly the results computed from the old state
+    miss, without touching any other. Results also expire after ttl
+    seconds. Size is counted in bytes, as given for each result plus
+    ENTRY_BYTES for its key and bookkeeping, and the least recently used
+    results are dropped once there are more than max_bytes. max_bytes 0
+    turns it off.
+    """
+
+    def __init__(self, max_bytes=64 * 2 ** 20, ttl=300):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # {key: (tag, stored at, value, size)}, least recently used first
+        self._entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, tag):
+        """Return the value cached for key under tag and mark it used, None on a miss"""
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is None or cached[0] != tag or time.time() - cached[1] > self.ttl:
+                if cached is not None:
+                    # Stale, computed from an older index or too long ago
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return cached[2]
+
+    def put(self, key, tag, value, size):
+        """Cache value for key under tag, size is the bytes it holds"""
+        size += ENTRY_BYTES
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (tag, time.time(), value, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        self.bytes -= self._entries.pop(key)[3]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
@@ -0,0 +1,128 @@
+"""Directory scanning for the file index, fanned out over a bounded thread pool"""
+import os
+import time
+import logging
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from metrics import STAT_CALLS
+
+logger = logging.getLogger(__name__)
+
+VALID_EXTENSIONS = {'.stl', '.3mf'}
+
+FileEntry = namedtuple('FileEntry', ['path', 'name', 'ext', 'size', 'mtime'])
+
+# One listed directory: its part files, {subdir: mtime} and how long the listing took
+Listing = namedtuple('Listing', ['entries', 'subdirs', 'seconds'])
+
+
+def list_directory(directory):
+    """List a single directory with os.scandir.
+
+    Returns its part files and a {path: mtime} of its subdirectories. Sizes
+    and mtimes come from the DirEntry stat data, which Windows returns with
+    the listing itself, so a share is not asked for a separate stat per file.
+    """
+    entries = []
+    subdirs = {}
+    stats = 0
+    with os.scandir(directory) as it:
+        for item in it:
+            try:
+                if item.is_dir():
+                    # Like os.walk, don't descend into symlinked directories
+                    if not item.is_symlink():
+                        stats += 1
+                        subdirs[item.path] = item.stat().st_mtime
+                    continue
+                ext = os.path.splitext(item.name)[1].lower()
+                if ext not in VALID_EXTENSIONS:
+                    continue
+                stats += 1
+                st = item.stat()
+            except OSError as e:
+                logger.warning(f"Could not stat {item.path}: {e}")
+                continue
+            entries.append(FileEntry(item.path, item.name, ext, st.st_size, st.st_mtime))
+    STAT_CALLS.inc(stats, 'scan')
+    return entries, subdirs
+
+
+def _timed_list(directory):
+    start_time = time.perf_counter()
+    entries, subdirs = list_directory(directory)
+    return Listing(entries, subdirs, time.perf_counter() - start_time)
+
+
+def _dir_mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def scan_stats(listings, seconds, workers, errors=0):
+    """Throughput figures for a set of listings, used to tune the worker count per mount"""
+    dirs = len(listings)
+    files = sum(len(listing.entries) for listing in listings)
+    list_seconds = sum(listing.seconds for listing in listings)
+    return {
+        'workers': workers,
+        'dirs': dirs,
+        'files': files,
+        'errors': errors,
+        'seconds': round(seconds, 3),
+        'dirs_per_second': round(dirs / seconds, 1) if seconds else None,
+        'files_per_second': round(files / seconds, 1) if seconds else None,
+        'avg_list_ms': round(list_seconds / dirs * 1000, 2) if dirs else None,
+    }
+
+
+class ParallelScanner:
+    """Lists directories concurrently.
+
+    On a high-latency mount almost all of a walk is spent waiting for
+    directory listings, so keeping several listings in flight at once
+    multiplies throughput until the server or link saturates.
+    """
+
+    def __init__(self, workers=8):
+        self.workers = max(1, workers)
+
+    def walk(self, start_dirs, known_dirs=()):
+        """List every directory in start_dirs and descend into subdirectories not in known_dirs.
+
+        Several roots can be walked at once and share the same pool. Returns
+        ({path: Listing}, {path: error}, seconds taken).
+        """
+        start_time = time.perf_counter()
+        start_dirs = list(start_dirs)
+        skip = set(known_dirs) | set(start_dirs)
+        listings = {}
+        failed = {}
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='scanner') as pool:
+            pending = {pool.submit(_timed_list, path): path for path in start_dirs}
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    path = pending.pop(future)
+                    try:
+                        listing = future.result()
+                    except OSError as e:
+                        logger.warning(f"Could not list {path}: {e}")
+                        failed[path] = e
+                        continue
+                    listings[path] = listing
+                    for subdir in listing.subdirs:
+                        if subdir not in skip:
+                            pending[pool.submit(_timed_list, subdir)] = subdir
+        return listings, failed, time.perf_counter() - start_time
+
+    def stat_dirs(self, paths):
+        """Return {path: mtime} for many directories at once, None for those that are gone"""
+        paths = list(paths)
+        STAT_CALLS.inc(len(paths), 'refresh')
+        if len(paths) < 2 or self.workers == 1:
+            return {path: _dir_mtime(path) for path in paths}
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='scanner') as pool:
+            return dict(zip(paths, pool.map(_dir_mtime, paths)))
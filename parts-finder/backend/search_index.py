@@ -0,0 +1,500 @@
+"""Precomputed name index used for substring and relevance ranked search over the indexed files"""
+import os
+import sys
+import bisect
+import threading
+import time
+import logging
+from array import array
+from columns import FileColumns
+from name_postings import NGRAM, SEPARATOR, TOKEN_PATTERN, encode, gram_keys
+from versions import VersionParser, version_key
+
+logger = logging.getLogger(__name__)
+
+# Stop intersecting posting lists once the candidates are this much smaller
+# than the next list, checking the few remaining names directly is cheaper
+INTERSECT_RATIO = 8
+# Posting ids gathered for a term shorter than NGRAM between checks of a ranked search's budget
+SCAN_CHUNK = 1 << 18
+
+TOKEN_CHARS = 'abcdefghijklmnopqrstuvwxyz0123456789'
+
+# Relevance of a query token found as a whole token of a name, as the start
+# of one, or within a few typos of one; averaged over the query's tokens
+EXACT_SCORE = 1.0
+PREFIX_SCORE = 0.75
+FUZZY_SCORE = 0.6
+FUZZY_EDIT_PENALTY = 0.15
+# Added for names containing the whole search term as typed
+SUBSTRING_SCORE = 0.25
+
+
+def max_edits(length):
+    """Typos tolerated in a query token, none in short ones, which would match nearly anything"""
+    if length < 4:
+        return 0
+    return 1 if length < 8 else 2
+
+
+def edit_distance(a, b, limit):
+    """Edits (insertions, deletions, substitutions, swaps of neighbours) between a and b, limit + 1 if more"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    for edits in range(limit + 1):
+        if _within(a, b, edits):
+            return edits
+    return limit + 1
+
+
+def _within(a, b, edits):
+    """True if a is at most edits away from b, trying each kind of edit at the first difference"""
+    start = 0
+    while start < len(a) and start < len(b) and a[start] == b[start]:
+        start += 1
+    a, b = a[start:], b[start:]
+    end = 0
+    while end < len(a) and end < len(b) and a[-1 - end] == b[-1 - end]:
+        end += 1
+    if end:
+        a, b = a[:-end], b[:-end]
+    if not a or not b:
+        return len(a) + len(b) <= edits
+    if not edits or abs(len(a) - len(b)) > edits:
+        return False
+    edits -= 1
+    return (_within(a[1:], b[1:], edits) or _within(a[1:], b, edits) or _within(a, b[1:], edits)
+            or (len(a) > 1 and len(b) > 1 and a[0] == b[1] and a[1] == b[0] and _within(a[2:], b[2:], edits)))
+
+
+def one_edit(token):
+    """Every token one insertion, deletion, substitution or swap of neighbours away from token"""
+    variants = set()
+    for i in range(len(token) + 1):
+        head, tail = token[:i], token[i:]
+        variants.update(head + char + tail for char in TOKEN_CHARS)
+        if tail:
+            variants.add(head + tail[1:])
+            variants.update(head + char + tail[1:] for char in TOKEN_CHARS)
+        if len(tail) > 1:
+            variants.add(head + tail[1] + tail[0] + tail[2:])
+    variants.discard(token)
+    return variants
+
+
+class _Budget:
+    """CPU time a ranked search may take, measured on the searching thread"""
+
+    def __init__(self, seconds):
+        self.deadline = None if seconds is None else time.thread_time() + seconds
+        self.exhausted = False
+
+    def spent(self):
+        if not self.exhausted and self.deadline is not None and time.thread_time() > self.deadline:
+            self.exhausted = True
+        return self.exhausted
+
+
+class TokenIndex:
+    """The distinct name tokens of a category, for exact, prefix and typo tolerant lookups.
+
+    The vocabulary is sorted, so a prefix is a range of it. Tokens one edit
+    off a query token are found by looking up every such variant of it, a
+    few hundred for a part number. For two edits there are too many, so
+    the vocabulary has its own trigram postings over the tokens padded with
+    ^ and $ as well: a token within d edits of a query token shares all but
+    at most (NGRAM + 1) * d of its trigrams, so only tokens appearing in
+    enough of the query's posting lists are compared with it. All of it is
+    read from the NamePostings of the columns.
+    """
+
+    def __init__(self, postings):
+        self.postings = postings
+        self.vocabulary = postings.vocabulary
+        self.files = postings.files
+
+    def exact(self, token):
+        """Return the id of a query token in the vocabulary, or None"""
+        return self.postings.token_id(token)
+
+    def prefixed(self, token, budget):
+        """Yield the ids of the tokens longer than a query token and starting with it"""
+        vocabulary = self.vocabulary
+        for token_id in range(bisect.bisect_right(vocabulary, token), len(vocabulary)):
+            if not vocabulary[token_id].startswith(token) or budget.spent():
+                break
+            yield token_id
+
+    def fuzzy(self, token, budget):
+        """Yield (token id, edits) of the tokens a few edits off a query token, prefixed ones excepted"""
+        edits = max_edits(len(token))
+        if not edits:
+            return
+        if edits == 1:
+            token_id_of = self.postings.token_id
+            for variant in one_edit(token):
+                token_id = token_id_of(variant)
+                if token_id is not None and not variant.startswith(token):
+                    yield token_id, 1
+            return
+        grams = gram_keys(f'^{token}$'.encode('ascii'))
+        needed = max(1, len(grams) - (NGRAM + 1) * edits)
+        shared = {}
+        for gram in grams:
+            for token_id in self.postings.token_postings(gram):
+                shared[token_id] = shared.get(token_id, 0) + 1
+        if budget.spent():
+            return
+        vocabulary = self.vocabulary
+        length = len(token)
+        # The most similar first, so running out of budget drops the least likely matches
+        candidates = sorted((token_id for token_id, hits in shared.items()
+                             if hits >= needed and abs(len(vocabulary[token_id]) - length) <= edits),
+                            key=shared.__getitem__, reverse=True)
+        for count, token_id in enumerate(candidates):
+            if count % 64 == 0 and budget.spent():
+                return
+            candidate = vocabulary[token_id]
+            if candidate.startswith(token):
+                continue
+            distance = edit_distance(token, candidate, edits)
+            if distance <= edits:
+                yield token_id, distance
+
+
+class NameIndex:
+    """Lowercased file names of one category with a trigram posting list.
+
+    A name contains a term only if it contains every trigram of that term,
+    so intersecting the term's posting lists yields a small candidate set
+    that is then checked with a plain substring test. Matches are therefore
+    exactly those of `term in name.lower()`.
+
+    The names and postings are the NamePostings stored with the FileColumns
+    of the entries, shared by every process mapping them; a plain list of
+    entries is encoded into columns in memory first.
+
+    Each file is also assigned its part family, and the latest revision of
+    every family is precomputed, so latest-only searches are a lookup per
+    matched family. Only these two arrays are held by each process.
+    """
+
+    def __init__(self, entries, version_parser=None, generation=0):
+        if not isinstance(entries, FileColumns):
+            entries = FileColumns.build(entries)
+        self.entries = entries
+        # The file index generation the entries are from
+        self.generation = generation
+        self.postings = entries.postings
+        self.tokens = TokenIndex(self.postings)
+        # Kept apart for sorting matches by date without building their entries
+        self.mtimes = entries.mtimes
+        self.version_parser = version_parser or VersionParser()
+        # Built on first lookup by path, most indexes are only ever searched
+        self._ids_by_path = None
+        self._part_keys = None
+        self._latest_by_type = None
+        self._memory = None
+        self._index_families()
+
+    def _index_families(self):
+        family_ids = {}
+        self.families = array('I')
+        latest = array('I')
+        newest = []
+        mtimes = self.mtimes
+        for file_id, name in enumerate(self.entries.names()):
+            family, version = self.version_parser.parse(name)
+            family_id = family_ids.setdefault(family, len(family_ids))
+            self.families.append(family_id)
+            # The most recently modified revision wins, the higher revision on a tie
+            rank = (mtimes[file_id], version_key(version))
+            if family_id == len(latest):
+                latest.append(file_id)
+                newest.append(rank)
+            elif rank > newest[family_id]:
+                latest[family_id] = file_id
+                newest[family_id] = rank
+        self._latest = latest
+
+    def __len__(self):
+        return len(self.entries)
+
+    def memory(self):
+        """Approximate bytes the index holds in this process on top of its entries, counted once.
+
+        The names and postings are part of the entries' columns. Lookups
+        built on first use, by path, by part number and of the latest
+        revision per file type, aren't included.
+        """
+        if self._memory is None:
+            self._memory = sys.getsizeof(self.families) + sys.getsizeof(self._latest)
+        return self._memory
+
+    def find(self, path):
+        """Return the entry indexed under path, or None"""
+        if self._ids_by_path is None:
+            self._ids_by_path = {entry.path: file_id for file_id, entry in enumerate(self.entries)}
+        file_id = self._ids_by_path.get(path)
+        return None if file_id is None else self.entries[file_id]
+
+    def resolve(self, part):
+        """Return the ids of the files a part number refers to in index order, and how it matched them.
+
+        Tried in order, each a dictionary lookup: the file name with or
+        without its extension ('name'), the part family of the revisions
+        ('family'), then the files with every token of the part number in
+        their name ('token'). Returns ([], None) if none match.
+        """
+        if self._part_keys is None:
+            names, families = {}, {}
+            for file_id, name in enumerate(self.entries.names()):
+                lowered = name.lower()
+                names.setdefault(lowered, []).append(file_id)
+                stem = os.path.splitext(lowered)[0]
+                if stem != lowered:
+                    names.setdefault(stem, []).append(file_id)
+                families.setdefault(self.version_parser.parse(name)[0].lower(), []).append(file_id)
+            self._part_keys = (names, families)
+        names, families = self._part_keys
+        part = part.strip().lower()
+        if part in names:
+            # A name can also be the stem of another file's name
+            return sorted(set(names[part])), 'name'
+        if part in families:
+            return families[part], 'family'
+        token_ids = [self.tokens.exact(token) for token in set(TOKEN_PATTERN.findall(part))]
+        if not token_ids or None in token_ids:
+            return [], None
+        lists = sorted((self.tokens.files[token_id] for token_id in token_ids), key=len)
+        file_ids = set(lists[0])
+        for ids in lists[1:]:
+            file_ids.intersection_update(ids)
+        return sorted(file_ids), 'token' if file_ids else None
+
+    def family(self, file_id):
+        return self.version_parser.parse(self.entries[file_id].name)[0]
+
+    def latest_scores(self, scores, by_type=False):
+        """Reduce {file id: score} to the latest scored revision of each family, keeping the family's best score"""
+        groups = {}
+        for file_id, score in scores.items():
+            key = self._family_key(file_id, by_type)
+            latest, best = groups.get(key, (file_id, score))
+            if self._is_newer(file_id, latest):
+                latest = file_id
+            groups[key] = (latest, max(best, score))
+        return dict(groups.values())
+
+    def latest(self, file_ids, by_type=False, family_wide=False):
+        """Return the latest revision of every family among file_ids, in index order.
+
+        The latest revision is picked among file_ids themselves, as the
+        baseline latestOnly search did; with family_wide it is the latest
+        indexed revision of the family, whether or not it is among file_ids.
+        With by_type the latest revision is picked among files of the same
+        extension, for searches filtered to one file type.
+        """
+        if family_wide and not by_type:
+            return sorted({self._latest[self.families[file_id]] for file_id in file_ids})
+        if family_wide:
+            if self._latest_by_type is None:
+                self._latest_by_type = self._newest(range(len(self)), by_type=True)
+            return sorted({self._latest_by_type[self._family_key(file_id, True)] for file_id in file_ids})
+        return sorted(self._newest(file_ids, by_type).values())
+
+    def _newest(self, file_ids, by_type):
+        newest = {}
+        for file_id in file_ids:
+            key = self._family_key(file_id, by_type)
+            current = newest.get(key)
+            if current is None or self._is_newer(file_id, current):
+                newest[key] = file_id
+        return newest
+
+    def _family_key(self, file_id, by_type):
+        if by_type:
+            return self.families[file_id], self.entries[file_id].ext
+        return self.families[file_id]
+
+    def _is_newer(self, file_id, other_id):
+        # The most recently modified revision wins, the higher revision on a tie
+        mtimes = self.mtimes
+        if mtimes[file_id] != mtimes[other_id]:
+            return mtimes[file_id] > mtimes[other_id]
+        return self._version_key(file_id) > self._version_key(other_id)
+
+    def _version_key(self, file_id):
+        # Only needed on a tie of mtimes, so parsed again rather than kept for every file
+        return version_key(self.version_parser.parse(self.entries[file_id].name)[1])
+
+    def match(self, term, budget=None):
+        """Return the ids of all names containing term, in index order.
+
+        A term shorter than a trigram is the start of the trigrams of the
+        names containing it, whose postings are gathered a chunk at a time;
+        that stops, leaving the ids found so far, once a _Budget is spent.
+        """
+        postings = self.postings
+        term = encode(term)
+        if SEPARATOR in term:
+            # No name holds one, and the postings of short terms would take it for padding
+            return []
+        if len(term) < NGRAM:
+            ids = postings.prefixed(term)
+            if budget is None:
+                return sorted(set(ids))
+            found = set()
+            for start in range(0, len(ids), SCAN_CHUNK):
+                if budget.spent():
+                    break
+                found.update(ids[start:start + SCAN_CHUNK])
+            return sorted(found)
+
+        grams = gram_keys(term)
+        if len(term) == NGRAM:
+            # Its only trigram, the postings are the matches
+            return list(postings.postings(grams.pop()))
+        lists = sorted((postings.postings(gram) for gram in grams), key=len)
+        candidates = set(lists[0])
+        for ids in lists[1:]:
+            if not candidates or len(candidates) * INTERSECT_RATIO < len(ids):
+                break
+            candidates.intersection_update(ids)
+        contains = postings.contains
+        return [file_id for file_id in sorted(candidates) if contains(file_id, term)]
+
+    def search(self, terms):
+        """Return the ids of names containing any of the terms, in index order"""
+        if len(terms) == 1:
+            return self.match(terms[0])
+        matched = set()
+        for term in terms:
+            matched.update(self.match(term))
+        return sorted(matched)
+
+
+    def rank(self, terms, budget_seconds=None):
+        """Score the names matching any of the terms by relevance, tolerating typos.
+
+        Returns ({file id: score}, complete). Each term is split into tokens
+        like the names are; a name scores the average over the tokens of how
+        well it matches each (whole token, start of one, or one within a few
+        edits), plus SUBSTRING_SCORE if it contains the term as typed, and
+        the best of its scores over the terms.
+
+        Matches are looked up best kind first for all tokens, and lookups
+        stop once the thread has used budget_seconds of CPU time. complete
+        is then False and only the weaker kinds of matches are missing.
+        """
+        budget = _Budget(budget_seconds)
+        tokens = self.tokens
+        queries = [(term, TOKEN_PATTERN.findall(term)) for term in terms]
+        # {(term, token): {file id: best score}}
+        best = {(term, token): {} for term, term_tokens in queries for token in term_tokens}
+
+        def add(key, token_ids, score):
+            # Kinds of matches are added best first, so a file already found matched better
+            found = best[key]
+            for token_id in token_ids:
+                found.update(dict.fromkeys([file_id for file_id in tokens.files[token_id] if file_id not in found],
+                                           score))
+                if budget.spent():
+                    return
+
+        for key in best:
+            token_id = tokens.exact(key[1])
+            if token_id is not None:
+                add(key, [token_id], EXACT_SCORE)
+        substrings = {term: [] if budget.spent() else self.match(term, budget) for term, _ in queries}
+        for key in best:
+            if not budget.spent():
+                add(key, tokens.prefixed(key[1], budget), PREFIX_SCORE)
+        for key in best:
+            if not budget.spent():
+                for token_id, distance in sorted(tokens.fuzzy(key[1], budget), key=lambda match: match[1]):
+                    add(key, [token_id], FUZZY_SCORE - FUZZY_EDIT_PENALTY * (distance - 1))
+
+        scores = {}
+        for term, term_tokens in queries:
+            if len(term_tokens) == 1:
+                term_scores = dict(best[(term, term_tokens[0])])
+            else:
+                term_scores = {}
+                for token in term_tokens:
+                    for file_id, score in best[(term, token)].items():
+                        term_scores[file_id] = term_scores.get(file_id, 0) + score / len(term_tokens)
+            for count, file_id in enumerate(substrings[term]):
+                if count % 4096 == 4095 and budget.spent():
+                    break
+                term_scores[file_id] = term_scores.get(file_id, 0) + SUBSTRING_SCORE
+            if not scores:
+                scores = term_scores
+                continue
+            for file_id, score in term_scores.items():
+                if score > scores.get(file_id, 0):
+                    scores[file_id] = score
+        return scores, not budget.exhausted
+
+
+class NameIndexCache:
+    """Keeps one NameIndex per category, rebuilt when the file index generation moves.
+
+    Building an index takes seconds on a large category, so once there is
+    one, searches keep getting it while a single background thread builds
+    its replacement; only the first search of a category waits for a build.
+    refresh() builds right away, for the indexer to call after a change.
+    """
+
+    def __init__(self, file_index, version_parsers=None):
+        self.file_index = file_index
+        # Categories without their own parser use the default naming convention
+        self.version_parsers = version_parsers or {}
+        self._lock = threading.Lock()
+        self._build_locks = {}
+        self._building = set()
+        self._indexes = {}
+
+    def get(self, category):
+        generation = self.file_index.snapshot(category)[0]
+        cached = self._indexes.get(category)
+        if cached is None:
+            return self.refresh(category)
+        if cached[0] != generation:
+            with self._lock:
+                start = category not in self._building
+                self._building.add(category)
+            if start:
+                threading.Thread(target=self._build_in_background, args=(category,),
+                                 name=f'name-index-{category}', daemon=True).start()
+        return cached[1]
+
+    def memory(self, category):
+        """NameIndex.memory() of the index kept for a category, None if none was built yet"""
+        cached = self._indexes.get(category)
+        return cached[1].memory() if cached is not None else None
+
+    def _build_in_background(self, category):
+        try:
+            self.refresh(category)
+        except Exception:
+            logger.exception(f"Could not build the name index for {category}")
+        finally:
+            with self._lock:
+                self._building.discard(category)
+
+    def refresh(self, category):
+        """Return the index of a category's current files, building it first if it is out of date"""
+        with self._lock:
+            build_lock = self._build_locks.setdefault(category, threading.Lock())
+        with build_lock:
+            generation, entries = self.file_index.snapshot(category)
+            cached = self._indexes.get(category)
+            if cached is not None and cached[0] == generation:
+                return cached[1]
+            start_time = time.time()
+            name_index = NameIndex(entries or [], self.version_parsers.get(category), generation)
+            self._indexes[category] = (generation, name_index)
+        logger.info(f"Built name index for {category} ({len(name_index)} files) "
+                    f"in {int((time.time() - start_time) * 1000)}ms")
+        return name_index
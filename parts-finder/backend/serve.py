@@ -0,0 +1,114 @@
+"""Production server for Parts Finder.
+
+Runs the app under gunicorn with several worker processes, each serving
+requests on a pool of threads. The app, and with it the loaded file index,
+is imported once before the workers are forked, so they share its memory
+copy-on-write and read the same SQLite pages through a memory map. One
+worker runs the background indexer and the others pick up its changes,
+see app.start_index_sync().
+
+On Windows, where gunicorn doesn't run, and with a single worker, waitress
+serves the app from one process with a pool of threads instead.
+
+    python serve.py --workers 4 --threads 8
+"""
+import os
+import sys
+import argparse
+import multiprocessing
+
+os.environ.setdefault('FLASK_ENV', 'production')
+
+backend_dir = os.path.dirname(os.path.abspath(__file__))
+if backend_dir not in sys.path:
+    sys.path.insert(0, backend_dir)
+
+try:
+    from gunicorn.app.base import BaseApplication
+except ImportError:
+    BaseApplication = None
+
+# Model files come from network shares, allow slow reads before a worker is restarted
+WORKER_TIMEOUT = 300
+
+
+def post_fork(server, worker):
+    from app import start_index_sync
+    start_index_sync()
+
+
+def worker_exit(server, worker):
+    from app import stop_indexer
+    # Also releases the indexer lock so another worker takes over
+    stop_indexer()
+
+
+if BaseApplication is not None:
+    class GunicornServer(BaseApplication):
+        """Runs the preloaded Flask app under gunicorn with options given in code"""
+
+        def __init__(self, options):
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            from app import app
+            return app
+
+
+def serve_gunicorn(host, port, workers, threads):
+    GunicornServer({
+        'bind': f'{host}:{port}',
+        'workers': workers,
+        'threads': threads,
+        'worker_class': 'gthread',
+        'preload_app': True,
+        'timeout': WORKER_TIMEOUT,
+        'post_fork': post_fork,
+        'worker_exit': worker_exit,
+    }).run()
+
+
+def serve_waitress(host, port, threads):
+    from waitress import serve
+    from app import app, start_indexer, stop_indexer
+    start_indexer()
+    try:
+        serve(app, host=host, port=port, threads=threads)
+    finally:
+        stop_indexer()
+
+
+def main(argv=None):
+    from config import get_config
+    config_instance = get_config()()
+    parser = argparse.ArgumentParser(description='Run Parts Finder with a production server')
+    parser.add_argument('--host', default=os.environ.get('FLASK_HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('FLASK_PORT', 5000)))
+    parser.add_argument('--workers', type=int, default=config_instance.SERVER_WORKERS,
+                        help='Server processes (SERVER_WORKERS)')
+    parser.add_argument('--threads', type=int, default=config_instance.SERVER_THREADS,
+                        help='Request threads per process (SERVER_THREADS)')
+    args = parser.parse_args(argv)
+
+    workers = max(1, args.workers)
+    threads = max(1, args.threads)
+    if workers > 1 and BaseApplication is None:
+        print("gunicorn is not available on this platform, serving from one process with waitress")
+        workers = 1
+    print(f"Starting Parts Finder on http://{args.host}:{args.port} "
+          f"with {workers} worker(s) x {threads} threads")
+    if workers > 1:
+        serve_gunicorn(args.host, args.port, workers, threads)
+    else:
+        serve_waitress(args.host, args.port, threads)
+
+
+if __name__ == '__main__':
+    # Geometry extraction runs in worker processes, which frozen builds must be able to start
+    multiprocessing.freeze_support()
+    main()
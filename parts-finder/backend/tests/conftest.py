@@ -0,0 +1,9 @@
+import os
+import tempfile
+
+# Keep the app's persistent index and job state out of the source tree during tests
+_state_dir = tempfile.mkdtemp(prefix='parts-finder-test-')
+os.environ.setdefault('INDEX_PATH', os.path.join(_state_dir, 'file_index.db'))
+os.environ.setdefault('COPY_JOBS_DIR', os.path.join(_state_dir, 'copy_jobs'))
+os.environ.setdefault('MODEL_CACHE_DIR', os.path.join(_state_dir, 'models'))
+os.environ.setdefault('THUMBNAIL_DIR', os.path.join(_state_dir, 'thumbnails'))
@@ -1,12 +1,34 @@
+import os
+import json
+import time
+import io
+import zipfile
+from urllib.parse import quote
 import pytest
+import app as app_module
 from app import app
 
 @pytest.fixture
 def client():
     app.config['TESTING'] = True
+    # Each test starts within the per-minute rate limits
+    app_module.limiter.reset()
     with app.test_client() as client:
         yield client
 
+@pytest.fixture
+def parts_root(tmp_path, monkeypatch):
+    root = tmp_path / 'parts'
+    (root / 'brackets').mkdir(parents=True)
+    (root / 'brackets' / 'bracket_v1.stl').write_bytes(b'solid a')
+    (root / 'brackets' / 'bracket_v2.stl').write_bytes(b'solid ab')
+    (root / 'housing.3mf').write_bytes(b'PK')
+    monkeypatch.setitem(app_module.DIRECTORIES, 'motorcycle', str(root))
+    app_module.file_index.rebuild('motorcycle', str(root))
+    # As the indexer does after a change, searches otherwise get the previous index meanwhile
+    app_module.index_changed('motorcycle')
+    return root
+
 def test_search_endpoint(client):
     response = client.post('/api/search', json={
         'category': 'motorcycle',
@@ -14,4 +36,352 @@ def test_search_endpoint(client):
     })
     assert response.status_code == 200
     data = response.get_json()
-    assert 'results' in data 
\ No newline at end of file
+    assert 'results' in data
+
+def test_search_makes_no_filesystem_calls(parts_root, monkeypatch):
+    def no_fs_access(*args, **kwargs):
+        raise AssertionError('search touched the filesystem')
+    for name in ('stat', 'scandir', 'listdir'):
+        monkeypatch.setattr(os, name, no_fs_access)
+    for name in ('exists', 'isfile', 'isdir', 'getsize', 'getmtime'):
+        monkeypatch.setattr(os.path, name, no_fs_access)
+
+    results = app_module.search_files('motorcycle', 'bracket, housing')
+
+    assert sorted(r['name'] for r in results) == ['bracket_v1.stl', 'bracket_v2.stl', 'housing.3mf']
+    bracket = next(r for r in results if r['name'] == 'bracket_v2.stl')
+    assert bracket['size'] == 8
+    assert bracket['relative_path'] == os.path.join('brackets', 'bracket_v2.stl')
+
+def test_search_pages_with_cursor(client, parts_root):
+    for i, name in enumerate(['bracket_v1.stl', 'bracket_v2.stl', 'housing.3mf']):
+        path = parts_root / 'brackets' / name if name.startswith('bracket') else parts_root / name
+        os.utime(path, (1000 + i, 1000 + i))
+    app_module.file_index.rebuild('motorcycle', str(parts_root))
+    app_module.index_changed('motorcycle')
+
+    query = {'category': 'motorcycle', 'searchTerm': 'bracket\nhousing', 'limit': 2}
+    first = client.post('/api/search', json=query).get_json()
+    assert [r['name'] for r in first['results']] == ['housing.3mf', 'bracket_v2.stl']
+    assert first['stats']['matched_files'] == 3
+
+    second = client.post('/api/search', json=dict(query, cursor=first['next_cursor'])).get_json()
+    assert [r['name'] for r in second['results']] == ['bracket_v1.stl']
+    assert second['next_cursor'] is None
+
+    other = client.post('/api/search', json=dict(query, searchTerm='housing', cursor=first['next_cursor']))
+    assert other.status_code == 400
+
+    # An empty page would hand back a cursor to the same offset forever
+    empty = client.post('/api/search', json=dict(query, limit=0))
+    assert empty.status_code == 400
+    assert 'limit' in empty.get_json()['error']
+    assert client.get('/api/duplicates?limit=0').status_code == 400
+
+def test_search_streams_ndjson(client, parts_root):
+    response = client.post('/api/search', json={
+        'category': 'motorcycle',
+        'searchTerm': 'bracket',
+        'stream': True
+    })
+    assert response.mimetype == 'application/x-ndjson'
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert sorted(line['name'] for line in lines[:-1]) == ['bracket_v1.stl', 'bracket_v2.stl']
+    assert lines[-1]['stats']['matched_files'] == 2
+
+def test_archive_streams_zip_of_selected_files(client, parts_root):
+    paths = [str(parts_root / 'brackets' / 'bracket_v1.stl'), str(parts_root / 'housing.3mf')]
+    response = client.post('/api/archive', data={'path': paths})
+    assert response.status_code == 200
+    assert response.mimetype == 'application/zip'
+    archive = zipfile.ZipFile(io.BytesIO(response.get_data()))
+    assert archive.read('bracket_v1.stl') == b'solid a'
+    assert archive.read('housing.3mf') == b'PK'
+
+    denied = client.post('/api/archive', json={'files': [{'path': __file__}]})
+    assert denied.status_code == 403
+
+def test_model_supports_conditional_and_range_requests(client, parts_root, monkeypatch):
+    # Model paths are drive paths on the shares, use a relative one here
+    monkeypatch.chdir(parts_root)
+    url = '/api/model/' + quote(os.path.join('brackets', 'bracket_v2.stl'))
+    first = client.get(url)
+    assert first.status_code == 200
+    assert first.get_data() == b'solid ab'
+    etag = first.headers['ETag']
+
+    repeat = client.get(url, headers={'If-None-Match': etag})
+    assert repeat.status_code == 304
+    assert repeat.get_data() == b''
+
+    partial = client.get(url, headers={'Range': 'bytes=2-4'})
+    assert partial.status_code == 206
+    assert partial.get_data() == b'lid'
+    assert partial.headers['Content-Range'] == 'bytes 2-4/8'
+
+def test_model_is_served_gzipped_from_cache(client, parts_root, monkeypatch):
+    monkeypatch.chdir(parts_root)
+    path = os.path.join('brackets', 'bracket_v2.stl')
+    entry = app_module.lookup_entry(path)
+    app_module.model_cache.build(os.path.abspath(path), entry.size, entry.mtime)
+
+    response = client.get('/api/model/' + quote(path), headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert response.headers['ETag'].endswith('-gz"')
+
+    plain = client.get('/api/model/' + quote(path))
+    assert 'Content-Encoding' not in plain.headers
+    assert plain.get_data() == b'solid ab'
+
+def test_model_lod_serves_decimated_preview(client, parts_root, monkeypatch):
+    from mesh import write_stl
+    from test_mesh import grid_mesh
+    write_stl(grid_mesh(100), str(parts_root / 'brackets' / 'plate_v1.stl'))
+    monkeypatch.chdir(parts_root)
+    monkeypatch.setattr(app_module.config_instance, 'MODEL_LOD_LEVELS', [1000, 5000])
+    url = '/api/model-lod/' + quote(os.path.join('brackets', 'plate_v1.stl'))
+
+    # The full model is sent while the preview is built in the background
+    response = client.get(url + '?triangles=800')
+    assert response.status_code == 302
+    assert response.headers['Location'].startswith('/api/model/')
+    deadline = time.time() + 10
+    while response.status_code == 302 and time.time() < deadline:
+        time.sleep(0.05)
+        response = client.get(url + '?triangles=800')
+    assert response.status_code == 200
+    assert response.headers['X-Original-Triangles'] == '20000'
+    assert int(response.headers['X-LOD-Triangles']) <= 1000
+    assert response.get_data()[80:84] == int(response.headers['X-LOD-Triangles']).to_bytes(4, 'little')
+
+    repeat = client.get(url + '?triangles=800', headers={'If-None-Match': response.headers['ETag']})
+    assert repeat.status_code == 304
+
+    # Models within the budget are sent in full
+    small = client.get('/api/model-lod/' + quote(os.path.join('brackets', 'bracket_v2.stl')))
+    assert small.status_code == 302
+    assert small.headers['Location'].startswith('/api/model/')
+
+def test_search_filters_on_stored_geometry(client, parts_root):
+    from geometry import Geometry
+    entries = {entry.name: entry for entry in app_module.file_index.get_entries('motorcycle')}
+    app_module.file_index.store_geometry([
+        (entries['bracket_v1.stl'], Geometry(12, 0, 0, 0, 150, 40, 10, 1.0, 2.0), '', ''),
+        (entries['bracket_v2.stl'], Geometry(12, 0, 0, 0, 250, 40, 10, 1.0, 2.0), '', ''),
+    ])
+
+    response = client.post('/api/search', json={
+        'category': 'motorcycle', 'searchTerm': 'bracket',
+        'filters': {'extent_x': {'max': 200}},
+    })
+    results = response.get_json()['results']
+    assert [result['name'] for result in results] == ['bracket_v1.stl']
+    assert results[0]['geometry']['extent'] == [150, 40, 10]
+
+    invalid = client.post('/api/search', json={
+        'category': 'motorcycle', 'searchTerm': 'bracket', 'filters': {'colour': {'max': 1}},
+    })
+    assert invalid.status_code == 400
+
+def test_thumbnails_are_linked_from_results_and_cached_for_good(client, parts_root):
+    from geometry import Geometry
+    digest = app_module.thumbnails.save(b'\x89PNG\r\n\x1a\nfake')
+    entries = {entry.name: entry for entry in app_module.file_index.get_entries('motorcycle')}
+    app_module.file_index.store_geometry([
+        (entries['bracket_v2.stl'], Geometry(12, 0, 0, 0, 1, 1, 1, 1.0, 1.0), digest, ''),
+    ])
+
+    results = client.post('/api/search', json={'category': 'motorcycle', 'searchTerm': 'bracket_v2'}).get_json()['results']
+    response = client.get(results[0]['thumbnail'])
+    assert response.status_code == 200
+    assert response.mimetype == 'image/png'
+    assert 'immutable' in response.headers['Cache-Control']
+    assert client.get('/api/thumbnail/not-a-digest').status_code == 404
+
+def test_model_head_and_batch_file_check_answer_from_index(client, parts_root, monkeypatch):
+    monkeypatch.chdir(parts_root)
+    path = os.path.join('brackets', 'bracket_v2.stl')
+    app_module.name_indexes.get('motorcycle')
+
+    def no_fs_access(*args, **kwargs):
+        raise AssertionError('touched the filesystem')
+    for name in ('stat', 'scandir', 'listdir'):
+        monkeypatch.setattr(os, name, no_fs_access)
+    for name in ('exists', 'isfile', 'isdir', 'getsize', 'getmtime'):
+        monkeypatch.setattr(os.path, name, no_fs_access)
+
+    head = client.head('/api/model/' + quote(path))
+    assert head.status_code == 200
+    assert head.headers['Content-Length'] == '8'
+    assert head.headers['ETag']
+    assert head.get_data() == b''
+
+    response = client.post('/api/file-check', json={'paths': [path, '/etc/passwd']})
+    files = response.get_json()['files']
+    assert files[0]['exists'] and files[0]['allowed'] and files[0]['size'] == 8
+    assert not files[1]['allowed'] and not files[1]['exists']
+
+def test_model_head_neither_claims_nor_builds_a_compressed_copy(client, parts_root, monkeypatch):
+    monkeypatch.chdir(parts_root)
+    built = []
+    monkeypatch.setattr(app_module.model_cache, '_build', lambda *args: built.append(args))
+
+    head = client.head('/api/model/' + quote(os.path.join('brackets', 'bracket_v1.stl')),
+                       headers={'Accept-Encoding': 'gzip'})
+    assert head.status_code == 200
+    assert 'Content-Encoding' not in head.headers
+    assert built == []
+
+def test_sibling_directory_with_same_prefix_is_not_allowed(parts_root, tmp_path):
+    sibling = tmp_path / 'parts-private' / 'secret.stl'
+    assert app_module.is_allowed_path(str(parts_root / 'brackets' / 'bracket_v1.stl'))
+    assert not app_module.is_allowed_path(str(sibling))
+
+def test_requests_fail_fast_while_drive_is_down(client, parts_root, monkeypatch):
+    monkeypatch.chdir(parts_root)
+    url = '/api/model/' + quote(os.path.join('brackets', 'bracket_v2.stl'))
+    etag = client.get(url).headers['ETag']
+    monkeypatch.setattr(app_module.drive_prober, 'is_available', lambda category: category != 'motorcycle')
+
+    assert client.get('/api/health').get_json()['drives_ok'] is False
+    down = client.get(url)
+    assert down.status_code == 503
+    assert 'Retry-After' in down.headers
+    # Revalidation and searches are still answered from the index
+    assert client.get(url, headers={'If-None-Match': etag}).status_code == 304
+    search = client.post('/api/search', json={'category': 'motorcycle', 'searchTerm': 'bracket'})
+    assert search.get_json()['stats']['drive_available'] is False
+    assert len(search.get_json()['results']) == 2
+
+def test_metrics_endpoint_reports_search_latency(client, parts_root):
+    client.post('/api/search', json={'category': 'motorcycle', 'searchTerm': 'bracket'})
+
+    response = client.get('/api/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    text = response.get_data(as_text=True)
+    assert 'partsfinder_search_seconds_count{category="motorcycle"}' in text
+    assert 'partsfinder_request_seconds_bucket{endpoint="api_search",method="POST",le="+Inf"}' in text
+    assert 'partsfinder_indexed_files{category="motorcycle"} 3' in text
+
+def test_duplicates_are_counted_collapsed_and_listed(client, parts_root):
+    (parts_root / 'brackets' / 'bracket_copy.stl').write_bytes(b'solid ab')
+    index = app_module.file_index
+    index.rebuild('motorcycle', str(parts_root))
+    entries = {entry.name: entry for entry in index.get_entries('motorcycle')}
+    os.utime(entries['bracket_copy.stl'].path, (0, 0))
+    index.rebuild('motorcycle', str(parts_root))
+    app_module.index_changed('motorcycle')
+    entries = {entry.name: entry for entry in index.get_entries('motorcycle')}
+    index.store_hashes([(entries[name], 'partial', 'same') for name in ('bracket_v2.stl', 'bracket_copy.stl')])
+    # Searches serve the previous clusters until the background rebuild is done
+    app_module.duplicate_clusters.refresh()
+
+    def search(**fields):
+        response = client.post('/api/search', json=dict(category='motorcycle', searchTerm='bracket',
+                                                        duplicates=True, **fields))
+        return {result['name']: result['duplicates'] for result in response.get_json()['results']}
+
+    assert search()['bracket_copy.stl'] == {'content': 1, 'geometry': 0}
+    # Only counted when asked for
+    plain = client.post('/api/search', json={'category': 'motorcycle', 'searchTerm': 'bracket'}).get_json()
+    assert 'duplicates' not in plain['results'][0]
+    assert plain['stats']['duplicates_ready'] is None
+    # The older copy is dropped
+    assert sorted(search(collapseDuplicates=True)) == ['bracket_v1.stl', 'bracket_v2.stl']
+    assert len(search(collapseDuplicates='geometry')) == 3
+    assert client.post('/api/search', json={'category': 'motorcycle', 'searchTerm': 'bracket',
+                                            'collapseDuplicates': 'name'}).status_code == 400
+
+    data = client.get('/api/duplicates?kind=content').get_json()
+    assert data['total_clusters'] == 1
+    assert data['total_reclaimable_bytes'] == len(b'solid ab')
+    assert [member['name'] for member in data['clusters'][0]['members']] == ['bracket_v2.stl', 'bracket_copy.stl']
+    assert client.get('/api/duplicates?kind=colour').status_code == 400
+
+def test_ranked_search_orders_by_relevance_and_tolerates_typos(client, parts_root):
+    response = client.post('/api/search', json={'category': 'motorcycle', 'searchTerm': 'brakcet', 'rank': True})
+    data = response.get_json()
+    assert sorted(result['name'] for result in data['results']) == ['bracket_v1.stl', 'bracket_v2.stl']
+    assert data['stats']['complete'] is True
+    assert all(0 < result['score'] for result in data['results'])
+    assert client.post('/api/search', json={'category': 'motorcycle', 'searchTerm': 'brakcet'}).get_json()['results'] == []
+
+    latest = client.post('/api/search', json={'category': 'motorcycle', 'searchTerm': 'bracket v1', 'rank': True,
+                                              'latestOnly': True, 'limit': 1}).get_json()
+    assert [result['name'] for result in latest['results']] == ['bracket_v2.stl']
+    assert latest['next_cursor'] is None
+
+def test_latest_only_keeps_the_latest_matching_revision(client, parts_root):
+    def search(term):
+        return [result['name'] for result in client.post('/api/search', json={
+            'category': 'motorcycle', 'searchTerm': term, 'latestOnly': True}).get_json()['results']]
+
+    assert search('bracket') == ['bracket_v2.stl']
+    # A newer revision not matching the term is not swapped in
+    assert search('bracket_v1') == ['bracket_v1.stl']
+
+def test_ranked_search_cut_short_is_not_cached(client, parts_root, monkeypatch):
+    monkeypatch.setattr(app_module.config_instance, 'SEARCH_RANK_BUDGET_MS', 0)
+    query = {'category': 'motorcycle', 'searchTerm': 'brakcet', 'rank': True}
+    first = client.post('/api/search', json=query).get_json()['stats']
+    assert first['complete'] is False
+    repeat = client.post('/api/search', json=query).get_json()['stats']
+    assert repeat['cache']['hit'] is False
+
+    monkeypatch.setattr(app_module.config_instance, 'SEARCH_RANK_BUDGET_MS', 1000)
+    client.post('/api/search', json=query)
+    assert client.post('/api/search', json=query).get_json()['stats']['cache']['hit'] is True
+
+def test_bom_lookup_reports_each_line(client, parts_root):
+    response = client.post('/api/bom', json={'category': 'motorcycle', 'parts': ['bracket', 'frame', 'housing']})
+    data = response.get_json()
+    assert [line['status'] for line in data['lines']] == ['found', 'missing', 'found']
+    assert data['lines'][0]['latest']['name'] == 'bracket_v2.stl'
+    assert data['stats']['missing'] == 1
+
+    upload = client.post('/api/bom', data={
+        'category': 'motorcycle', 'latestOnly': 'true',
+        'file': (io.BytesIO(b'Part,Qty\nbracket,2\n'), 'bom.csv'),
+    }, content_type='multipart/form-data')
+    line = upload.get_json()['lines'][0]
+    assert [result['name'] for result in line['files']] == ['bracket_v2.stl']
+    assert line['quantity'] == '2'
+    assert client.post('/api/bom', json={'category': 'motorcycle', 'parts': 'bracket'}).status_code == 400
+
+def test_repeated_searches_are_cached_until_the_index_changes(client, parts_root):
+    def search(term):
+        return client.post('/api/search', json={'category': 'motorcycle', 'searchTerm': term}).get_json()
+
+    first = search('bracket, housing')
+    again = search('HOUSING,bracket')
+    assert first['stats']['cache']['hit'] is False
+    assert again['stats']['cache']['hit'] is True
+    assert again['results'] == first['results']
+    # Pages of a cached search are picked from its cached matches
+    page = client.post('/api/search', json={'category': 'motorcycle', 'searchTerm': 'housing, bracket',
+                                            'limit': 1, 'offset': 1}).get_json()
+    assert page['stats']['cache']['hit'] is True
+    assert page['results'] == first['results'][1:2]
+
+    # Filters are keyed by what they ask for, in any order
+    filtered = {'category': 'motorcycle', 'searchTerm': 'bracket',
+                'filters': {'volume': {'min': 1}, 'extent_x': {'max': 200}}}
+    assert client.post('/api/search', json=filtered).get_json()['stats']['cache']['hit'] is False
+    reordered = dict(filtered, filters={'extent_x': {'max': 200.0}, 'volume': {'min': 1}})
+    assert client.post('/api/search', json=reordered).get_json()['stats']['cache']['hit'] is True
+
+    (parts_root / 'bracket_v3.stl').write_bytes(b'solid abc')
+    app_module.file_index.refresh('motorcycle', str(parts_root))
+    app_module.index_changed('motorcycle')
+    after = search('bracket, housing')
+    assert after['stats']['cache']['hit'] is False
+    assert after['results'][0]['name'] == 'bracket_v3.stl'
+
+def test_index_status_counts_the_name_index(client, parts_root):
+    memory = client.get('/api/index-status').get_json()['categories']['motorcycle']['memory']
+    assert memory['name_index_bytes'] > 0
+    assert memory['process_bytes'] == memory['heap_bytes'] + memory['name_index_bytes']
+    assert memory['bytes_per_file'] * memory['files'] > memory['column_bytes'] + memory['name_index_bytes'] - memory['files']
@@ -0,0 +1,20 @@
+import io
+import zipfile
+from archive import stream_zip
+
+
+def test_stream_zip_yields_chunks_of_a_valid_archive(tmp_path):
+    first = tmp_path / 'a' / 'part.stl'
+    second = tmp_path / 'b' / 'part.stl'
+    for path, size in ((first, 3 * 1024 * 1024), (second, 10)):
+        path.parent.mkdir()
+        path.write_bytes(b'solid facet normal 0 0 1\n' * (size // 25 + 1))
+
+    chunks = list(stream_zip([str(first), str(second), str(tmp_path / 'gone.stl')]))
+
+    assert len(chunks) > 3
+    archive = zipfile.ZipFile(io.BytesIO(b''.join(chunks)))
+    assert archive.testzip() is None
+    assert archive.read('part.stl') == first.read_bytes()
+    assert archive.read('part_1.stl') == second.read_bytes()
+    assert 'gone.stl' in archive.read('MISSING.txt').decode()
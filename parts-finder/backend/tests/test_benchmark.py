@@ -0,0 +1,35 @@
+import os
+from benchmark import MANIFEST_NAME, compare_reports, generate_tree
+
+
+def list_tree(root):
+    return sorted(os.path.relpath(os.path.join(path, name), root)
+                  for path, _, names in os.walk(root) for name in names if name != MANIFEST_NAME)
+
+
+def test_generated_tree_is_reproducible(tmp_path):
+    first, second = str(tmp_path / 'a'), str(tmp_path / 'b')
+    assert generate_tree(first, files=300, depth=2, files_per_dir=20) == 300
+    generate_tree(second, files=300, depth=2, files_per_dir=20)
+
+    files = list_tree(first)
+    assert files == list_tree(second)
+    assert len(files) == 300
+    assert all(os.path.basename(path).split('_v')[1][:-4].isdigit() for path in files)
+    assert {path.count(os.sep) for path in files} == {2}
+    # Later revisions of a part are newer
+    v1 = os.path.join(first, next(path for path in files if path.endswith('_v1.stl')))
+    v2 = v1.replace('_v1.stl', '_v2.stl')
+    if os.path.exists(v2):
+        assert os.path.getmtime(v2) > os.path.getmtime(v1)
+
+
+def test_compare_flags_regressions_beyond_threshold():
+    baseline = {'results': {'search': {'median_ms': 10.0, 'p95_ms': 10.0},
+                            'copy': {'bytes_per_second': 1000}}}
+    report = {'results': {'search': {'median_ms': 15.0, 'p95_ms': 50.0},
+                          'copy': {'bytes_per_second': 1100}}}
+
+    rows, regressions = compare_reports(baseline, report, threshold=0.2)
+    assert ('copy', 'bytes_per_second', 1000, 1100, 0.1) in rows
+    assert regressions == [('search', 'median_ms', 10.0, 15.0, -0.5)]
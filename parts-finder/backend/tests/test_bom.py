@@ -0,0 +1,30 @@
+from file_index import FileEntry
+from search_index import NameIndex
+import bom
+
+
+def make_entries(names):
+    return [FileEntry(f'/parts/{name}', name, '.' + name.rsplit('.', 1)[1], 0, float(mtime))
+            for mtime, name in enumerate(names)]
+
+
+def test_read_csv_finds_part_and_quantity_columns():
+    assert bom.read_csv('Pos;Part Number;Qty\n1;BRK-100;4\n2;;1\n3;HSG-7;\n') == [('BRK-100', '4'), ('HSG-7', None)]
+    assert bom.read_csv('bracket\nhousing, spare\n') == [('bracket', None), ('housing', None)]
+    assert bom.read_csv('') == []
+
+
+def test_resolve_groups_matches_per_part():
+    name_index = NameIndex(make_entries([
+        'bracket_v1.stl', 'bracket_v2.stl', 'bracket_v2.3mf', 'mount_000123_v1.stl', 'housing.3mf',
+    ]))
+    lines = bom.resolve(name_index, ['Bracket', 'housing', '000123', 'bracket_v1', 'frame', 'bracket'])
+
+    assert [line['matched_by'] for line in lines] == ['family', 'name', 'token', 'name', None, 'family']
+    assert [entry.name for entry in lines[0]['matches']] == ['bracket_v2.3mf', 'bracket_v2.stl', 'bracket_v1.stl']
+    # An older revision asked for by name still reports the latest one
+    assert lines[3]['latest'].name == 'bracket_v2.3mf'
+    assert lines[4]['matches'] == [] and lines[4]['latest'] is None
+
+    latest = bom.resolve(name_index, ['bracket'], file_type='stl', latest_only=True)[0]
+    assert [entry.name for entry in latest['matches']] == ['bracket_v2.stl']
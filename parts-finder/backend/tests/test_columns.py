@@ -0,0 +1,90 @@
+import os
+import pytest
+from columns import FileColumns, encode_columns, write_columns
+from file_index import FileIndex
+from scanner import FileEntry
+
+
+ENTRIES = [
+    FileEntry(os.path.join('parts', 'brackets', 'bracket_v1.stl'), 'bracket_v1.stl', '.stl', 7, 1700000000.5),
+    FileEntry(os.path.join('parts', 'brackets', 'bracket_v2.STL'), 'bracket_v2.STL', '.stl', 2 ** 40, 1700000001.25),
+    FileEntry(os.path.join('parts', 'housing.3mf'), 'housing.3mf', '.3mf', 0, 0.0),
+    # An undecodable byte in a name, as os.listdir returns it
+    FileEntry(os.path.join('parts', 'gr\udcfcn.stl'), 'gr\udcfcn.stl', '.stl', 3, 2.0),
+    FileEntry(os.path.join('parts', 'früh.stl'), 'früh.stl', '.stl', 4, 3.0),
+    # Path not ending with the name, stored whole
+    FileEntry('elsewhere.stl', 'renamed.stl', '.stl', 5, 4.0),
+]
+
+
+def test_columns_round_trip_entries():
+    columns = FileColumns.build(ENTRIES)
+
+    assert len(columns) == len(ENTRIES)
+    assert list(columns) == ENTRIES
+    assert [columns[i] for i in range(len(ENTRIES))] == ENTRIES
+    assert list(columns.names()) == [entry.name for entry in ENTRIES]
+    assert columns[-1] == ENTRIES[-1]
+    assert columns[1:4] == ENTRIES[1:4]
+    assert columns[::-2] == ENTRIES[::-2]
+    with pytest.raises(IndexError):
+        columns[len(ENTRIES)]
+    assert list(FileColumns.build([])) == []
+
+
+def test_columns_are_read_through_a_memory_map(tmp_path):
+    path = str(tmp_path / 'columns' / 'motorcycle.1.cols')
+    write_columns(path, encode_columns(ENTRIES))
+
+    columns = FileColumns.open(path)
+    assert list(columns) == ENTRIES
+    memory = columns.memory()
+    assert memory['files'] == len(ENTRIES)
+    assert memory['dirs'] == 3
+    assert memory['shared'] and not FileColumns.build(ENTRIES).memory()['shared']
+    assert memory['column_bytes'] == os.path.getsize(path)
+
+    (tmp_path / 'bad.cols').write_bytes(b'not columns at all')
+    with pytest.raises(ValueError):
+        FileColumns.open(str(tmp_path / 'bad.cols'))
+
+
+def test_file_index_keeps_one_column_file_per_category(tmp_path):
+    parts = tmp_path / 'parts'
+    parts.mkdir()
+    (parts / 'bracket_v1.stl').write_bytes(b'solid a')
+    db_path = str(tmp_path / 'index.db')
+    index = FileIndex(db_path)
+    index.rebuild('motorcycle', str(parts))
+    assert os.listdir(db_path + '-columns') == ['motorcycle.1.cols']
+
+    (parts / 'bracket_v2.stl').write_bytes(b'solid ab')
+    os.utime(parts, (1, 1))
+    index.refresh('motorcycle', str(parts))
+    assert os.listdir(db_path + '-columns') == ['motorcycle.2.cols']
+    assert index.memory('motorcycle')['shared']
+
+    # Another process maps the current file, and rebuilds it if it's gone
+    follower = FileIndex(db_path)
+    follower.load()
+    assert sorted(entry.name for entry in follower.get_entries('motorcycle')) == ['bracket_v1.stl', 'bracket_v2.stl']
+    os.remove(os.path.join(db_path + '-columns', 'motorcycle.2.cols'))
+    rebuilt = FileIndex(db_path)
+    rebuilt.load()
+    assert sorted(rebuilt.get_entries('motorcycle')) == sorted(index.get_entries('motorcycle'))
+
+
+def test_columns_carry_the_search_data_of_the_names():
+    from search_index import NameIndex
+    columns = FileColumns.build(ENTRIES)
+    postings = columns.postings
+    assert list(postings.names()) == [entry.name.lower() for entry in ENTRIES]
+    assert list(postings.vocabulary) == ['bracket', 'fr', 'gr', 'h', 'housing', 'n', 'renamed', 'v1', 'v2']
+    assert [ENTRIES[i].name for i in postings.files[postings.token_id('bracket')]] == ['bracket_v1.stl',
+                                                                                         'bracket_v2.STL']
+    assert postings.token_id('missing') is None
+
+    # Terms shorter than a trigram in bytes and longer ones, across multibyte and undecodable names
+    name_index = NameIndex(columns)
+    for term in ['ü', 'h.', 'früh', 'gr\udcfc', 'v2.stl', '.stl', 'xyz']:
+        assert name_index.match(term) == [i for i, entry in enumerate(ENTRIES) if term in entry.name.lower()]
@@ -0,0 +1,101 @@
+import os
+import json
+import time
+from copy_jobs import CopyJobManager, PARTIAL_SUFFIX, copy_file
+
+
+def wait_until_finished(job, timeout=10):
+    deadline = time.time() + timeout
+    while job.status == 'running' and time.time() < deadline:
+        time.sleep(0.02)
+    return job.to_dict()
+
+
+def test_copy_file_resumes_from_offset(tmp_path):
+    source = tmp_path / 'part.stl'
+    source.write_bytes(os.urandom(100000))
+    target = tmp_path / 'copy.stl'
+    target.write_bytes(source.read_bytes()[:40000] + b'garbage')
+
+    copied = []
+    copy_file(str(source), str(target), offset=40000, progress=copied.append)
+
+    assert target.read_bytes() == source.read_bytes()
+    assert sum(copied) == 60000
+
+
+def test_job_copies_files_and_resumes_failures(tmp_path):
+    sources = []
+    for i in range(5):
+        path = tmp_path / 'src' / f'part_{i}.stl'
+        path.parent.mkdir(exist_ok=True)
+        path.write_bytes(b'x' * (1000 * (i + 1)))
+        sources.append((str(path), path.stat().st_size))
+    missing = str(tmp_path / 'src' / 'missing.stl')
+    target_dir = tmp_path / 'out'
+    (target_dir).mkdir()
+    (target_dir / 'part_0.stl').write_bytes(b'already here')
+
+    manager = CopyJobManager(str(tmp_path / 'jobs'), workers=3)
+    job = manager.create(sources + [(missing, 10)], str(target_dir))
+    progress = wait_until_finished(job)
+
+    assert progress['status'] == 'failed'
+    assert progress['files_done'] == 5 and progress['files_failed'] == 1
+    assert progress['bytes_done'] == 15000
+    assert (target_dir / 'part_0.stl').read_bytes() == b'already here'
+    assert not list(target_dir.glob('*' + PARTIAL_SUFFIX))
+
+    # A new manager picks the job up from disk, only the failed file is retried
+    with open(missing, 'wb') as f:
+        f.write(b'y' * 10)
+    done_copy = target_dir / 'part_1.stl'
+    done_inode = done_copy.stat().st_ino
+    reloaded = CopyJobManager(str(tmp_path / 'jobs'), workers=2)
+    progress = wait_until_finished(reloaded.resume(job.id))
+
+    assert progress['status'] == 'done'
+    assert progress['files_done'] == 6
+    assert (target_dir / 'missing.stl').read_bytes() == b'y' * 10
+    assert done_copy.stat().st_ino == done_inode
+
+
+def test_jobs_of_other_processes_are_read_from_disk(tmp_path):
+    source = tmp_path / 'part.stl'
+    source.write_bytes(b'x' * 100)
+    owner = CopyJobManager(str(tmp_path / 'jobs'))
+    other = CopyJobManager(str(tmp_path / 'jobs'))
+    job = owner.create([(str(source), 100)], str(tmp_path / 'out'))
+    wait_until_finished(job)
+
+    assert other.get(job.id).to_dict()['status'] == 'done'
+    assert other.get('0' * 32) is None
+    assert other.get('../secrets') is None
+
+
+def test_jobs_of_processes_that_died_are_interrupted_and_resumable(tmp_path):
+    source = tmp_path / 'part.stl'
+    source.write_bytes(b'x' * 100)
+    owner = CopyJobManager(str(tmp_path / 'jobs'))
+    job = owner.create([(str(source), 100)], str(tmp_path / 'out'))
+    wait_until_finished(job)
+    (tmp_path / 'out' / 'part.stl').unlink()
+
+    # As left by a process killed while copying
+    with open(job.state_path) as f:
+        state = json.load(f)
+    state['files'][0]['status'] = 'pending'
+    state.update(status='running', owner=-1, heartbeat=time.time())
+    with open(job.state_path, 'w') as f:
+        json.dump(state, f)
+    other = CopyJobManager(str(tmp_path / 'jobs'))
+    assert other.get(job.id).status == 'running'
+
+    state['heartbeat'] = time.time() - 3600
+    with open(job.state_path, 'w') as f:
+        json.dump(state, f)
+    assert other.get(job.id).status == 'interrupted'
+    progress = wait_until_finished(other.resume(job.id))
+    assert progress['status'] == 'done'
+    assert (tmp_path / 'out' / 'part.stl').read_bytes() == b'x' * 100
+    assert owner.get(job.id).to_dict()['status'] == 'done'
@@ -0,0 +1,35 @@
+import os
+import threading
+from drives import DriveProber, DriveUnavailableError
+import pytest
+
+
+def test_prober_reports_missing_and_hung_drives(tmp_path, monkeypatch):
+    hung = threading.Event()
+    real_stat = os.stat
+
+    def stat(path, *args, **kwargs):
+        if str(path).endswith('hung'):
+            hung.wait(5)
+        return real_stat(path, *args, **kwargs)
+    monkeypatch.setattr(os, 'stat', stat)
+
+    prober = DriveProber({'ok': str(tmp_path), 'missing': str(tmp_path / 'missing'),
+                          'hung': str(tmp_path / 'hung')}, timeout=0.2)
+    assert prober.is_available('hung')
+    try:
+        prober.probe()
+        status = prober.status()
+        assert status['ok']['available'] and status['ok']['latency_ms'] is not None
+        assert not status['missing']['available']
+        assert not status['hung']['available'] and 'within' in status['hung']['error']
+        with pytest.raises(DriveUnavailableError):
+            prober.check('hung')
+
+        # The stuck check isn't repeated while it is still running
+        prober.probe()
+        assert 'No response for' in prober.status()['hung']['error']
+        assert sum(t.name.startswith('drive-probe') and t.name.endswith('hung')
+                   for t in threading.enumerate()) == 1
+    finally:
+        hung.set()
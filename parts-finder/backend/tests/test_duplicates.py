@@ -0,0 +1,104 @@
+import os
+import time
+import pytest
+from file_index import FileIndex
+from duplicates import PARTIAL_BYTES, DuplicateIndexer, DuplicateClusters, hash_file
+
+
+def write(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+
+
+@pytest.fixture
+def roots(tmp_path):
+    big = os.urandom(3 * PARTIAL_BYTES)
+    # Same size, first and last bytes as big, different in the middle
+    lookalike = big[:PARTIAL_BYTES] + os.urandom(PARTIAL_BYTES) + big[-PARTIAL_BYTES:]
+    write(tmp_path / 'drawings' / 'frame_v1.stl', big)
+    write(tmp_path / 'models' / 'frame_copy.stl', big)
+    write(tmp_path / 'models' / 'frame_edited.stl', lookalike)
+    write(tmp_path / 'models' / 'clip_v1.stl', b'small part')
+    write(tmp_path / 'drawings' / 'clip_v2.stl', b'small part')
+    write(tmp_path / 'models' / 'unique.stl', b'no other file has this size')
+    return {'drawings': str(tmp_path / 'drawings'), 'models': str(tmp_path / 'models')}
+
+
+def test_hash_file_reads_small_files_whole(tmp_path):
+    write(tmp_path / 'a.stl', b'abc')
+    partial, full, error = hash_file(str(tmp_path / 'a.stl'), 3)
+    assert partial == full and error is None
+    assert hash_file(str(tmp_path / 'missing.stl'), 3)[0] == ''
+
+
+def test_only_files_sharing_size_and_ends_are_hashed_in_full(tmp_path, roots):
+    index = FileIndex(str(tmp_path / 'index.db'))
+    index.rebuild_many(roots)
+    partial_pending, full_pending = index.pending_hashes(roots)
+    assert sorted(entry.name for entry in partial_pending) == [
+        'clip_v1.stl', 'clip_v2.stl', 'frame_copy.stl', 'frame_edited.stl', 'frame_v1.stl']
+
+    index.store_hashes([(entry, *hash_file(entry.path, entry.size)[:2]) for entry in partial_pending])
+    partial_pending, full_pending = index.pending_hashes(roots)
+    assert partial_pending == []
+    assert sorted(entry.name for entry, _ in full_pending) == [
+        'frame_copy.stl', 'frame_edited.stl', 'frame_v1.stl']
+
+
+def test_indexer_clusters_copies_across_categories(tmp_path, roots):
+    index = FileIndex(str(tmp_path / 'index.db'))
+    index.rebuild_many(roots)
+    indexer = DuplicateIndexer(index, roots, workers=1, interval=0.05)
+    indexer.start()
+    deadline = time.time() + 30
+    while any(index.pending_hashes(roots)) and time.time() < deadline:
+        time.sleep(0.05)
+    indexer.stop()
+
+    duplicate_clusters = DuplicateClusters(index, roots)
+    assert duplicate_clusters.refresh()
+    clusters = duplicate_clusters.clusters('content')
+    names = sorted(sorted((category, entry.name) for category, entry in members) for members in clusters.values())
+    assert names == [
+        [('drawings', 'clip_v2.stl'), ('models', 'clip_v1.stl')],
+        [('drawings', 'frame_v1.stl'), ('models', 'frame_copy.stl')],
+    ]
+
+    reloaded = FileIndex(str(tmp_path / 'index.db'))
+    reloaded.load()
+    entries = {entry.name: entry for entry in reloaded.get_entries('models')}
+    reloaded_clusters = DuplicateClusters(reloaded, roots)
+    reloaded_clusters.refresh()
+    assert reloaded_clusters.copies(entries['frame_copy.stl']) == {'content': 1, 'geometry': 0}
+    assert reloaded.content_hash(entries['frame_edited.stl']) is not None
+    assert reloaded.content_hash(entries['unique.stl']) is None
+
+
+def test_clusters_are_rebuilt_in_the_background(tmp_path, roots):
+    index = FileIndex(str(tmp_path / 'index.db'))
+    index.rebuild_many(roots)
+    clusters = DuplicateClusters(index, roots, min_interval=0)
+    # Even the first use doesn't wait for a build
+    assert clusters.clusters('content') == {}
+    deadline = time.time() + 10
+    while not clusters.ready and time.time() < deadline:
+        time.sleep(0.01)
+    assert clusters.ready
+    entries = {entry.name: entry for category in roots for entry in index.get_entries(category)}
+
+    # Geometry without fingerprints doesn't regroup
+    generation = clusters.generation
+    index.store_geometry([(entries['clip_v1.stl'], None, '', '')])
+    clusters.clusters('content')
+    time.sleep(0.1)
+    assert clusters.generation == generation
+
+    index.store_hashes([(entries[name], 'same', 'same') for name in ('clip_v1.stl', 'clip_v2.stl')])
+    # The previous groups are served while the new ones are built
+    generation = clusters.generation
+    assert clusters.clusters('content') == {}
+    deadline = time.time() + 10
+    while clusters.generation == generation and time.time() < deadline:
+        time.sleep(0.01)
+    assert list(clusters.clusters('content')) == ['same']
+    assert clusters.copies(entries['clip_v1.stl']) == {'content': 1, 'geometry': 0}
@@ -0,0 +1,107 @@
+import os
+import pytest
+from file_index import FileIndex
+
+
+@pytest.fixture
+def parts_dir(tmp_path):
+    root = tmp_path / 'parts'
+    (root / 'brackets').mkdir(parents=True)
+    (root / 'brackets' / 'bracket_v1.stl').write_bytes(b'solid a')
+    (root / 'brackets' / 'bracket_v2.STL').write_bytes(b'solid ab')
+    (root / 'housing.3mf').write_bytes(b'PK')
+    (root / 'notes.txt').write_text('ignored')
+    return root
+
+
+def test_rebuild_indexes_part_files(tmp_path, parts_dir):
+    index = FileIndex(str(tmp_path / 'index.db'))
+    entries = index.rebuild('motorcycle', str(parts_dir))
+
+    names = sorted(entry.name for entry in entries)
+    assert names == ['bracket_v1.stl', 'bracket_v2.STL', 'housing.3mf']
+    bracket = next(entry for entry in entries if entry.name == 'bracket_v2.STL')
+    assert bracket.ext == '.stl'
+    assert bracket.size == 8
+    assert bracket.mtime == os.path.getmtime(bracket.path)
+
+
+def test_index_is_reloaded_from_disk(tmp_path, parts_dir):
+    db_path = str(tmp_path / 'index.db')
+    FileIndex(db_path).rebuild('motorcycle', str(parts_dir))
+
+    reloaded = FileIndex(db_path)
+    assert reloaded.get_entries('motorcycle') is None
+    assert reloaded.load() == 3
+    assert reloaded.is_indexed('motorcycle', str(parts_dir))
+    assert not reloaded.is_indexed('motorcycle', str(tmp_path / 'elsewhere'))
+    assert len(reloaded.get_entries('motorcycle')) == 3
+
+
+def test_refresh_rescans_only_changed_directories(tmp_path, parts_dir):
+    index = FileIndex(str(tmp_path / 'index.db'))
+    index.rebuild('motorcycle', str(parts_dir))
+
+    assert index.refresh('motorcycle', str(parts_dir))['dirs_rescanned'] == 0
+
+    (parts_dir / 'brackets' / 'bracket_v1.stl').unlink()
+    (parts_dir / 'brackets' / 'bracket_v3.stl').write_bytes(b'solid abc')
+    (parts_dir / 'frames' / 'rear').mkdir(parents=True)
+    (parts_dir / 'frames' / 'rear' / 'frame.stl').write_bytes(b'solid')
+    os.utime(parts_dir / 'brackets', (0, 1))
+    os.utime(parts_dir, (0, 1))
+
+    counts = index.refresh('motorcycle', str(parts_dir))
+    assert (counts['added'], counts['removed'], counts['changed']) == (2, 1, 0)
+    assert counts['dirs_rescanned'] == 4
+
+    names = sorted(entry.name for entry in index.get_entries('motorcycle'))
+    assert names == ['bracket_v2.STL', 'bracket_v3.stl', 'frame.stl', 'housing.3mf']
+
+    reloaded = FileIndex(str(tmp_path / 'index.db'))
+    reloaded.load()
+    assert sorted(entry.name for entry in reloaded.get_entries('motorcycle')) == names
+
+
+def test_sync_reloads_changes_made_by_another_process(tmp_path, parts_dir):
+    db_path = str(tmp_path / 'index.db')
+    writer = FileIndex(db_path)
+    writer.rebuild('motorcycle', str(parts_dir))
+    reader = FileIndex(db_path)
+    reader.load()
+    assert reader.sync() == []
+
+    (parts_dir / 'brackets' / 'bracket_v3.stl').write_bytes(b'solid abc')
+    os.utime(parts_dir / 'brackets', (0, 1))
+    writer.refresh('motorcycle', str(parts_dir))
+    generation, _ = reader.snapshot('motorcycle')
+
+    assert reader.sync() == ['motorcycle']
+    assert len(reader.get_entries('motorcycle')) == 4
+    assert reader.snapshot('motorcycle')[0] > generation
+    assert writer.sync() == []
+
+
+def test_snapshots_dont_wait_for_database_writes(tmp_path, parts_dir):
+    index = FileIndex(str(tmp_path / 'index.db'))
+    index.rebuild('motorcycle', str(parts_dir))
+    generation = index.snapshot('motorcycle')[0]
+    # Held through every write transaction, which searches must not queue behind
+    with index._write_lock:
+        assert index.snapshot('motorcycle') == (generation, index.get_entries('motorcycle'))
+
+
+def test_pruning_geometry_moves_its_generation(tmp_path, parts_dir):
+    from geometry import Geometry
+    index = FileIndex(str(tmp_path / 'index.db'))
+    entries = index.rebuild('motorcycle', str(parts_dir))
+    index.store_geometry([(entry, Geometry(12, 0, 0, 0, 1, 1, 1, 1.0, 1.0), '', '') for entry in entries])
+    generation = index.geometry_generation
+    assert index.prune_geometry() == 0
+    assert index.geometry_generation == generation
+
+    (parts_dir / 'housing.3mf').unlink()
+    index.rebuild('motorcycle', str(parts_dir))
+    assert index.prune_geometry() == 1
+    # Filtered searches cached against the old geometry are dropped
+    assert index.geometry_generation > generation
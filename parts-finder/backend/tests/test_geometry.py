@@ -0,0 +1,167 @@
+import os
+import time
+import zipfile
+import numpy as np
+import pytest
+from functools import partial
+from mesh import write_stl
+from file_index import FileIndex
+from thumbnails import ThumbnailStore
+from geometry import (GeometryIndexer, analyze, extract_geometry, mesh_geometry, mesh_fingerprint, parse_filters,
+                      matches_filters)
+
+CUBE_POINTS = np.array([[x, y, z] for x in (0, 10) for y in (0, 20) for z in (0, 30)], np.float64)
+# Outward facing triangles of the 10 x 20 x 30 box above
+CUBE_FACES = [(0, 2, 6), (0, 6, 4), (1, 5, 7), (1, 7, 3), (0, 1, 3), (0, 3, 2),
+              (4, 6, 7), (4, 7, 5), (0, 4, 5), (0, 5, 1), (2, 3, 7), (2, 7, 6)]
+
+
+def cube_triangles():
+    return CUBE_POINTS[np.array(CUBE_FACES)]
+
+
+def write_3mf(path, unit='millimeter'):
+    vertices = ''.join(f'<vertex x="{x}" y="{y}" z="{z}"/>' for x, y, z in CUBE_POINTS)
+    triangles = ''.join(f'<triangle v1="{a}" v2="{b}" v3="{c}"/>' for a, b, c in CUBE_FACES)
+    model = (f'<?xml version="1.0"?><model unit="{unit}" '
+             f'xmlns="http://schemas.microsoft.com/3dmanufacturing/core/2015/02">'
+             f'<resources><object id="1" type="model"><mesh><vertices>{vertices}</vertices>'
+             f'<triangles>{triangles}</triangles></mesh></object></resources>'
+             f'<build><item objectid="1"/></build></model>')
+    with zipfile.ZipFile(path, 'w') as package:
+        package.writestr('3D/3dmodel.model', model)
+
+
+def test_box_geometry():
+    geometry = mesh_geometry(cube_triangles())
+    assert geometry.triangles == 12
+    assert (geometry.min_x, geometry.min_y, geometry.min_z) == (0, 0, 0)
+    assert (geometry.max_x, geometry.max_y, geometry.max_z) == (10, 20, 30)
+    assert geometry.area == pytest.approx(2 * (10 * 20 + 10 * 30 + 20 * 30))
+    assert geometry.volume == pytest.approx(6000)
+
+
+def test_stl_and_3mf_extraction_agree(tmp_path):
+    write_stl(cube_triangles().astype(np.float32), str(tmp_path / 'box.stl'))
+    write_3mf(str(tmp_path / 'box.3mf'))
+    write_3mf(str(tmp_path / 'box_cm.3mf'), unit='centimeter')
+
+    stl = extract_geometry(str(tmp_path / 'box.stl'))
+    threemf = extract_geometry(str(tmp_path / 'box.3mf'))
+    assert stl == pytest.approx(threemf)
+    assert extract_geometry(str(tmp_path / 'box_cm.3mf')).volume == pytest.approx(6000 * 1000)
+
+
+def test_binary_stls_are_analyzed_through_a_memory_map(tmp_path, monkeypatch):
+    import tracemalloc
+    import geometry
+    from test_mesh import grid_mesh
+    triangles = grid_mesh(300)
+    path = str(tmp_path / 'plate.stl')
+    write_stl(triangles, path)
+    expected = analyze(path, str(tmp_path / 'thumbnails'), 32)
+
+    def no_load(path):
+        raise AssertionError('loaded the whole mesh')
+    monkeypatch.setattr(geometry, 'load_model', no_load)
+    monkeypatch.setattr(geometry, 'CHUNK_TRIANGLES', 4096)
+    result = analyze(path, str(tmp_path / 'thumbnails'), 32)
+    assert result[3] is None
+    assert result[0] == pytest.approx(expected[0]) and result[2] == expected[2]
+
+    tracemalloc.start()
+    mesh_fingerprint(geometry.model_triangles(path))
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    # Well below the 36 bytes a triangle of the whole mesh
+    assert peak < triangles.nbytes / 4
+
+
+def test_filters():
+    geometry = mesh_geometry(cube_triangles())
+    assert matches_filters(geometry, parse_filters({'extent_x': {'max': 200}, 'volume': {'min': 1000}}))
+    assert not matches_filters(geometry, parse_filters({'max_extent': {'max': 25}}))
+    assert not matches_filters(None, parse_filters({'triangles': {'min': 0}}))
+    with pytest.raises(ValueError):
+        parse_filters({'weight': {'max': 1}})
+
+
+def test_fingerprint_ignores_position_and_triangle_order():
+    triangles = cube_triangles()
+    fingerprint = mesh_fingerprint(triangles)
+    # Moved, triangles shuffled and the vertices of each rotated
+    moved = (triangles + [100.5, -20, 7])[np.random.default_rng(1).permutation(len(triangles))]
+    moved = np.roll(moved, 1, axis=1)
+    assert mesh_fingerprint(moved) == fingerprint
+    assert mesh_fingerprint(triangles.astype(np.float32)) == fingerprint
+    # Same extents and area per axis pair, but a different box
+    assert mesh_fingerprint(triangles * [1, 1, 1.01]) != fingerprint
+    assert mesh_fingerprint(triangles[:, :, [1, 0, 2]]) != fingerprint
+
+
+def test_indexer_extracts_and_persists_geometry(tmp_path):
+    root = tmp_path / 'parts'
+    root.mkdir()
+    write_stl(cube_triangles().astype(np.float32), str(root / 'box_v1.stl'))
+    (root / 'broken_v1.3mf').write_bytes(b'not a zip')
+    index = FileIndex(str(tmp_path / 'index.db'))
+    entries = {entry.name: entry for entry in index.rebuild('parts', str(root))}
+
+    thumbnails = ThumbnailStore(str(tmp_path / 'thumbnails'))
+    extractor = GeometryIndexer(index, {'parts': str(root)}, thumbnails, thumbnail_size=32,
+                                workers=1, interval=0.05)
+    extractor.start()
+    deadline = time.time() + 30
+    while index.pending_geometry(['parts']) and time.time() < deadline:
+        time.sleep(0.05)
+    extractor.stop()
+
+    assert index.get_geometry(entries['box_v1.stl']).volume == pytest.approx(6000)
+    assert index.get_geometry(entries['broken_v1.3mf']) is None
+    digest = index.get_thumbnail(entries['box_v1.stl'])
+    with open(thumbnails.path(digest), 'rb') as f:
+        assert f.read(8) == b'\x89PNG\r\n\x1a\n'
+    assert index.get_thumbnail(entries['broken_v1.3mf']) is None
+    assert index.pending_geometry(['parts']) == []
+    assert index.get_fingerprint(entries['box_v1.stl']) == mesh_fingerprint(cube_triangles())
+    assert index.get_fingerprint(entries['broken_v1.3mf']) is None
+
+    reloaded = FileIndex(str(tmp_path / 'index.db'))
+    reloaded.load()
+    assert reloaded.get_geometry(entries['box_v1.stl']).triangles == 12
+    # A rewritten file needs extracting again
+    assert reloaded.get_geometry(entries['box_v1.stl']._replace(mtime=0)) is None
+
+
+def analyze_or_crash(path, thumbnail_dir):
+    """analyze, except that files named crash kill their worker process, as running out of memory would"""
+    if 'crash' in os.path.basename(path):
+        os._exit(1)
+    return analyze(path, thumbnail_dir, 32)
+
+
+def test_indexer_survives_files_killing_its_workers(tmp_path):
+    root = tmp_path / 'parts'
+    root.mkdir()
+    for name in ('a_v1.stl', 'crash_v1.stl', 'b_v1.stl'):
+        write_stl(cube_triangles().astype(np.float32), str(root / name))
+    index = FileIndex(str(tmp_path / 'index.db'))
+    entries = {entry.name: entry for entry in index.rebuild('parts', str(root))}
+    thumbnails = ThumbnailStore(str(tmp_path / 'thumbnails'))
+    extractor = GeometryIndexer(index, {'parts': str(root)}, thumbnails, workers=2)
+
+    extractor._restart_pool()
+    try:
+        extractor._extract(partial(analyze_or_crash, thumbnail_dir=thumbnails.directory),
+                           index.pending_geometry(['parts']))
+        # The pool was replaced and still works
+        assert extractor._analyze(partial(analyze_or_crash, thumbnail_dir=thumbnails.directory),
+                                  [str(root / 'a_v1.stl')])[0][0].triangles == 12
+    finally:
+        extractor._pool.shutdown()
+
+    assert index.get_geometry(entries['a_v1.stl']).triangles == 12
+    assert index.get_geometry(entries['b_v1.stl']).triangles == 12
+    assert index.get_geometry(entries['crash_v1.stl']) is None
+    assert extractor.failed == 1
+    assert index.pending_geometry(['parts']) == []
@@ -0,0 +1,121 @@
+import os
+import time
+import pytest
+from file_index import FileIndex
+import indexer as indexer_module
+from indexer import IndexerThread, IndexFollower
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+@pytest.mark.parametrize('use_events', [False, True])
+def test_indexer_picks_up_new_files(tmp_path, use_events):
+    root = tmp_path / 'parts'
+    root.mkdir()
+    (root / 'bracket_v1.stl').write_bytes(b'solid')
+    index = FileIndex(str(tmp_path / 'index.db'))
+    indexer = IndexerThread(index, {'motorcycle': str(root)}, max_staleness=1, use_events=use_events)
+    indexer.start()
+    try:
+        assert wait_for(lambda: index.is_indexed('motorcycle', str(root)))
+        (root / 'sub').mkdir()
+        (root / 'sub' / 'bracket_v2.stl').write_bytes(b'solid')
+        assert wait_for(lambda: len(index.get_entries('motorcycle')) == 2)
+        assert indexer.status()['motorcycle']['error'] is None
+    finally:
+        indexer.stop()
+        indexer.join(5)
+
+
+def test_polled_root_picks_up_files_rewritten_in_place(tmp_path, monkeypatch):
+    monkeypatch.setattr(indexer_module, 'POLL_RESYNC_INTERVAL', 1)
+    root = tmp_path / 'parts'
+    root.mkdir()
+    part = root / 'bracket_v1.stl'
+    part.write_bytes(b'solid')
+    index = FileIndex(str(tmp_path / 'index.db'))
+    index.rebuild('motorcycle', str(root))
+    indexer = IndexerThread(index, {'motorcycle': str(root)}, max_staleness=1, use_events=False)
+    indexer.start()
+    try:
+        assert wait_for(lambda: indexer.status()['motorcycle']['last_refresh'] is not None)
+        # Rewritten without its directory's mtime moving, which incremental polls don't notice
+        dir_mtime = root.stat().st_mtime_ns
+        part.write_bytes(b'solid, now longer')
+        os.utime(root, ns=(dir_mtime, dir_mtime))
+        assert index.refresh('motorcycle', str(root))['changed'] == 0
+        assert wait_for(lambda: index.get_entries('motorcycle')[0].size == part.stat().st_size)
+    finally:
+        indexer.stop()
+        indexer.join(5)
+
+
+def test_offline_root_keeps_existing_index(tmp_path):
+    root = tmp_path / 'parts'
+    root.mkdir()
+    (root / 'bracket_v1.stl').write_bytes(b'solid')
+    index = FileIndex(str(tmp_path / 'index.db'))
+    index.rebuild('motorcycle', str(root))
+
+    (root / 'bracket_v1.stl').unlink()
+    root.rmdir()
+    with pytest.raises(FileNotFoundError):
+        index.refresh('motorcycle', str(root))
+    assert len(index.get_entries('motorcycle')) == 1
+
+
+def test_indexer_runs_refreshes_requested_by_other_processes(tmp_path):
+    root = tmp_path / 'parts'
+    root.mkdir()
+    (root / 'bracket_v1.stl').write_bytes(b'solid')
+    index = FileIndex(str(tmp_path / 'index.db'))
+    index.rebuild('motorcycle', str(root))
+    other = FileIndex(str(tmp_path / 'index.db'))
+    other.request_refresh()
+    other.request_refresh(full=True)
+    assert index.take_refresh_request() == 'full'
+    assert index.take_refresh_request() is None
+
+    indexer = IndexerThread(index, {'motorcycle': str(root)}, max_staleness=3600, use_events=False)
+    indexer.start()
+    try:
+        assert wait_for(lambda: indexer.status()['motorcycle']['last_refresh'] is not None)
+        (root / 'sub').mkdir()
+        (root / 'sub' / 'bracket_v2.stl').write_bytes(b'solid')
+        # Not polled again for an hour
+        time.sleep(1.5)
+        assert len(index.get_entries('motorcycle')) == 1
+        other.request_refresh()
+        assert wait_for(lambda: len(index.get_entries('motorcycle')) == 2)
+    finally:
+        indexer.stop()
+        indexer.join(5)
+
+
+def test_follower_rebuilds_derived_indexes_after_syncing(tmp_path):
+    root = tmp_path / 'parts'
+    root.mkdir()
+    (root / 'bracket_v1.stl').write_bytes(b'solid')
+    leader = FileIndex(str(tmp_path / 'index.db'))
+    leader.rebuild('motorcycle', str(root))
+    follower_index = FileIndex(str(tmp_path / 'index.db'))
+    follower_index.load()
+    synced = []
+    follower = IndexFollower(follower_index, str(tmp_path / 'index.lock'), lambda: None,
+                             interval=0.05, on_sync=synced.append)
+    follower.start()
+    try:
+        (root / 'bracket_v2.stl').write_bytes(b'solid')
+        leader.rebuild('motorcycle', str(root))
+        assert wait_for(lambda: ['motorcycle'] in synced)
+        assert len(follower_index.get_entries('motorcycle')) == 2
+    finally:
+        follower.stop()
+        follower.join(5)
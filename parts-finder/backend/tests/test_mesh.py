@@ -0,0 +1,60 @@
+import numpy as np
+import mesh
+from mesh import decimate, load_stl, write_stl, stl_triangle_count, lod_builder, lod_counts
+
+
+def grid_mesh(n):
+    """A wavy n x n square surface of 2 * n * n triangles"""
+    xs, ys = np.meshgrid(np.linspace(0, 100, n + 1), np.linspace(0, 100, n + 1), indexing='ij')
+    points = np.stack([xs, ys, np.sin(xs / 10) * 5], axis=-1).astype(np.float32)
+    a, b = points[:-1, :-1].reshape(-1, 3), points[1:, :-1].reshape(-1, 3)
+    c, d = points[1:, 1:].reshape(-1, 3), points[:-1, 1:].reshape(-1, 3)
+    return np.concatenate([np.stack([a, b, c], 1), np.stack([a, c, d], 1)])
+
+
+def test_binary_and_ascii_stl_load_the_same_triangles(tmp_path, monkeypatch):
+    triangles = grid_mesh(4)
+    binary = tmp_path / 'binary.stl'
+    write_stl(triangles, str(binary))
+    ascii_lines = ['solid grid']
+    for triangle in triangles:
+        ascii_lines += ['facet normal 0 0 1', 'outer loop']
+        ascii_lines += [f'vertex {x!r} {y!r} {z!r}' for x, y, z in triangle.tolist()]
+        ascii_lines += ['endloop', 'endfacet']
+    ascii = tmp_path / 'ascii.stl'
+    ascii.write_text('\n'.join(ascii_lines + ['endsolid grid']))
+
+    assert stl_triangle_count(str(binary)) == 32
+    assert stl_triangle_count(str(ascii)) is None
+    np.testing.assert_array_equal(load_stl(str(binary)), triangles)
+    np.testing.assert_array_equal(load_stl(str(ascii)), triangles)
+    # Binary files with trailing bytes are binary unless they could be ASCII
+    padded = tmp_path / 'padded.stl'
+    padded.write_bytes(binary.read_bytes() + b'\0' * 10)
+    assert stl_triangle_count(str(padded)) == 32
+    np.testing.assert_array_equal(load_stl(str(padded)), triangles)
+    # Parsed over many chunks of lines
+    monkeypatch.setattr(mesh, 'ASCII_CHUNK_BYTES', 100)
+    np.testing.assert_array_equal(load_stl(str(ascii)), triangles)
+
+
+def test_decimate_stays_within_budget_and_keeps_the_shape():
+    triangles = grid_mesh(100)
+    lod = decimate(triangles, 2000)
+
+    assert 2000 * 0.5 <= len(lod) <= 2000
+    np.testing.assert_allclose(lod.reshape(-1, 3).min(axis=0), [0, 0, -5], atol=2)
+    np.testing.assert_allclose(lod.reshape(-1, 3).max(axis=0), [100, 100, 5], atol=2)
+    assert decimate(triangles, len(triangles)) is triangles
+
+
+def test_lod_artifact_records_its_triangle_counts(tmp_path):
+    source = tmp_path / 'part.stl'
+    write_stl(grid_mesh(50), str(source))
+    target = tmp_path / 'lod.stl'
+
+    lod_builder(str(source), 1000)(str(target))
+
+    kept, original = lod_counts(str(target))
+    assert original == 5000
+    assert kept == stl_triangle_count(str(target)) <= 1000
@@ -0,0 +1,27 @@
+from metrics import Counter, Gauge, Histogram
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = Histogram('test_seconds', 'Test latency', buckets=(0.1, 1.0), labels=('category',))
+    for value in (0.05, 0.1, 0.5, 3.0):
+        histogram.observe(value, 'motorcycle')
+
+    lines = histogram.render()
+    assert lines[:2] == ['# HELP test_seconds Test latency', '# TYPE test_seconds histogram']
+    assert 'test_seconds_bucket{category="motorcycle",le="0.1"} 2' in lines
+    assert 'test_seconds_bucket{category="motorcycle",le="1.0"} 3' in lines
+    assert 'test_seconds_bucket{category="motorcycle",le="+Inf"} 4' in lines
+    assert 'test_seconds_count{category="motorcycle"} 4' in lines
+    assert 'test_seconds_sum{category="motorcycle"} 3.65' in lines
+    assert histogram.count('motorcycle') == 4
+
+
+def test_counter_and_gauge_render_labels():
+    counter = Counter('test_total', 'Test count', labels=('source',))
+    counter.inc(3, 'scan')
+    counter.inc(1, 'say "hi"')
+    gauge = Gauge('test_files', 'Test gauge', lambda: {(): 7})
+
+    assert 'test_total{source="scan"} 3' in counter.render()
+    assert 'test_total{source="say \\"hi\\""} 1' in counter.render()
+    assert gauge.render()[-1] == 'test_files 7'
@@ -0,0 +1,80 @@
+import gzip
+import numpy as np
+from mesh import STL_DTYPE, STL_HEADER_SIZE
+from model_cache import ArtifactCache, ModelCache
+
+ASCII_STL = b"""solid part
+  facet normal 0 0 1
+    outer loop
+      vertex 0 0 0
+      vertex 1 0 0
+      vertex 0 1 0
+    endloop
+  endfacet
+  facet normal 0 0 -1
+    outer loop
+      vertex 0 0 0
+      vertex 0 1 0
+      vertex 1 0 0
+    endloop
+  endfacet
+endsolid part
+"""
+
+
+def test_model_cache_stores_compressed_binary(tmp_path):
+    source = tmp_path / 'part.stl'
+    source.write_bytes(ASCII_STL)
+    st = source.stat()
+    models = ModelCache(ArtifactCache(str(tmp_path / 'cache'), 1024 * 1024))
+
+    path = models.build(str(source), st.st_size, st.st_mtime)
+    with gzip.open(path, 'rb') as f:
+        data = f.read()
+    # Converted from ASCII, with the normals recomputed from the vertices
+    assert len(data) == STL_HEADER_SIZE + 4 + 2 * STL_DTYPE.itemsize
+    records = np.frombuffer(data, STL_DTYPE, offset=STL_HEADER_SIZE + 4)
+    np.testing.assert_array_equal(records['normal'], [[0, 0, 1], [0, 0, -1]])
+    np.testing.assert_array_equal(records['vertices'][0], [[0, 0, 0], [1, 0, 0], [0, 1, 0]])
+    assert models.lookup(str(source), st.st_size, st.st_mtime) == path
+    # A changed source is a different artifact
+    assert models.lookup(str(source), st.st_size + 1, st.st_mtime) is None
+
+
+def test_artifact_cache_evicts_least_recently_used(tmp_path):
+    cache = ArtifactCache(str(tmp_path / 'cache'), 250)
+
+    def writer(size):
+        return lambda path: open(path, 'wb').write(b'x' * size)
+
+    cache.put('a', writer(100))
+    cache.put('b', writer(100))
+    assert cache.get('a') is not None
+    cache.put('c', writer(100))
+
+    assert cache.get('b') is None
+    assert cache.get('a') is not None and cache.get('c') is not None
+    assert cache.total_bytes == 200
+    assert sorted(p.name for p in (tmp_path / 'cache').iterdir()) == ['a', 'c']
+
+    # The cache picks up its contents again after a restart
+    reopened = ArtifactCache(str(tmp_path / 'cache'), 250)
+    assert reopened.total_bytes == 200
+    assert reopened.get('a') is not None
+
+
+def test_processes_sharing_a_cache_directory_share_its_size_and_evictions(tmp_path):
+    first = ArtifactCache(str(tmp_path / 'cache'), 250)
+    second = ArtifactCache(str(tmp_path / 'cache'), 250)
+
+    def writer(size):
+        return lambda path: open(path, 'wb').write(b'x' * size)
+
+    first.put('a', writer(100))
+    second.put('b', writer(100))
+    second.put('c', writer(100))
+    # Evicted by the other process, a miss rather than a path that no longer exists
+    assert first.get('a') is None
+    assert first.get('b') is not None
+    assert first.total_bytes == second.total_bytes == 200
+    assert first.stats()['files'] == 2
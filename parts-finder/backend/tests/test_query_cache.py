@@ -0,0 +1,28 @@
+from query_cache import ENTRY_BYTES, QueryCache
+
+
+def test_results_are_reused_only_under_the_same_tag():
+    cache = QueryCache(max_bytes=1000)
+    cache.put('bracket', 1, ['a', 'b'], 16)
+    assert cache.get('bracket', 1) == ['a', 'b']
+    assert cache.get('bracket', 2) is None
+    # The stale result is gone, not only skipped
+    assert cache.get('bracket', 1) is None
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 2
+
+
+def test_least_recently_used_results_are_evicted_and_expire():
+    cache = QueryCache(max_bytes=3 * ENTRY_BYTES + 16)
+    cache.put('a', 0, [1, 2], 8)
+    cache.put('b', 0, [3], 4)
+    cache.get('a', 0)
+    cache.put('c', 0, [4, 5], 8)
+    assert cache.get('b', 0) is None
+    assert cache.get('a', 0) == [1, 2]
+    assert cache.stats()['bytes'] == 2 * ENTRY_BYTES + 16
+
+    cache.put('huge', 0, list(range(1000)), 4000)
+    assert cache.get('huge', 0) is None
+
+    cache.ttl = -1
+    assert cache.get('a', 0) is None
@@ -0,0 +1,40 @@
+from file_index import FileIndex
+from scanner import ParallelScanner, scan_stats
+
+
+def make_tree(root, depth, width):
+    root.mkdir(parents=True)
+    (root / f'part_{depth}.stl').write_bytes(b'solid')
+    if depth:
+        for i in range(width):
+            make_tree(root / f'dir{i}', depth - 1, width)
+
+
+def test_walk_lists_several_roots_in_parallel(tmp_path):
+    make_tree(tmp_path / 'a', depth=3, width=3)
+    make_tree(tmp_path / 'b', depth=2, width=2)
+
+    listings, failed, seconds = ParallelScanner(workers=4).walk(
+        [str(tmp_path / 'a'), str(tmp_path / 'b'), str(tmp_path / 'missing')]
+    )
+
+    assert list(failed) == [str(tmp_path / 'missing')]
+    assert len(listings) == (1 + 3 + 9 + 27) + (1 + 2 + 4)
+    stats = scan_stats(listings.values(), seconds, workers=4)
+    assert stats['files'] == stats['dirs'] == 47
+    assert stats['dirs_per_second'] > 0
+
+
+def test_rebuild_many_indexes_reachable_roots(tmp_path):
+    make_tree(tmp_path / 'a', depth=2, width=2)
+    index = FileIndex(str(tmp_path / 'index.db'), scanner=ParallelScanner(workers=3))
+
+    results, errors = index.rebuild_many({
+        'motorcycle': str(tmp_path / 'a'),
+        'aerospace': str(tmp_path / 'offline'),
+    })
+
+    assert len(results['motorcycle']) == 7
+    assert isinstance(errors['aerospace'], FileNotFoundError)
+    assert index.scan_stats['motorcycle']['workers'] == 3
+    assert not index.is_indexed('aerospace', str(tmp_path / 'offline'))
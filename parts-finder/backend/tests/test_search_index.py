@@ -0,0 +1,113 @@
+import time
+import random
+from file_index import FileEntry, FileIndex
+import search_index
+from search_index import NameIndex, NameIndexCache
+from columns import FileColumns, encode_columns, write_columns
+
+
+def make_entries(names):
+    return [FileEntry(f'/parts/{name}', name, '.stl', 0, 0.0) for name in names]
+
+
+def test_matches_plain_substring_search():
+    rng = random.Random(7)
+    alphabet = 'abcAB_-v0123 .'
+    names = [''.join(rng.choice(alphabet) for _ in range(rng.randint(1, 14))) + '.stl'
+             for _ in range(2000)]
+    name_index = NameIndex(make_entries(names))
+
+    for term in ['a', 'v1', 'ab_', 'ba-v0', '.stl', 'zzz', 'abab', '_v2.s']:
+        expected = [i for i, name in enumerate(names) if term in name.lower()]
+        assert name_index.match(term) == expected
+
+    terms = ['ab_', 'v1', 'b-']
+    expected = [i for i, name in enumerate(names) if any(term in name.lower() for term in terms)]
+    assert name_index.search(terms) == expected
+
+
+def test_cache_rebuilds_after_index_changes(tmp_path):
+    root = tmp_path / 'parts'
+    root.mkdir()
+    (root / 'bracket_v1.stl').write_bytes(b'solid')
+    file_index = FileIndex(str(tmp_path / 'index.db'))
+    file_index.rebuild('motorcycle', str(root))
+    cache = NameIndexCache(file_index)
+
+    first = cache.get('motorcycle')
+    assert cache.get('motorcycle') is first
+    assert first.match('bracket') == [0]
+
+    (root / 'frame.stl').write_bytes(b'solid')
+    file_index.rebuild('motorcycle', str(root))
+    # The previous index is served while its replacement is built in the background
+    assert cache.get('motorcycle') is first
+    deadline = time.time() + 10
+    while cache.get('motorcycle') is first and time.time() < deadline:
+        time.sleep(0.01)
+    second = cache.get('motorcycle')
+    assert second is not first
+    assert len(second) == 2
+    assert cache.refresh('motorcycle') is second
+    assert cache.memory('motorcycle') == second.memory() > 0
+    assert cache.memory('other') is None
+
+
+def test_names_and_postings_are_read_from_the_mapped_columns(tmp_path):
+    import tracemalloc
+    names = [f'bracket_{i:06d}_v{i % 4}.stl' for i in range(20000)]
+    path = str(tmp_path / 'motorcycle.1.cols')
+    write_columns(path, encode_columns(make_entries(names)))
+    entries = FileColumns.open(path)
+    tracemalloc.start()
+    name_index = NameIndex(entries)
+    traced = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    assert name_index.postings is entries.postings
+    # Only the family of each file and the latest revision of each family are held by the process
+    assert name_index.memory() < 10 * len(names)
+    assert traced < 40 * len(names)
+    assert name_index.match('_000123_v3') == [123]
+    assert name_index.match('v3.') == list(range(3, len(names), 4))
+    assert name_index.resolve('bracket_000123') == ([123], 'family')
+
+
+def test_rank_prefers_whole_tokens_and_tolerates_typos():
+    names = ['mount_000123_v2.stl', 'mount_000123_v1.stl', 'mounting_plate.stl', 'mount_000132.stl',
+             'bracket_000123.stl', 'frame.stl']
+    name_index = NameIndex(make_entries(names))
+
+    scores, complete = name_index.rank(['mount'])
+    assert complete
+    assert scores[0] > scores[2] > 0
+    assert 5 not in scores
+
+    # A swapped digit and a missing letter still find the part, exact names first
+    scores, _ = name_index.rank(['mout_000123'])
+    assert set(scores) == {0, 1, 3, 4}
+    assert scores[0] == scores[1] > scores[3] > scores[4]
+    assert name_index.rank(['brakcet'])[0].keys() == {4}
+
+
+def test_rank_stops_at_its_cpu_budget(monkeypatch):
+    rng = random.Random(3)
+    names = [f'part_{rng.randrange(10 ** 6):06d}_v{rng.randint(1, 5)}.stl' for _ in range(20000)]
+    name_index = NameIndex(make_entries(names))
+    assert len(name_index.rank(['prat'])[0]) == len(names)
+    # Out of time after the exact lookups, so no typos are tried
+    scores, complete = name_index.rank(['prat'], budget_seconds=0)
+    assert not complete
+    assert scores == {}
+
+    # Terms too short for the trigram postings gather theirs a chunk at a time within the budget
+    monkeypatch.setattr(search_index, 'SCAN_CHUNK', 1000)
+    class OneChunk:
+        exhausted = False
+
+        def spent(self):
+            spent, self.exhausted = self.exhausted, True
+            return spent
+
+    found = name_index.match('p', OneChunk())
+    assert found == list(range(1000))
+    assert name_index.match('p') == list(range(len(names)))
@@ -0,0 +1,61 @@
+import zlib
+import time
+import numpy as np
+import thumbnails
+from thumbnails import ThumbnailStore, render_thumbnail, encode_png
+from test_geometry import cube_triangles
+
+
+def decode_png(png):
+    """Pixels of a PNG written by encode_png (no filters, one IDAT chunk)"""
+    width, height = int.from_bytes(png[16:20], 'big'), int.from_bytes(png[20:24], 'big')
+    length = int.from_bytes(png[33:37], 'big')
+    rows = np.frombuffer(zlib.decompress(png[41:41 + length]), np.uint8).reshape(height, -1)
+    return rows[:, 1:].reshape(height, width, 4)
+
+
+def test_render_shades_the_part_on_a_transparent_background():
+    image = render_thumbnail(cube_triangles().astype(np.float32), 64)
+
+    assert image.shape == (64, 64, 4)
+    assert image[32, 32, 3] == 255
+    assert image[0, 0, 3] == 0
+    covered = image[..., 3] == 255
+    # The box fills a solid region without holes and shows faces at different shades
+    assert covered[16:48, 24:40].all()
+    assert len(np.unique(image[covered][:, 0])) >= 2
+
+
+def cylinder_slivers(segments, length=1000.0):
+    """Side of a long thin cylinder, two triangles running its whole length per segment"""
+    angles = np.linspace(0, 2 * np.pi, segments + 1)
+    ring = np.stack([np.cos(angles), np.sin(angles), np.zeros_like(angles)], 1)
+    bottom, top = ring[:-1], ring[:-1] + [0, 0, length]
+    next_bottom, next_top = ring[1:], ring[1:] + [0, 0, length]
+    return np.concatenate([np.stack([bottom, next_bottom, next_top], 1),
+                           np.stack([bottom, next_top, top], 1)]).astype(np.float32)
+
+
+def test_render_cost_follows_covered_pixels(monkeypatch):
+    start = time.perf_counter()
+    image = render_thumbnail(cylinder_slivers(2000), 128)
+    assert time.perf_counter() - start < 5
+    covered = image[..., 3] == 255
+    assert 0 < covered.sum() < 128 * 128 / 4
+
+    # Past the sample budget the nearest triangles are still drawn
+    monkeypatch.setattr(thumbnails, 'MAX_RENDER_SAMPLES', 2000)
+    image = render_thumbnail(cube_triangles().astype(np.float32), 64)
+    assert 0 < (image[..., 3] == 255).sum() <= 2000
+
+
+def test_png_round_trip_and_content_addressing(tmp_path):
+    image = render_thumbnail(cube_triangles().astype(np.float32), 32)
+    png = encode_png(image)
+    np.testing.assert_array_equal(decode_png(png), image)
+
+    store = ThumbnailStore(str(tmp_path))
+    digest = store.save(png)
+    assert store.save(png) == digest
+    assert store.prune({digest}) == 0
+    assert store.prune(set()) == 1
@@ -0,0 +1,40 @@
+from file_index import FileEntry
+from search_index import NameIndex
+from versions import VersionParser, version_key
+
+
+def test_default_pattern_matches_underscore_v_convention():
+    parser = VersionParser()
+    assert parser.parse('bracket_v3.stl') == ('bracket', '3')
+    assert parser.parse('arm_mount_v12_final.stl') == ('arm_mount', '12')
+    assert parser.parse('housing.3mf') == ('housing.3mf', '')
+
+
+def test_custom_patterns_are_tried_in_order():
+    parser = VersionParser([
+        r'(?P<family>.*?)-Rev(?P<version>[A-Z]+)',
+        r'(?P<family>.*?)_r(?P<version>[0-9]+)',
+    ])
+    assert parser.parse('WING-SPAR-RevB.stl') == ('WING-SPAR', 'B')
+    assert parser.parse('rib_r02.3mf') == ('rib', '02')
+    assert version_key('10') > version_key('9')
+    assert version_key('B') > version_key('A')
+
+
+def test_latest_revision_per_family():
+    entries = [
+        FileEntry('/p/bracket_v1.stl', 'bracket_v1.stl', '.stl', 1, 100.0),
+        FileEntry('/p/bracket_v2.stl', 'bracket_v2.stl', '.stl', 1, 200.0),
+        FileEntry('/p/bracket_v3.3mf', 'bracket_v3.3mf', '.3mf', 1, 300.0),
+        FileEntry('/p/clamp_v1.stl', 'clamp_v1.stl', '.stl', 1, 50.0),
+    ]
+    name_index = NameIndex(entries)
+
+    assert name_index.family(1) == 'bracket'
+    # Only matched revisions are candidates, unless the whole family is asked for
+    assert name_index.latest(name_index.search(['bracket_v1', 'clamp'])) == [0, 3]
+    assert name_index.latest(name_index.search(['bracket_v1', 'clamp']), family_wide=True) == [2, 3]
+    assert name_index.latest([0, 1, 2, 3]) == [2, 3]
+    assert name_index.latest_scores({0: 0.5, 1: 0.9, 3: 0.2}) == {1: 0.9, 3: 0.2}
+    assert name_index.latest([0, 1, 2, 3], by_type=True) == [1, 2, 3]
+    assert name_index.latest([0, 3], by_type=True, family_wide=True) == [1, 3]
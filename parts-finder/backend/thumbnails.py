@@ -0,0 +1,203 @@
+"""Small shaded preview images of part meshes, rendered on the CPU with NumPy"""
+import os
+import zlib
+import struct
+import hashlib
+import tempfile
+import logging
+import numpy as np
+from mesh import decimate, face_normals
+
+logger = logging.getLogger(__name__)
+
+# Meshes are decimated to this many triangles first, far more than a thumbnail can show
+MAX_RENDER_TRIANGLES = 20000
+# Pixel samples of one render, over all triangles; past it only the triangles nearest the viewer are drawn
+MAX_RENDER_SAMPLES = 2000000
+# Triangles and pixel samples worked on at once, bounding the temporary arrays
+CHUNK_TRIANGLES = 4096
+CHUNK_SAMPLES = 262144
+MARGIN = 0.06
+BASE_COLOR = np.array([205, 210, 220], np.float64)
+AMBIENT = 0.3
+LIGHT = np.array([-0.4, 0.5, 1.0]) / np.linalg.norm([-0.4, 0.5, 1.0])
+
+
+def _view_rotation(azimuth=45.0, elevation=30.0):
+    """Rotation looking at the model from the front right, slightly from above, with Z up"""
+    a, e = np.radians(azimuth), np.radians(elevation)
+    turn = np.array([[np.cos(a), -np.sin(a), 0], [np.sin(a), np.cos(a), 0], [0, 0, 1]])
+    # Model Z becomes screen up, then tilt towards the viewer
+    upright = np.array([[1, 0, 0], [0, 0, 1], [0, -1, 0]])
+    tilt = np.array([[1, 0, 0], [0, np.cos(e), -np.sin(e)], [0, np.sin(e), np.cos(e)]])
+    return tilt @ upright @ turn
+
+
+VIEW_ROTATION = _view_rotation()
+
+def render_thumbnail(triangles, size=128):
+    """Render triangles to a size x size RGBA image with a transparent background.
+
+    Each triangle is filled by scanline, one sample in every pixel of every
+    row it crosses, so the work follows the pixels it covers however long
+    and thin it is, and a depth test per pixel keeps the sample nearest to
+    the viewer. Faces are lit from the upper left, on both sides since STL
+    winding can't be trusted.
+    """
+    image = np.zeros((size, size, 4), np.uint8)
+    if len(triangles) > MAX_RENDER_TRIANGLES:
+        triangles = decimate(triangles, MAX_RENDER_TRIANGLES)
+    if not len(triangles):
+        return image
+    view = (triangles.reshape(-1, 3).astype(np.float64) @ VIEW_ROTATION.T).reshape(-1, 3, 3)
+    low = view.reshape(-1, 3).min(axis=0)
+    high = view.reshape(-1, 3).max(axis=0)
+    extent = max(high[0] - low[0], high[1] - low[1]) or 1.0
+    scale = size * (1 - 2 * MARGIN) / extent
+    # Screen coordinates, y pointing down, centered in the image
+    screen = np.empty_like(view)
+    screen[..., 0] = (view[..., 0] - (low[0] + high[0]) / 2) * scale + size / 2
+    screen[..., 1] = ((low[1] + high[1]) / 2 - view[..., 1]) * scale + size / 2
+    screen[..., 2] = view[..., 2]
+
+    shade = AMBIENT + (1 - AMBIENT) * np.abs(face_normals(view) @ LIGHT)
+
+    faces, rows, starts, widths = _spans(screen, size)
+    samples = np.bincount(faces, widths, minlength=len(screen))
+    if samples.sum() > MAX_RENDER_SAMPLES:
+        nearest = np.argsort(-screen[..., 2].max(axis=1))
+        drawn = np.zeros(len(screen), bool)
+        drawn[nearest[np.cumsum(samples[nearest]) <= MAX_RENDER_SAMPLES]] = True
+        logger.debug(f"Thumbnail needs {int(samples.sum())} samples, drawing {drawn.sum()} of {len(screen)} triangles")
+        kept = drawn[faces]
+        faces, rows, starts, widths = faces[kept], rows[kept], starts[kept], widths[kept]
+
+    # Depth buffer of the nearest face at every pixel, depth growing away from the viewer
+    depth_buffer = np.full(size * size, np.inf)
+    face_buffer = np.full(size * size, -1, np.int64)
+    bounds = np.searchsorted(np.cumsum(widths), np.arange(CHUNK_SAMPLES, int(widths.sum()), CHUNK_SAMPLES))
+    for chunk in np.split(np.arange(len(faces)), bounds):
+        pixels, depths, pixel_faces = _samples(screen, faces[chunk], rows[chunk], starts[chunk],
+                                               widths[chunk], size)
+        # Nearest sample of every pixel: sort by pixel, then depth, keep the first of each run
+        order = np.lexsort((depths, pixels))
+        sorted_pixels = pixels[order]
+        first = np.ones(len(order), bool)
+        first[1:] = sorted_pixels[1:] != sorted_pixels[:-1]
+        visible = order[first]
+        nearer = depths[visible] < depth_buffer[pixels[visible]]
+        visible = visible[nearer]
+        depth_buffer[pixels[visible]] = depths[visible]
+        face_buffer[pixels[visible]] = pixel_faces[visible]
+
+    covered = np.flatnonzero(face_buffer >= 0)
+    flat = image.reshape(-1, 4)
+    flat[covered, :3] = np.clip(BASE_COLOR * shade[face_buffer[covered]][:, None], 0, 255).astype(np.uint8)
+    flat[covered, 3] = 255
+    return image
+
+
+def _spans(screen, size):
+    """Pixel runs of every row each screen triangle crosses, as (faces, rows, starts, widths)"""
+    parts = []
+    for first in range(0, len(screen), CHUNK_TRIANGLES):
+        chunk = screen[first:first + CHUNK_TRIANGLES]
+        sx, sy = chunk[..., 0], chunk[..., 1]
+        y_low, y_high = sy.min(axis=1), sy.max(axis=1)
+        top = np.clip(np.floor(y_low), 0, size - 1).astype(np.int64)
+        counts = np.clip(np.floor(y_high), 0, size - 1).astype(np.int64) - top + 1
+        faces = np.repeat(np.arange(len(chunk)), counts)
+        rows = top[faces] + np.arange(len(faces)) - np.repeat(np.cumsum(counts) - counts, counts)
+        # The row's center line, moved inside triangles that don't reach it so they still get a pixel
+        line = np.clip(rows + 0.5, y_low[faces], y_high[faces])
+        left = np.full(len(faces), np.inf)
+        right = np.full(len(faces), -np.inf)
+        for a, b in ((0, 1), (1, 2), (2, 0)):
+            xa, xb = sx[faces, a], sx[faces, b]
+            ya, yb = sy[faces, a], sy[faces, b]
+            crosses = (line >= np.minimum(ya, yb)) & (line <= np.maximum(ya, yb))
+            dy = yb - ya
+            x = xa + np.divide(line - ya, dy, out=np.zeros_like(dy), where=dy != 0) * (xb - xa)
+            # Horizontal edges on the line cover their whole length
+            left = np.where(crosses, np.minimum(left, np.where(dy == 0, np.minimum(xa, xb), x)), left)
+            right = np.where(crosses, np.maximum(right, np.where(dy == 0, np.maximum(xa, xb), x)), right)
+        starts = np.clip(np.floor(left), 0, size - 1).astype(np.int64)
+        widths = np.clip(np.floor(right), 0, size - 1).astype(np.int64) - starts + 1
+        parts.append((faces + first, rows, starts, widths))
+    return tuple(np.concatenate(column) for column in zip(*parts))
+
+
+def _samples(screen, faces, rows, starts, widths, size):
+    """Pixel index, depth and face of every pixel of the given runs"""
+    pixel_faces = np.repeat(faces, widths)
+    y = np.repeat(rows, widths)
+    x = np.repeat(starts, widths) + np.arange(len(pixel_faces)) - np.repeat(np.cumsum(widths) - widths, widths)
+    # Depth on each face's plane at the pixel center, kept within the face's own depth range
+    triangles = screen[pixel_faces]
+    origin = triangles[:, 0]
+    normals = np.cross(triangles[:, 1] - origin, triangles[:, 2] - origin)
+    edge_on = np.abs(normals[:, 2]) < 1e-12
+    depth = origin[:, 2] - (normals[:, 0] * (x + 0.5 - origin[:, 0]) + normals[:, 1] * (y + 0.5 - origin[:, 1])) \
+        / np.where(edge_on, 1.0, normals[:, 2])
+    z = triangles[..., 2]
+    depth = np.where(edge_on, z.mean(axis=1), np.clip(depth, z.min(axis=1), z.max(axis=1)))
+    return y * size + x, -depth, pixel_faces
+
+
+def encode_png(image):
+    """Encode an (h, w, 4) uint8 RGBA array as PNG"""
+    height, width = image.shape[:2]
+    rows = np.zeros((height, width * 4 + 1), np.uint8)
+    rows[:, 1:] = image.reshape(height, -1)
+
+    def chunk(tag, data):
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+
+    return (b'\x89PNG\r\n\x1a\n'
+            + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(rows.tobytes(), 9))
+            + chunk(b'IEND', b''))
+
+
+class ThumbnailStore:
+    """Directory of PNG thumbnails named by the SHA-1 of their content.
+
+    Identical renders, e.g. copies of the same part, are stored once, and
+    a thumbnail never changes under its name, so it can be cached by
+    clients indefinitely.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, digest):
+        return os.path.join(self.directory, digest[:2], f'{digest}.png')
+
+    def save(self, png):
+        """Store PNG data, returns its digest"""
+        digest = hashlib.sha1(png).hexdigest()
+        path = self.path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(png)
+            os.replace(tmp_path, path)
+        return digest
+
+    def prune(self, keep):
+        """Delete thumbnails whose digest is not in keep, returns how many were deleted"""
+        removed = 0
+        for shard in os.scandir(self.directory):
+            if not shard.is_dir():
+                continue
+            for item in os.scandir(shard.path):
+                digest = item.name[:-len('.png')]
+                if item.name.endswith('.png') and digest not in keep:
+                    try:
+                        os.remove(item.path)
+                        removed += 1
+                    except OSError as e:
+                        logger.warning(f"Could not remove thumbnail {item.name}: {e}")
+        return removed
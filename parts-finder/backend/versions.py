@@ -0,0 +1,39 @@
+"""Part family and revision parsing for file names"""
+import re
+
+# Everything before the first "_v" is the part family, e.g. bracket_v3.stl -> bracket
+DEFAULT_VERSION_PATTERNS = [r'(?P<family>.*?)_v(?P<version>[0-9]*)']
+
+_NATURAL_PARTS = re.compile(r'(\d+)')
+
+
+def version_key(version):
+    """Sort key for revision strings, numbers compare numerically (v10 > v9, RevB > RevA)"""
+    return tuple(
+        (0, int(part), '') if part.isdigit() else (1, 0, part.upper())
+        for part in _NATURAL_PARTS.split(version) if part
+    )
+
+
+class VersionParser:
+    """Splits file names into a part family and a revision.
+
+    Patterns are tried in order and the first one matching the start of the
+    name wins. Each needs a `family` group and may have a `version` group.
+    Names no pattern matches form a family of their own.
+    """
+
+    def __init__(self, patterns=None):
+        self.patterns = [re.compile(pattern) for pattern in (patterns or DEFAULT_VERSION_PATTERNS)]
+        for pattern in self.patterns:
+            if 'family' not in pattern.groupindex:
+                raise ValueError(f"Version pattern needs a 'family' group: {pattern.pattern}")
+
+    def parse(self, name):
+        """Return (family, version) for a file name, version is '' when there is none"""
+        for pattern in self.patterns:
+            match = pattern.match(name)
+            if match:
+                groups = match.groupdict()
+                return groups['family'], groups.get('version') or ''
+        return name, ''
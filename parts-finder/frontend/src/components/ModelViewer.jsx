@@ -615,7 +615,9 @@ window.ModelViewer = function ModelViewer({ filePath }) {
   window.modelViewerKeydownHandler = handleKeyDown;
   
   // Load the model
-  const loadModel = React.useCallback(async (modelUrl, fileExtension) => {
+  // When fullModelUrl is given, modelUrl is a decimated preview that is
+  // replaced by the full-resolution geometry once that has loaded
+  const loadModel = React.useCallback(async (modelUrl, fileExtension, fullModelUrl) => {
     const { scene } = threeObjects.current;
     if (!scene) return;
     
@@ -705,6 +707,28 @@ window.ModelViewer = function ModelViewer({ filePath }) {
             
             // Add transform UI
             addTransformUI();
+            
+            if (fullModelUrl) {
+              loader.load(
+                fullModelUrl,
+                (fullGeometry) => {
+                  // Skip the upgrade if another model has been loaded meanwhile
+                  if (threeObjects.current.mesh !== mesh) {
+                    fullGeometry.dispose();
+                    return;
+                  }
+                  console.log('Full resolution STL model loaded, replacing preview');
+                  const previewGeometry = mesh.geometry;
+                  fullGeometry.computeBoundingBox();
+                  mesh.geometry = fullGeometry;
+                  previewGeometry.dispose();
+                },
+                undefined,
+                (err) => {
+                  console.error('Error loading full resolution STL model, keeping preview:', err);
+                }
+              );
+            }
           },
           (xhr) => {
             if (xhr.lengthComputable) {
@@ -1276,31 +1300,20 @@ window.ModelViewer = function ModelViewer({ filePath }) {
       }
       
       try {
-        // First check if the file exists
-        const response = await fetch('/api/file-check', {
-          method: 'POST',
-          headers: { 'Content-Type': 'application/json' },
-          body: JSON.stringify({ path: filePath })
-        });
-        
-        const data = await response.json();
-        console.log('File check result:', data);
-        
-        if (!data.exists) {
-          throw new Error(`File not found: ${filePath}`);
-        }
-        
-        if (!data.allowed) {
-          throw new Error(`File access not allowed: ${filePath}`);
-        }
-        
+        // No separate existence check, /api/model answers 404 or 403 itself
+        // and the loader's error callback reports it
         // Encode the file path to make it URL-safe
         const encodedPath = encodeURIComponent(filePath);
         const modelUrl = `/api/model/${encodedPath}`;
         console.log('Model URL:', modelUrl);
         
-        // Load the model
-        await loadModel(modelUrl, fileExtension);
+        // Show a decimated preview of STL models first, the server redirects
+        // to the full model when it is already small enough
+        if (fileExtension === 'stl') {
+          await loadModel(`/api/model-lod/${encodedPath}?triangles=100000`, fileExtension, modelUrl);
+        } else {
+          await loadModel(modelUrl, fileExtension);
+        }
       } catch (err) {
         console.error('Error checking file:', err);
         
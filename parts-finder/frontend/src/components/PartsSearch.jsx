@@ -140,10 +140,18 @@ window.PartsSearch = function PartsSearch() {
         })
       });
 
-      const data = await response.json();
+      let data = await response.json();
       
       if (data.error) throw new Error(data.error);
 
+      // The copy runs as a background job, poll it until it finishes
+      while (data.status === 'running' || data.status === 'pending') {
+        await new Promise(resolve => setTimeout(resolve, 1000));
+        const progress = await fetch(data.status_url || `/api/copy/${data.job_id}`);
+        data = { ...data, ...(await progress.json()) };
+        if (data.error) throw new Error(data.error);
+      }
+
       const successCount = data.results.filter(r => r.success).length;
       const failedFiles = data.results.filter(r => !r.success);
       
@@ -162,6 +170,28 @@ window.PartsSearch = function PartsSearch() {
     }
   };
 
+  const handleDownloadZip = () => {
+    if (selectedFiles.size === 0) {
+      setError('Please select files to download');
+      return;
+    }
+
+    // Submit a form so the browser streams the archive straight to disk
+    const form = document.createElement('form');
+    form.method = 'POST';
+    form.action = '/api/archive';
+    selectedFiles.forEach(path => {
+      const input = document.createElement('input');
+      input.type = 'hidden';
+      input.name = 'path';
+      input.value = path;
+      form.appendChild(input);
+    });
+    document.body.appendChild(form);
+    form.submit();
+    document.body.removeChild(form);
+  };
+
   const toggleFileSelection = (path) => {
     setSelectedFiles(prev => {
       const newSelected = new Set(prev);
@@ -379,9 +409,16 @@ window.PartsSearch = function PartsSearch() {
 
   // Add copy button and path selection to results container
   const copySection = selectedFiles.size > 0 && React.createElement('div', {
-    className: 'mt-4 p-4 border-t border-purple-200/20 dark:border-purple-800/20'
+    className: 'mt-4 p-4 border-t border-purple-200/20 dark:border-purple-800/20 flex gap-3'
   },
     React.createElement('button', {
+      key: 'download-zip',
+      onClick: handleDownloadZip,
+      className: `px-6 py-3 bg-blue-600 text-white rounded-lg hover:bg-blue-700 
+        transition-colors flex items-center gap-2 dark:bg-blue-500 dark:hover:bg-blue-600`
+    }, `Download Selected (${selectedFiles.size}) as ZIP`),
+    React.createElement('button', {
+      key: 'copy',
       onClick: handleCopy,
       disabled: loadingStates.copy,
       className: `px-6 py-3 bg-green-600 text-white rounded-lg hover:bg-green-700 
@@ -454,6 +491,10 @@ window.PartsSearch = function PartsSearch() {
                   key: 'size-header',
                   className: `px-6 py-3 text-left text-xs font-medium ${theme.textMuted} uppercase` 
                 }, 'Size'),
+                React.createElement('th', { 
+                  key: 'dimensions-header',
+                  className: `px-6 py-3 text-left text-xs font-medium ${theme.textMuted} uppercase` 
+                }, 'Dimensions'),
                 React.createElement('th', { 
                   key: 'modified-header',
                   className: `px-6 py-3 text-left text-xs font-medium ${theme.textMuted} uppercase` 
@@ -496,7 +537,20 @@ window.PartsSearch = function PartsSearch() {
                   React.createElement('td', { 
                     key: 'name-cell',
                     className: `px-6 py-4 whitespace-nowrap ${theme.text}` 
-                  }, file.name),
+                  },
+                    React.createElement('div', { className: 'flex items-center gap-3' }, [
+                      file.thumbnail
+                        ? React.createElement('img', {
+                            key: 'thumbnail',
+                            src: file.thumbnail,
+                            alt: '',
+                            loading: 'lazy',
+                            className: 'w-12 h-12 object-contain flex-shrink-0'
+                          })
+                        : React.createElement('div', { key: 'thumbnail', className: 'w-12 h-12 flex-shrink-0' }),
+                      React.createElement('span', { key: 'name' }, file.name)
+                    ])
+                  ),
                   React.createElement('td', { 
                     key: 'type-cell',
                     className: 'px-6 py-4 whitespace-nowrap' 
@@ -509,6 +563,13 @@ window.PartsSearch = function PartsSearch() {
                     key: 'size-cell',
                     className: `px-6 py-4 whitespace-nowrap text-sm ${theme.textMuted}` 
                   }, `${Math.round(file.size / 1024)} KB`),
+                  React.createElement('td', { 
+                    key: 'dimensions-cell',
+                    className: `px-6 py-4 whitespace-nowrap text-sm ${theme.textMuted}`,
+                    title: file.geometry ? `${file.geometry.triangles.toLocaleString()} triangles` : undefined
+                  }, file.geometry
+                    ? `${file.geometry.extent.map(value => Math.round(value)).join(' × ')} mm`
+                    : '—'),
                   React.createElement('td', { 
                     key: 'modified-cell',
                     className: `px-6 py-4 whitespace-nowrap text-sm ${theme.textMuted}` 
@@ -55,7 +55,7 @@ def run_application():
     os.chdir(BACKEND_DIR)
     
     # Import the app from the backend
-    from app import app
+    from app import app, start_indexer
     
     # Get the host and port from environment variables or use defaults
     host = os.environ.get('FLASK_HOST', '127.0.0.1')
@@ -73,7 +73,8 @@ def open_browser():
     browser_thread.daemon = True
     browser_thread.start()
     
-    # Run the Flask app
+    # Keep the file index current in the background, then run the Flask app
+    start_indexer()
     app.run(host=host, port=port)
 
 if __name__ == '__main__':